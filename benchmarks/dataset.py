@@ -0,0 +1,262 @@
+"""
+Generator syntetycznych danych Comarch ERP Optima (Towary, TwrCeny, KntOsoby, Rabaty) z historią zmian
+jak w tabelach temporalnych, do testów synchronizacji w skali produkcyjnej bez kopii bazy klienta.
+
+Wiersze nie są przechowywane: wartość każdej kolumny jest wyliczana deterministycznie z ziarna, ID rekordu
+i numeru wersji kolumny, a pamiętane są tylko zmiany (wersje, dodania, usunięcia). Dzięki temu zbiór
+z milionem towarów zajmuje niewiele pamięci, a stan z dowolnej chwili (FOR SYSTEM_TIME AS OF) jest dostępny.
+
+    dataset = Dataset(products=1_000_000, contractors=50_000, discounts=200_000)
+    dataset.apply_changes(update_rate=0.02, delete_rate=0.001, insert_rate=0.005)
+
+Zbiór można też wyeksportować do CSV (np. do BULK INSERT w testowej bazie):
+
+    python benchmarks/dataset.py --products 100000 --csv dane/
+"""
+import os
+import csv
+import argparse
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+NOUNS = ["Wiertarka", "Szlifierka", "Młotek", "Klucz", "Śrubokręt", "Piła", "Poziomica", "Obcęgi", "Taśma", "Farba",
+         "Kabel", "Przedłużacz", "Żarówka", "Gniazdko", "Wkręt", "Kołek", "Klej", "Silikon", "Pędzel", "Wałek"]
+ADJECTIVES = ["udarowa", "profesjonalna", "akumulatorowa", "stalowy", "nasadowy", "krzyżakowy", "ręczna", "laserowa",
+              "izolacyjna", "akrylowa", "miedziany", "zwijany", "LED", "podwójne", "ocynkowany", "rozporowy", "montażowy", "sanitarny"]
+BRANDS = ["Bosch", "Makita", "Stanley", "Yato", "Neo", "Topex", "Dedra", "Graphite", "Fiskars", "Śnieżka"]
+FIRST_NAMES = ["Jan", "Anna", "Piotr", "Katarzyna", "Tomasz", "Małgorzata", "Paweł", "Agnieszka", "Michał", "Barbara",
+               "Krzysztof", "Ewa", "Andrzej", "Magdalena", "Łukasz", "Joanna", "Marcin", "Zofia", "Grzegorz", "Aleksandra"]
+LAST_NAMES = ["Nowak", "Kowalski", "Wiśniewski", "Wójcik", "Kowalczyk", "Kamiński", "Lewandowski", "Zieliński", "Szymański",
+              "Woźniak", "Dąbrowski", "Kozłowski", "Jankowski", "Mazur", "Kwiatkowski", "Krawczyk", "Piotrowski", "Grabowski"]
+DOMAINS = ["example.com", "firma.pl", "poczta.example.pl", "sklep.example.com"]
+# Opisy HTML od jednego do sześciu akapitów
+DESCRIPTIONS = [
+    " ".join(f"<p>{NOUNS[(n + k) % len(NOUNS)]} {ADJECTIVES[(n * 7 + k) % len(ADJECTIVES)]} o wysokiej jakości, do prac w domu i warsztacie. Gwarancja {12 * (1 + k % 3)} miesięcy.</p>" for k in range(1 + n % 6))
+    for n in range(512)
+]
+ASCII = str.maketrans("ąćęłńóśźżĄĆĘŁŃÓŚŹŻ", "acelnoszzACELNOSZZ")
+ROUNDINGS = [Decimal("0.01")] * 8 + [Decimal("0.10"), Decimal("1.00")]
+# Typy rabatów z udziałem jak w typowej bazie: na towar dla kontrahenta (6, 13), na towar dla wszystkich (8, 11)
+# i ogólne dla kontrahenta (2, bez towaru - pomijane przez złączenie z TowarIDs)
+DISCOUNT_TYPES = [6] * 8 + [13] * 4 + [8] * 3 + [11] * 2 + [2] * 2
+# Rabaty na grupy towarów lub kontrahentów, których synchronizacja nie obsługuje
+GROUP_DISCOUNT_TYPES = [3, 4]
+
+def mix(*values: int) -> int:
+    """
+    Deterministyczny 64-bitowy skrót liczb całkowitych, używany zamiast generatora losowego, by wartość kolumny
+    zależała tylko od (ziarno, ID, wersja). Skrót krotki liczb całkowitych nie zależy od PYTHONHASHSEED.
+    """
+    return hash(values) & 0xFFFFFFFFFFFFFFFF
+
+class Table:
+    """
+    Tabela z historią: rekordy 1..initial_count istnieją od `created_at`, a pozostałe zmiany są zapisane jako
+    wersje {id: [(ValidFrom, indeks zmienionej kolumny)]}, dodania {id: ValidFrom} i usunięcia {id: ValidTo}.
+
+    Args:
+        columns: Kolumny tabeli, pierwsza to ID.
+        generate: Funkcja (id, wersje kolumn) -> krotka wartości kolumn.
+        changeable: Indeksy kolumn, które mogą się zmieniać.
+    """
+    def __init__(self, name: str, columns: tuple, generate, changeable: tuple, initial_count: int, created_at: datetime):
+        self.name = name
+        self.columns = columns
+        self.generate = generate
+        self.changeable = changeable
+        self.initial_count = initial_count
+        self.created_at = created_at
+        self.next_id = initial_count + 1
+        self.versions = {}
+        self.inserted = {}
+        self.deleted = {}
+
+    def exists(self, record_id: int, at: datetime = None) -> bool:
+        created = self.created_at if record_id <= self.initial_count else self.inserted.get(record_id)
+        if created is None or (at is not None and created > at):
+            return False
+        removed = self.deleted.get(record_id)
+        return removed is None or (at is not None and removed > at)
+
+    def ids(self, at: datetime = None):
+        """
+        ID rekordów istniejących w chwili `at` (domyślnie teraz), rosnąco.
+        """
+        for record_id in range(1, self.next_id):
+            if self.exists(record_id, at):
+                yield record_id
+
+    def row(self, record_id: int, at: datetime = None) -> tuple | None:
+        """
+        Wartości kolumn rekordu w chwili `at` (domyślnie teraz) lub None, jeżeli rekord wtedy nie istniał.
+        """
+        if not self.exists(record_id, at):
+            return None
+        column_versions = [0] * len(self.columns)
+        for valid_from, column in self.versions.get(record_id, ()):
+            if at is None or valid_from <= at:
+                column_versions[column] += 1
+        return self.generate(record_id, column_versions)
+
+    def changed_ids(self, since: datetime, until: datetime) -> set:
+        """
+        ID rekordów zmienionych lub dodanych w przedziale (since, until].
+        """
+        changed = {record_id for record_id, versions in self.versions.items() if any(since < valid_from <= until for valid_from, _ in versions)}
+        changed.update(record_id for record_id, created in self.inserted.items() if since < created <= until)
+        return changed
+
+    def deleted_ids(self, since: datetime, until: datetime) -> set:
+        """
+        ID rekordów usuniętych w przedziale (since, until] (ValidTo ostatniej wersji w tabeli historii).
+        """
+        return {record_id for record_id, removed in self.deleted.items() if since < removed <= until}
+
+    def update(self, record_id: int, at: datetime, seed: int):
+        column = self.changeable[mix(seed, record_id, len(self.versions.get(record_id, ())), 7) % len(self.changeable)]
+        self.versions.setdefault(record_id, []).append((at, column))
+
+    def insert(self, at: datetime) -> int:
+        record_id = self.next_id
+        self.next_id += 1
+        self.inserted[record_id] = at
+        return record_id
+
+    def delete(self, record_id: int, at: datetime):
+        self.deleted[record_id] = at
+
+class Dataset:
+    """
+    Syntetyczna baza Optima: `products` towarów z `price_types` cenami każdy (TwC_Typ 1..price_types),
+    `contractors` osób kontrahentów i `discounts` rabatów.
+
+    Args:
+        missing_email_rate: Odsetek kontrahentów bez e-maila (mapowanie takiego kontrahenta kończy się błędem).
+        group_discount_rate: Odsetek rabatów na grupy (nieobsługiwanych, mapowanie kończy się błędem).
+        free_rate: Odsetek towarów z ceną 0 (pomijanych bez --obejmuj-darmowe-towary).
+        seed: Ziarno - ten sam zestaw argumentów daje zawsze te same dane.
+    """
+    def __init__(self, products: int = 10000, contractors: int = 2000, discounts: int = 5000, price_types: int = 4,
+                 missing_email_rate: float = 0.0, group_discount_rate: float = 0.0, free_rate: float = 0.01, seed: int = 1, start: datetime = None):
+        self.seed = seed
+        self.price_types = price_types
+        self.missing_email_rate = missing_email_rate
+        self.group_discount_rate = group_discount_rate
+        self.free_rate = free_rate
+        self.clock = start or datetime(2025, 1, 1, 8, 0, 0)
+        self.towary = Table("Towary", ("Twr_TwrId", "Twr_Nazwa", "Twr_Opis"), self.__towar, (1, 2), products, self.clock)
+        self.twr_ceny = Table("TwrCeny", ("TwC_TwCID", "TwC_TwrID", "TwC_Typ", "TwC_Wartosc", "TwC_Zaokraglenie"), self.__cena, (3, 3, 3, 4), products * price_types, self.clock)
+        self.knt_osoby = Table("KntOsoby", ("KnO_KnOId", "KnO_KntId", "KnO_Nazwisko", "KnO_Email"), self.__osoba, (2, 3, 3), contractors, self.clock)
+        self.rabaty = Table("Rabaty", ("Rab_RabId", "Rab_Typ", "Rab_TwrId", "Rab_PodmiotTyp", "Rab_PodmiotId", "Rab_Rabat", "Rab_Cena", "Rab_DataOd", "Rab_DataDo"), self.__rabat, (5, 5, 8), discounts, self.clock)
+        self.tables = {table.name: table for table in (self.towary, self.twr_ceny, self.knt_osoby, self.rabaty)}
+        self.clock += timedelta(minutes=1)
+
+    def now(self) -> datetime:
+        """
+        Bieżący czas bazy (SYSUTCDATETIME). Każde wywołanie przesuwa zegar o sekundę, tak jak upływa czas między synchronizacjami.
+        """
+        self.clock += timedelta(seconds=1)
+        return self.clock
+
+    # Generatory wierszy: (id, wersje kolumn) -> krotka
+    def __towar(self, twr_id: int, versions: list) -> tuple:
+        h = mix(self.seed, 1, twr_id, versions[1])
+        name = f"{NOUNS[h % len(NOUNS)]} {ADJECTIVES[(h >> 8) % len(ADJECTIVES)]} {BRANDS[(h >> 16) % len(BRANDS)]} {twr_id:07d}"
+        if versions[1]:
+            name += f" ({versions[1] + 1}. gen.)"
+        h = mix(self.seed, 2, twr_id, versions[2])
+        description = None if h % 10 == 0 else DESCRIPTIONS[(h >> 4) % len(DESCRIPTIONS)]
+        return (twr_id, name, description)
+
+    def __cena(self, twc_id: int, versions: list) -> tuple:
+        twr_id = (twc_id - 1) // self.price_types + 1
+        typ = (twc_id - 1) % self.price_types + 1
+        free = mix(self.seed, 3, twr_id) % 10000 < self.free_rate * 10000
+        h = mix(self.seed, 4, twc_id, versions[3])
+        value = Decimal(0) if free else Decimal(100 + h % 500000) / 100
+        return (twc_id, twr_id, typ, value, ROUNDINGS[mix(self.seed, 5, twc_id, versions[4]) % len(ROUNDINGS)])
+
+    def __osoba(self, kno_id: int, versions: list) -> tuple:
+        h = mix(self.seed, 6, kno_id, versions[2])
+        first, last = FIRST_NAMES[h % len(FIRST_NAMES)], LAST_NAMES[(h >> 8) % len(LAST_NAMES)]
+        # Część osób ma w nazwisku tylko jeden człon (np. nazwa działu)
+        full_name = first if (h >> 16) % 50 == 0 else f"{first} {last}"
+        h = mix(self.seed, 7, kno_id, versions[3])
+        if h % 10000 < self.missing_email_rate * 10000:
+            email = None
+        else:
+            email = f"{first}.{last}{kno_id}".lower().translate(ASCII) + (f".{versions[3]}" if versions[3] else "") + f"@{DOMAINS[(h >> 8) % len(DOMAINS)]}"
+        return (kno_id, (kno_id - 1) // 2 + 1, full_name, email)
+
+    def __rabat(self, rab_id: int, versions: list) -> tuple:
+        h = mix(self.seed, 8, rab_id)
+        if h % 10000 < self.group_discount_rate * 10000:
+            typ = GROUP_DISCOUNT_TYPES[(h >> 4) % len(GROUP_DISCOUNT_TYPES)]
+        else:
+            typ = DISCOUNT_TYPES[(h >> 4) % len(DISCOUNT_TYPES)]
+        twr_id = None if typ in (1, 2) else (h >> 12) % max(1, self.towary.initial_count) + 1
+        podmiot = None if typ in (7, 8, 11) else (h >> 36) % max(1, self.knt_osoby.initial_count // 2) + 1
+        rabat = Decimal(1 + mix(self.seed, 9, rab_id, versions[5]) % 50)
+        h = mix(self.seed, 10, rab_id, versions[8])
+        date_to = None if h % 4 else datetime(2026, 1, 1) + timedelta(days=h % 365)
+        return (rab_id, typ, twr_id, 1, podmiot, rabat, Decimal(0), None, date_to)
+
+    def price_id(self, twr_id: int, typ: int) -> int:
+        return (twr_id - 1) * self.price_types + typ
+
+    def apply_changes(self, update_rate: float = 0.01, delete_rate: float = 0.0, insert_rate: float = 0.0, at: datetime = None) -> datetime:
+        """
+        Wprowadza zmiany jak między dwiema synchronizacjami: zmienia `update_rate` istniejących rekordów każdej tabeli
+        (jedna kolumna na zmianę), usuwa `delete_rate` towarów, kontrahentów i rabatów (z cenami usuwanych towarów)
+        i dodaje `insert_rate` nowych (towary z kompletem cen). Zwraca czas zmian (ValidFrom / ValidTo).
+        """
+        at = at or self.now()
+        round_seed = mix(self.seed, 11, int(at.timestamp()))
+        for table in self.tables.values():
+            existing = table.next_id - 1
+            for n in range(int(existing * update_rate)):
+                record_id = mix(round_seed, 12, n, len(table.name)) % existing + 1
+                if table.exists(record_id):
+                    table.update(record_id, at, self.seed)
+
+        for table in (self.towary, self.knt_osoby, self.rabaty):
+            existing = table.next_id - 1
+            for n in range(int(existing * delete_rate)):
+                record_id = mix(round_seed, 13, n, len(table.name)) % existing + 1
+                if not table.exists(record_id):
+                    continue
+                table.delete(record_id, at)
+                if table is self.towary:
+                    for typ in range(1, self.price_types + 1):
+                        self.twr_ceny.delete(self.price_id(record_id, typ), at)
+            for _ in range(int(existing * insert_rate)):
+                record_id = table.insert(at)
+                if table is self.towary:
+                    for typ in range(1, self.price_types + 1):
+                        price_id = self.twr_ceny.insert(at)
+                        assert price_id == self.price_id(record_id, typ)
+
+        self.clock = max(self.clock, at) + timedelta(seconds=1)
+        return at
+
+    def export_csv(self, directory: str):
+        """
+        Zapisuje bieżący stan tabel do plików <tabela>.csv w katalogu `directory`.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for table in self.tables.values():
+            with open(os.path.join(directory, f"{table.name}.csv"), "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(table.columns)
+                writer.writerows(table.row(record_id) for record_id in table.ids())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generator syntetycznych danych Comarch ERP Optima.")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--contractors", type=int, default=2000)
+    parser.add_argument("--discounts", type=int, default=5000)
+    parser.add_argument("--price-types", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--csv", required=True, help="Katalog, do którego zostaną zapisane pliki CSV.")
+    args = parser.parse_args()
+    Dataset(args.products, args.contractors, args.discounts, args.price_types, seed=args.seed).export_csv(args.csv)
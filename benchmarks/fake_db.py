@@ -0,0 +1,305 @@
+"""
+Baza danych w pamięci udająca MSSQL z tabelami Comarch ERP Optima na potrzeby benchmarków.
+
+Zapytania są rozpoznawane po znaczniku /* ERPFlow:<nazwa> */ dodawanym przez `sql.execute`, więc synchronizacja
+(`generic_sync`, funkcje mapujące, zapis mapowań przez `save_id_mappings`) działa bez zmian. Zamiast SQL wykonywana
+jest odpowiadająca zapytaniu funkcja w Pythonie. Nieznane zapytanie zgłasza `pyodbc.ProgrammingError`.
+
+Dane tabel CDN pochodzą z `dataset.Dataset` (z historią zmian), więc obsługiwana jest zarówno pełna, jak i przyrostowa
+synchronizacja przez temporal tables (zapytania *.incremental, changes.<tabela>, wykrywanie usunięć po ValidTo).
+
+    database = FakeDatabase(Dataset(products=1_000_000, contractors=50_000, discounts=200_000))
+    install(database)  # connections.cursor / connections.conn wskazują na tę bazę
+"""
+import re
+import json
+import itertools
+import threading
+from collections import namedtuple
+from datetime import datetime
+import pyodbc
+import connections as con
+import sql
+from dataset import Dataset
+
+TAG_PATTERN = re.compile(r"/\* " + sql.QUERY_TAG + r":([\w.\-]+) \*/")
+# Kolumny porównywane przez get_changed_columns(_bulk): ... AS [nowa_<kolumna>]
+CHANGED_COLUMN_PATTERN = re.compile(r"\[nowa_(\w+)\]")
+
+# Tabele mapowań i kolumny ID encji: {prefiks nazwy zapytania: (tabela CDN, kolumna ID, tabela mapowań)}
+ENTITIES = {
+    "products": ("Towary", "Twr_TwrId", "TowarIDs"),
+    "contractors": ("KntOsoby", "KnO_KnOId", "KontrahenciIDs"),
+}
+
+PRODUCT_COLUMNS = ("Twr_TwrId", "Twr_Nazwa", "Twr_Opis", "TwC_Wartosc", "TwC_Zaokraglenie")
+CONTRACTOR_COLUMNS = ("KnO_KnOId", "KnO_KntId", "KnO_Nazwisko", "KnO_Email")
+DISCOUNT_COLUMNS = ("Rab_RabId", "Rab_Typ", "Rab_TwrId", "WC_ID", "Rab_PodmiotId", "Rab_Rabat", "Rab_Cena", "Rab_DataOd", "Rab_DataDo")
+
+__row_types = {}
+def row_type(columns: tuple):
+    """
+    Typ wiersza z dostępem po indeksie i po nazwie kolumny (jak pyodbc.Row).
+    """
+    result = __row_types.get(columns)
+    if result is None:
+        result = __row_types[columns] = namedtuple("Row", columns)
+    return result
+
+class FakeDatabase:
+    """
+    Tabele Towary, TwrCeny, KntOsoby, Rabaty z `dataset` i tabele mapowań ERPFlow ({db_id: [api_id, hash]}).
+    Zapytania są wykonywane pod jedną blokadą, więc z bazy mogą korzystać równolegle różne połączenia;
+    wiersze wyników są generowane leniwie przy pobieraniu (fetchmany), jak z kursora po stronie serwera.
+    """
+    def __init__(self, dataset: Dataset = None):
+        self.lock = threading.RLock()
+        self.dataset = dataset or Dataset()
+        self.mappings = {table: {} for _, _, table in ENTITIES.values()}
+        self.handlers = {
+            "sync.start": self.sync_start,
+            "setup.is_temporal_enabled": lambda query, params: [(1,)],
+            "setup.is_change_tracking_enabled": lambda query, params: [],
+            "checkpoints.exists": lambda query, params: [(None,)],
+            "mappings.has_payload_hash": lambda query, params: [(32,)],
+            "products.full": self.products,
+            "products.incremental": self.products,
+            "contractors.full": self.contractors,
+            "contractors.incremental": self.contractors,
+            "discounts.full": self.discounts,
+            "discounts.incremental": self.discounts,
+        }
+
+    def execute(self, connection: "FakeConnection", query: str, params: tuple) -> tuple[tuple, list]:
+        """
+        Wykonuje zapytanie i zwraca (kolumny, wiersze).
+        """
+        match = TAG_PATTERN.match(query.lstrip())
+        if match is None:
+            return self.execute_untagged(connection, query, params)
+        name = match.group(1)
+        with self.lock:
+            handler = self.handlers.get(name)
+            if handler is not None:
+                return self.__result(handler(query, params))
+            parts = name.split(".")
+            if parts[0] == "mappings":
+                return self.__result(self.mapping_query(connection, parts[1], parts[2], params))
+            if parts[0] == "changes" and parts[1] in self.dataset.tables:
+                return self.__result(self.changed_columns(query, parts[1], params, single=parts[-1] == "record"))
+            if parts[-1] == "deleted" and parts[0] in ENTITIES:
+                return self.__result(self.deleted(parts[0], params))
+        raise pyodbc.ProgrammingError(f"FakeDatabase: nieobsługiwane zapytanie '{name}'")
+
+    def __result(self, result) -> tuple[tuple, list]:
+        # Funkcje zwracają (kolumny, wartości) albo same wartości (dostęp tylko po indeksie)
+        if isinstance(result, tuple):
+            return result
+        return (), result
+
+    def execute_untagged(self, connection: "FakeConnection", query: str, params: tuple) -> tuple[tuple, list]:
+        """
+        Zapytania bez znacznika: sprawdzenie połączenia i tabela tymczasowa #ERPFlowMapowania z `save_id_mappings`.
+        """
+        statement = " ".join(query.split())
+        if statement == "SELECT 1":
+            return (), [(1,)]
+        if "#ERPFlowMapowania" in statement:
+            if statement.startswith(("CREATE TABLE", "IF OBJECT_ID", "DROP TABLE")):
+                connection.temp_mappings = []
+                return (), []
+            if statement.startswith("INSERT INTO"):
+                connection.temp_mappings.append(tuple(params) + (None,) * (3 - len(params)))
+                return (), []
+        raise pyodbc.ProgrammingError(f"FakeDatabase: nieobsługiwane zapytanie '{statement[:60]}'")
+
+    def sync_start(self, query, params):
+        return [(self.dataset.now(), None)]
+
+    def __window(self, params) -> tuple[datetime, datetime] | None:
+        # Zapytania przyrostowe: FOR SYSTEM_TIME BETWEEN <ostatnia synchronizacja> AND <początek bieżącej>
+        return (params[0], params[1]) if params else None
+
+    def products(self, query, params):
+        """
+        Towary z ceną typu 2 - wszystkie lub (w trybie przyrostowym) zmienione w Towary albo w cenie typu 2.
+        """
+        dataset, window = self.dataset, self.__window(params)
+        if window is None:
+            ids = dataset.towary.ids()
+        else:
+            changed = dataset.towary.changed_ids(*window)
+            changed.update((price_id - 1) // dataset.price_types + 1 for price_id in dataset.twr_ceny.changed_ids(*window) if (price_id - 1) % dataset.price_types + 1 == 2)
+            ids = sorted(twr_id for twr_id in changed if dataset.towary.exists(twr_id))
+
+        def rows():
+            for twr_id in ids:
+                price = dataset.twr_ceny.row(dataset.price_id(twr_id, 2))
+                if price is not None:
+                    towar = dataset.towary.row(twr_id)
+                    yield (twr_id, towar[1], towar[2], price[3], price[4])
+        return PRODUCT_COLUMNS, rows()
+
+    def contractors(self, query, params):
+        table, window = self.dataset.knt_osoby, self.__window(params)
+        ids = table.ids() if window is None else sorted(kno_id for kno_id in table.changed_ids(*window) if table.exists(kno_id))
+        return CONTRACTOR_COLUMNS, (table.row(kno_id) for kno_id in ids)
+
+    def discounts(self, query, params):
+        """
+        Rabaty dla kontrahentów (Rab_PodmiotTyp = 1) złączone z TowarIDs (WC_ID towaru).
+        """
+        table, window = self.dataset.rabaty, self.__window(params)
+        ids = table.ids() if window is None else sorted(rab_id for rab_id in table.changed_ids(*window) if table.exists(rab_id))
+        product_ids = dict(self.mappings["TowarIDs"])
+
+        def rows():
+            for rab_id in ids:
+                rabat = table.row(rab_id)
+                if rabat[3] == 1 and rabat[2] in product_ids:
+                    yield (*rabat[:3], product_ids[rabat[2]][0], *rabat[4:])
+        return DISCOUNT_COLUMNS, rows()
+
+    def __record_ids(self, table_name: str, id_column: str, record_id: int, filters: tuple) -> list[int]:
+        # ID wierszy tabeli odpowiadających ID z zapytania; ceny są wyszukiwane po TwC_TwrID (i TwC_Typ z filtra)
+        if table_name == "TwrCeny" and id_column == "TwC_TwrID":
+            types = filters or range(1, self.dataset.price_types + 1)
+            return [self.dataset.price_id(record_id, typ) for typ in types]
+        return [record_id]
+
+    def changed_columns(self, query: str, table_name: str, params, single: bool):
+        """
+        Stan rekordów teraz (nowa_*) i w chwili ostatniej synchronizacji (stara_*, FOR SYSTEM_TIME AS OF),
+        dla `get_changed_columns` (`single`) lub paczki ID z `get_changed_columns_bulk`.
+        """
+        table = self.dataset.tables[table_name]
+        columns = CHANGED_COLUMN_PATTERN.findall(query)
+        id_column = re.search(r"t_now\.\[(\w+)\] = ", query).group(1)
+        if single:
+            last_sync, record_ids, filters = params[0], [params[1]], ()
+        else:
+            record_ids, last_sync, filters = json.loads(params[0]), params[1], params[2:]
+        indexes = [table.columns.index(column) for column in columns]
+
+        output_columns = ("id_rekordu",) + tuple(f"{prefix}_{column}" for column in columns for prefix in ("nowa", "stara"))
+        values = []
+        for record_id in record_ids:
+            for row_id in self.__record_ids(table_name, id_column, record_id, filters):
+                now = table.row(row_id)
+                if now is None:
+                    continue
+                old = table.row(row_id, last_sync)
+                values.append((record_id, *(value for index in indexes for value in (now[index], old[index] if old else None))))
+        if single:
+            return output_columns[1:], [value[1:] for value in values[:1]]
+        return output_columns, values
+
+    def deleted(self, entity: str, params):
+        """
+        Zmapowane rekordy, których nie ma już w tabeli: usunięte w oknie (ValidTo) synchronizacji przyrostowej
+        albo (pełna synchronizacja) wszystkie (anti-join z `get_deleted_query`).
+        """
+        table_name, _, mapping_table = ENTITIES[entity]
+        table, mappings = self.dataset.tables[table_name], self.mappings[mapping_table]
+        window = self.__window(params)
+        candidates = mappings if window is None else table.deleted_ids(*window)
+        return [(db_id, mappings[db_id][0]) for db_id in candidates if db_id in mappings and not table.exists(db_id)]
+
+    def mapping_query(self, connection: "FakeConnection", table: str, operation: str, params):
+        mappings = self.mappings[table]
+        if operation == "clear":
+            mappings.clear()
+            return []
+        if operation == "load":
+            return [(db_id, api_id) for db_id, (api_id, _) in mappings.items()]
+        if operation == "hashes":
+            return [(db_id, payload_hash) for db_id, (_, payload_hash) in mappings.items() if payload_hash is not None]
+        if operation == "unassign":
+            sources = {api_id: db_id for db_id, api_id, _ in connection.temp_mappings}
+            for db_id in [db_id for db_id, (api_id, _) in mappings.items() if api_id in sources and sources[api_id] != db_id]:
+                del mappings[db_id]
+            return []
+        if operation == "merge":
+            actions = []
+            for db_id, api_id, payload_hash in connection.temp_mappings:
+                actions.append(("UPDATE" if db_id in mappings else "INSERT",))
+                mappings[db_id] = [api_id, payload_hash]
+            return actions
+        if operation == "remove":
+            removed = set(json.loads(params[0]))
+            for db_id in [db_id for db_id, (api_id, _) in mappings.items() if api_id in removed]:
+                del mappings[db_id]
+            return []
+        if operation == "prune":
+            kept = set(json.loads(params[0]))
+            for db_id in [db_id for db_id in mappings if db_id not in kept]:
+                del mappings[db_id]
+            return []
+        raise pyodbc.ProgrammingError(f"FakeDatabase: nieobsługiwana operacja na mapowaniach '{operation}'")
+
+class FakeCursor:
+    """
+    Kursor zgodny z używaną częścią pyodbc.Cursor: execute, executemany, fetchone, fetchmany, fetchall.
+    """
+    def __init__(self, connection: "FakeConnection"):
+        self.connection = connection
+        self.fast_executemany = False
+        self.rows = iter(())
+
+    def setinputsizes(self, sizes):
+        pass
+
+    def execute(self, query: str, params=()):
+        columns, values = self.connection.database.execute(self.connection, query, tuple(params or ()))
+        make_row = row_type(columns)._make if columns else tuple
+        self.rows = map(make_row, values)
+        return self
+
+    def executemany(self, query: str, rows):
+        for params in rows:
+            self.connection.database.execute(self.connection, query, tuple(params))
+
+    def fetchone(self):
+        return next(self.rows, None)
+
+    def fetchmany(self, size: int = 1):
+        return list(itertools.islice(self.rows, size))
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def close(self):
+        self.rows = iter(())
+
+class FakeConnection:
+    """
+    Połączenie z `FakeDatabase`. Tabela tymczasowa #ERPFlowMapowania należy do połączenia, tak jak w MSSQL.
+    """
+    def __init__(self, database: FakeDatabase):
+        self.database = database
+        self.autocommit = True
+        self.temp_mappings = []
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+def install(database: FakeDatabase):
+    """
+    Podmienia połączenia z bazą danych w module `connections` na połączenia z `database`
+    (główne połączenie, połączenia wątków z `thread_connection` i strumieniowe z `open_database_connection`).
+    """
+    def open_database_connection():
+        connection = FakeConnection(database)
+        return connection.cursor(), connection
+
+    con.open_database_connection = open_database_connection
+    con.reconnect_database()
@@ -0,0 +1,257 @@
+"""
+Benchmark synchronizacji: products.sync, contractors.sync i discounts.sync na bazie w pamięci (`fake_db`)
+przeciwko lokalnemu zamiennikowi API (`stub_server`, osobny proces).
+
+Dla każdej encji raportuje liczbę elementów na sekundę, medianę i 99. percentyl czasu odpowiedzi partii
+oraz szczytowe zużycie pamięci (RSS) procesu synchronizacji, i porównuje wyniki z zapisanym punktem odniesienia.
+
+    python benchmarks/run.py --products 20000 --contractors 5000 --discounts 10000 --latency-ms 50
+    python benchmarks/run.py --save-baseline   # zapisuje wyniki jako punkt odniesienia
+
+W scenariuszu przyrostowym (--scenario incremental) najpierw wykonywana jest niemierzona pełna synchronizacja,
+potem w danych (`dataset.Dataset`) zmieniana, usuwana i dodawana jest część rekordów (--update-rate, --delete-rate,
+--insert-rate), a mierzona jest synchronizacja przyrostowa przez temporal tables:
+
+    python benchmarks/run.py --products 1000000 --scenario incremental --update-rate 0.01
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS_DIR), "src"))
+
+import stub_server
+import fake_db
+from dataset import Dataset
+import connections as con
+import comarch_client as db
+import http_client
+import scheduler
+import logger as log
+import products
+import contractors
+import discounts
+
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, "baseline.json")
+
+# Wskaźniki porównywane z punktem odniesienia: (nazwa, czy większa wartość jest lepsza)
+COMPARED = [
+    ("items_per_second", True),
+    ("p50_ms", False),
+    ("p99_ms", False),
+    ("peak_rss_mb", False),
+]
+
+def peak_rss_mb() -> float | None:
+    """
+    Szczytowe zużycie pamięci (RSS) bieżącego procesu w MB lub None, jeżeli nie można go odczytać.
+    """
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 1024 / 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux podaje wartość w KB, macOS w bajtach
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+def percentile(values: list[float], fraction: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def start_stub_server(args) -> tuple[subprocess.Popen, str]:
+    """
+    Uruchamia `stub_server.py` w osobnym procesie (by jego pamięć nie była liczona do RSS synchronizacji)
+    i zwraca (proces, adres).
+    """
+    command = [
+        sys.executable, os.path.join(BENCHMARKS_DIR, "stub_server.py"), "--port", "0",
+        "--latency-ms", str(args.latency_ms), "--per-item-ms", str(args.per_item_ms), "--jitter-ms", str(args.jitter_ms),
+        "--rate-limit", str(args.rate_limit), "--error-rate", str(args.error_rate), "--max-body-kb", str(args.max_body_kb),
+        "--seed", str(args.seed),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    url = process.stdout.readline().strip()
+    if not url.startswith("http"):
+        process.kill()
+        raise RuntimeError("Nie udało się uruchomić serwera stub_server.py.")
+    return process, url
+
+def get_server_stats(url: str) -> dict:
+    return http_client.get_session(url).get(f"{url}/__stats", timeout=10).json()
+
+def setup_environment(url: str, state_file: str):
+    """
+    Kieruje synchronizację na zamiennik API i bazę w pamięci (zamiast połączeń tworzonych przez `connections` przy pierwszym użyciu).
+    """
+    os.environ.setdefault("database_name", "ERPFlowBenchmark")
+    os.environ["woocommerce_store_url"] = url
+    db.SYNC_STATE_FILE = state_file
+    db.load_sync_state()
+    # Zamiennik działa po HTTP, ale klienci uwierzytelniają się jak przy HTTPS (Basic), bez podpisu OAuth
+    con.wcapi = http_client.ApiClient(url, "wc/v3", auth=("benchmark", "benchmark"))
+    con.wpapi = http_client.ApiClient(url, "wp/v2", auth=("benchmark", "benchmark"))
+    con.efapi = http_client.ApiClient(url, "erp-flow/v1", auth=("benchmark", "benchmark"))
+
+def run_entity(name: str, sync_func, url: str, latencies: list) -> dict:
+    """
+    Uruchamia synchronizację jednej encji i zwraca jej wyniki.
+    """
+    before = get_server_stats(url)
+    latencies.clear()
+    started = time.perf_counter()
+    # Tak jak w main.sync_all: encja w osobnym wątku z własnym połączeniem z bazą
+    success = scheduler.run_tasks({name: (sync_func, [])}).get(name, False)
+    elapsed = time.perf_counter() - started
+    batch_latencies = list(latencies)
+    after = get_server_stats(url)
+
+    items = after["items"] - before["items"]
+    statuses = {status: count - before["statuses"].get(status, 0) for status, count in after["statuses"].items()}
+    p50 = percentile(batch_latencies, 0.5)
+    p99 = percentile(batch_latencies, 0.99)
+    rss = peak_rss_mb()
+    return {
+        "success": bool(success),
+        "seconds": round(elapsed, 3),
+        "items": items,
+        "item_errors": after["item_errors"] - before["item_errors"],
+        "requests": after["requests"] - before["requests"],
+        "statuses": {status: count for status, count in statuses.items() if count},
+        "items_per_second": round(items / elapsed, 1) if elapsed > 0 else None,
+        "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+        "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+        "peak_rss_mb": round(rss, 1) if rss is not None else None,
+    }
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Porównuje wyniki z punktem odniesienia. Zwraca opisy pogorszeń większych niż `tolerance` (np. 0.2 = 20%).
+    """
+    regressions = []
+    for entity, result in results.items():
+        reference = baseline.get("results", {}).get(entity)
+        if not reference:
+            continue
+        for metric, higher_is_better in COMPARED:
+            value, expected = result.get(metric), reference.get(metric)
+            if value is None or not expected:
+                continue
+            change = (value - expected) / expected
+            worse = -change if higher_is_better else change
+            print(f"  {entity:<12}{metric:<18}{expected:>10} -> {value:<10} ({change:+.1%})")
+            if worse > tolerance:
+                regressions.append(f"{entity}: {metric} {expected} -> {value} ({change:+.1%})")
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark synchronizacji ERPFlow z lokalnym zamiennikiem WooCommerce / WordPress.")
+    parser.add_argument("--products", type=int, default=5000, help="Liczba towarów. Domyślnie 5000.")
+    parser.add_argument("--contractors", type=int, default=1000, help="Liczba kontrahentów. Domyślnie 1000.")
+    parser.add_argument("--discounts", type=int, default=2000, help="Liczba rabatów. Domyślnie 2000.")
+    parser.add_argument("--price-types", type=int, default=4, help="Liczba cen (TwC_Typ) każdego towaru. Domyślnie 4.")
+    parser.add_argument("--scenario", default="full", choices=["full", "incremental"], help="Mierzona synchronizacja: pełna lub przyrostowa po zmianach w danych. Domyślnie full.")
+    parser.add_argument("--update-rate", type=float, default=0.01, help="Scenariusz incremental: odsetek zmienianych rekordów każdej tabeli. Domyślnie 0.01.")
+    parser.add_argument("--delete-rate", type=float, default=0.001, help="Scenariusz incremental: odsetek usuwanych towarów, kontrahentów i rabatów. Domyślnie 0.001.")
+    parser.add_argument("--insert-rate", type=float, default=0.001, help="Scenariusz incremental: odsetek dodawanych towarów, kontrahentów i rabatów. Domyślnie 0.001.")
+    parser.add_argument("--entities", default="products,contractors,discounts", help="Synchronizowane encje, po przecinku (rabaty wymagają towarów).")
+    parser.add_argument("--contractors-api", default="wp", choices=["wp", "wc"], help="API kontrahentów (jak --kontrahenci-api).")
+    parser.add_argument("--streaming", action="store_true", help="Tryb strumieniowy (jak --strumieniowo).")
+    parser.add_argument("--client-rate-limit", type=float, default=0, help="Limit żądań na sekundę po stronie synchronizacji (api_rate_limit, 0 - bez limitu). Domyślnie 0.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Plik z punktem odniesienia (JSON).")
+    parser.add_argument("--save-baseline", action="store_true", help="Zapisuje wyniki jako nowy punkt odniesienia.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Dopuszczalne pogorszenie względem punktu odniesienia (0.2 = 20%%).")
+    parser.add_argument("--output", help="Zapisuje wyniki do pliku JSON.")
+    parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    stub_server.add_arguments(parser)
+    args = parser.parse_args()
+    log.set_log_level(args.log_level)
+    os.environ["api_rate_limit"] = str(args.client_rate_limit)
+
+    entities = [entity.strip() for entity in args.entities.split(",") if entity.strip()]
+    sync_funcs = {
+        "products": lambda: products.sync(add_all=False, skip_free=False, force=False, streaming=args.streaming),
+        "contractors": lambda: contractors.sync(add_all=False, force=False, transport=args.contractors_api, streaming=args.streaming),
+        "discounts": lambda: discounts.sync(add_all=False, skip_free=False, force=False, streaming=args.streaming),
+    }
+    unknown = [entity for entity in entities if entity not in sync_funcs]
+    if unknown:
+        parser.error(f"Nieznane encje: {', '.join(unknown)}")
+
+    server, url = start_stub_server(args)
+    state_dir = tempfile.TemporaryDirectory(prefix="erpflow-benchmark-")
+    try:
+        setup_environment(url, os.path.join(state_dir.name, "sync_state.json"))
+
+        database = fake_db.FakeDatabase(Dataset(args.products, args.contractors, args.discounts, args.price_types, seed=args.seed))
+        fake_db.install(database)
+        db.detect_change_backend(["Towary", "TwrCeny", "KntOsoby", "Rabaty"])
+        db.save_sync_start_timestamp()
+
+        # Czas odpowiedzi każdego żądania (od wysłania do odebrania nagłówków), mierzony po stronie klienta
+        latencies = []
+        http_client.get_session(url).hooks["response"].append(lambda response, *hook_args, **hook_kwargs: latencies.append(response.elapsed.total_seconds()))
+
+        if args.scenario == "incremental":
+            # Pełna synchronizacja jako punkt wyjścia (niemierzona), potem zmiany w danych i nowy znacznik czasu
+            for entity in entities:
+                if not scheduler.run_tasks({entity: (sync_funcs[entity], [])}).get(entity, False):
+                    print(f"Wstępna pełna synchronizacja '{entity}' zakończona błędem.")
+            db.update_sync_watermark()
+            database.dataset.apply_changes(args.update_rate, args.delete_rate, args.insert_rate)
+            db.save_sync_start_timestamp()
+
+        results = {}
+        for entity in entities:
+            results[entity] = run_entity(entity, sync_funcs[entity], url, latencies)
+    finally:
+        server.kill()
+        state_dir.cleanup()
+
+    config = {key: getattr(args, key) for key in ("products", "contractors", "discounts", "price_types", "scenario", "update_rate", "delete_rate", "insert_rate", "contractors_api", "streaming", "client_rate_limit", "latency_ms", "per_item_ms", "jitter_ms", "rate_limit", "error_rate", "max_body_kb")}
+
+    print(f"\n{'Encja':<12}{'OK':<4}{'Czas [s]':>9}{'Elementów':>11}{'Błędów':>8}{'Elem./s':>10}{'p50 [ms]':>10}{'p99 [ms]':>10}{'RSS [MB]':>10}  Statusy HTTP")
+    for entity, result in results.items():
+        statuses = ", ".join(f"{status}: {count}" for status, count in sorted(result["statuses"].items()))
+        print(f"{entity:<12}{'tak' if result['success'] else 'nie':<4}{result['seconds']:>9}{result['items']:>11}{result['item_errors']:>8}"
+              f"{str(result['items_per_second']):>10}{str(result['p50_ms']):>10}{str(result['p99_ms']):>10}{str(result['peak_rss_mb']):>10}  {statuses}")
+
+    report = {"config": config, "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nPorównanie z {args.baseline}:")
+        if baseline.get("config") != config:
+            print("  UWAGA: konfiguracja różni się od konfiguracji punktu odniesienia - wyniki mogą być nieporównywalne.")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"  POGORSZENIE: {regression}")
+    elif not args.save_baseline:
+        print(f"\nBrak punktu odniesienia {args.baseline}. Zapisz go przez --save-baseline.")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nZapisano punkt odniesienia: {args.baseline}")
+
+    if not all(result["success"] for result in results.values()):
+        return 2
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""
+Lokalny zamiennik WooCommerce / WordPress / pluginu ERPFlow do benchmarków.
+
+Obsługuje endpointy używane przez synchronizację:
+- wc/v3/products/batch, wc/v3/customers/batch oraz listy wc/v3/products, wc/v3/customers (stronicowane),
+- wp/v2/users (tworzenie), wp/v2/users/<id> (aktualizacja, usuwanie) oraz lista wp/v2/users,
+- erp-flow/v1/prices/batch (upsert, update, delete).
+
+Opóźnienie, limit żądań i odsetek błędów są konfigurowalne, a liczniki można odczytać (GET /__stats)
+i wyzerować (POST /__reset). Serwer można uruchomić osobno:
+
+    python benchmarks/stub_server.py --port 8080 --latency-ms 50 --rate-limit 20
+"""
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+class StubStore:
+    """
+    Stan sklepu (produkty, klienci, ceny) i zachowanie serwera (opóźnienie, limit żądań, błędy).
+
+    Args:
+        latency_ms: Stałe opóźnienie każdej odpowiedzi.
+        per_item_ms: Dodatkowe opóźnienie na element partii (WooCommerce zapisuje elementy po kolei).
+        jitter_ms: Losowy rozrzut opóźnienia (0 - jitter_ms).
+        rate_limit: Maksymalna liczba żądań na sekundę (0 - bez limitu); nadmiarowe dostają 429 z Retry-After.
+        error_rate: Odsetek żądań (0-1) kończonych odpowiedzią 503.
+        max_body_kb: Maksymalny rozmiar treści żądania (0 - bez limitu); większe dostają 413.
+        seed: Ziarno generatora losowego (powtarzalne błędy i opóźnienia).
+    """
+    def __init__(self, latency_ms: float = 0, per_item_ms: float = 0, jitter_ms: float = 0, rate_limit: float = 0, error_rate: float = 0, max_body_kb: int = 0, seed: int = 1):
+        self.latency_ms = latency_ms
+        self.per_item_ms = per_item_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.max_body_kb = max_body_kb
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = rate_limit
+        self.refilled = time.monotonic()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.next_id = 1
+            self.items = {"products": {}, "customers": {}, "prices": {}}
+            self.stats = {"requests": 0, "items": 0, "item_errors": 0, "statuses": {}}
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {**self.stats, "statuses": dict(self.stats["statuses"]), "stored": {name: len(items) for name, items in self.items.items()}}
+
+    def count(self, status: int, items: int = 0, errors: int = 0):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["items"] += items
+            self.stats["item_errors"] += errors
+            self.stats["statuses"][str(status)] = self.stats["statuses"].get(str(status), 0) + 1
+
+    def throttle(self) -> float | None:
+        """
+        Limit żądań (token bucket). Zwraca liczbę sekund do wysłania w Retry-After albo None, jeżeli żądanie przechodzi.
+        """
+        if not self.rate_limit:
+            return None
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate_limit, self.tokens + (now - self.refilled) * self.rate_limit)
+            self.refilled = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return None
+            return (1 - self.tokens) / self.rate_limit
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def delay(self, items: int):
+        with self.lock:
+            jitter = self.random.uniform(0, self.jitter_ms) if self.jitter_ms else 0
+        seconds = (self.latency_ms + self.per_item_ms * items + jitter) / 1000
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def __create(self, collection: str, key_field: str, data: dict) -> dict:
+        key = data.get(key_field)
+        for item in self.items[collection].values():
+            if key and item.get(key_field) == key:
+                return {"id": 0, "error": {"code": f"{collection}_invalid_{key_field}", "message": f"Duplikat {key_field}: {key}", "data": {"status": 400}}}
+        item = {**data, "id": self.next_id}
+        item.pop("password", None)
+        self.items[collection][self.next_id] = item
+        self.next_id += 1
+        return item
+
+    def __update(self, collection: str, data: dict) -> dict:
+        item = self.items[collection].get(data.get("id"))
+        if item is None:
+            return {"id": data.get("id"), "error": {"code": "invalid_id", "message": "Nie znaleziono elementu.", "data": {"status": 404}}}
+        item.update({key: value for key, value in data.items() if key != "password"})
+        return item
+
+    def __delete(self, collection: str, item_id) -> dict:
+        item = self.items[collection].pop(item_id, None)
+        if item is None:
+            return {"id": item_id, "error": {"code": "invalid_id", "message": "Nie znaleziono elementu.", "data": {"status": 404}}}
+        return item
+
+    def batch(self, collection: str, key_field: str, data: dict, keys: tuple = ("create", "update", "delete")) -> dict:
+        create_key, update_key, delete_key = keys
+        with self.lock:
+            response = {}
+            if data.get(create_key):
+                response[create_key] = [self.__upsert(collection, key_field, item) if create_key == "upsert" else self.__create(collection, key_field, item) for item in data[create_key]]
+            if data.get(update_key):
+                response[update_key] = [self.__update(collection, item) for item in data[update_key]]
+            if data.get(delete_key):
+                response[delete_key] = [self.__delete(collection, item_id) for item_id in data[delete_key]]
+        return response
+
+    def __upsert(self, collection: str, key_field: str, data: dict) -> dict:
+        for item in self.items[collection].values():
+            if item.get(key_field) == data.get(key_field):
+                item.update(data)
+                return item
+        return self.__create(collection, key_field, data)
+
+    def single(self, collection: str, key_field: str, method: str, item_id: int | None, data: dict | None) -> tuple[int, dict]:
+        with self.lock:
+            if method == "POST" and item_id is None:
+                item = self.__create(collection, key_field, data or {})
+                return (400 if "error" in item else 201), item
+            if method == "POST":
+                item = self.__update(collection, {**(data or {}), "id": item_id})
+                return (404 if "error" in item else 200), item
+            item = self.__delete(collection, item_id)
+            if "error" in item:
+                return 404, item["error"]
+            return 200, {"deleted": True, "previous": item}
+
+    def list(self, collection: str, page: int, per_page: int) -> tuple[list, int]:
+        with self.lock:
+            items = list(self.items[collection].values())
+        pages = max(1, -(-len(items) // per_page))
+        return items[(page - 1) * per_page:page * per_page], pages
+
+def make_handler(store: StubStore):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def __send(self, status: int, body, headers: dict = None):
+            content = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("content-type", "application/json; charset=UTF-8")
+            self.send_header("content-length", str(len(content)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def __read_body(self) -> bytes:
+            body = self.rfile.read(int(self.headers.get("content-length") or 0))
+            if self.headers.get("content-encoding") == "gzip":
+                body = gzip.decompress(body)
+            return body
+
+        def __handle(self, method: str):
+            parts = urlsplit(self.path)
+            query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+            body = self.__read_body() if method in ("POST", "PUT") else b""
+
+            if parts.path == "/__stats":
+                return self.__send(200, store.snapshot())
+            if parts.path == "/__reset":
+                store.reset()
+                return self.__send(200, {"reset": True})
+
+            retry_after = store.throttle()
+            if retry_after is not None:
+                store.count(429)
+                return self.__send(429, {"code": "too_many_requests", "message": "Limit żądań."}, {"retry-after": f"{retry_after:.2f}"})
+            if store.max_body_kb and len(body) > store.max_body_kb * 1024:
+                store.count(413)
+                return self.__send(413, {"code": "request_too_large", "message": "Za duże żądanie."})
+            if store.should_fail():
+                store.delay(0)
+                store.count(503)
+                return self.__send(503, {"code": "service_unavailable", "message": "Serwer przeciążony."})
+
+            data = json.loads(body) if body else None
+            path = parts.path.removeprefix("/wp-json/").strip("/")
+            routes = {
+                "wc/v3/products/batch": ("products", "sku", ("create", "update", "delete")),
+                "wc/v3/customers/batch": ("customers", "username", ("create", "update", "delete")),
+                "erp-flow/v1/prices/batch": ("prices", "sku", ("upsert", "update", "delete")),
+            }
+            if path in routes and method == "POST":
+                collection, key_field, keys = routes[path]
+                items = sum(len(data.get(key) or []) for key in keys)
+                store.delay(items)
+                response = store.batch(collection, key_field, data, keys)
+                errors = sum(1 for results in response.values() for item in results if item.get("error"))
+                store.count(200, items - errors, errors)
+                return self.__send(200, response)
+
+            lists = {"wc/v3/products": "products", "wc/v3/customers": "customers", "wp/v2/users": "customers"}
+            if path in lists and method == "GET":
+                store.delay(0)
+                items, pages = store.list(lists[path], int(query.get("page", 1)), int(query.get("per_page", 10)))
+                store.count(200, len(items))
+                return self.__send(200, items, {"x-wp-totalpages": str(pages), "x-wp-total": str(len(items))})
+
+            if path == "wp/v2/users" or path.startswith("wp/v2/users/"):
+                item_id = path.removeprefix("wp/v2/users").strip("/")
+                store.delay(1)
+                status, response = store.single("customers", "username", method, int(item_id) if item_id else None, data)
+                store.count(status, int(status < 300), int(status >= 300))
+                return self.__send(status, response)
+
+            store.count(404)
+            return self.__send(404, {"code": "rest_no_route", "message": "Nie znaleziono trasy.", "data": {"status": 404}})
+
+        def do_GET(self):
+            self.__handle("GET")
+
+        def do_POST(self):
+            self.__handle("POST")
+
+        def do_PUT(self):
+            self.__handle("PUT")
+
+        def do_DELETE(self):
+            self.__handle("DELETE")
+
+    return Handler
+
+def start(store: StubStore, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """
+    Uruchamia serwer w wątku w tle i zwraca go (adres: `server.server_address`).
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(store))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-server", daemon=True).start()
+    return server
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-ms", type=float, default=20, help="Stałe opóźnienie odpowiedzi (ms). Domyślnie 20.")
+    parser.add_argument("--per-item-ms", type=float, default=2, help="Dodatkowe opóźnienie na element partii (ms). Domyślnie 2.")
+    parser.add_argument("--jitter-ms", type=float, default=10, help="Losowy rozrzut opóźnienia (ms). Domyślnie 10.")
+    parser.add_argument("--rate-limit", type=float, default=0, help="Limit żądań na sekundę (0 - bez limitu).")
+    parser.add_argument("--error-rate", type=float, default=0, help="Odsetek żądań kończonych odpowiedzią 503 (0-1).")
+    parser.add_argument("--max-body-kb", type=int, default=0, help="Maksymalny rozmiar treści żądania w KB (0 - bez limitu), większe dostają 413.")
+    parser.add_argument("--seed", type=int, default=1, help="Ziarno generatora losowego.")
+
+def store_from_arguments(args) -> StubStore:
+    return StubStore(args.latency_ms, args.per_item_ms, args.jitter_ms, args.rate_limit, args.error_rate, args.max_body_kb, args.seed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lokalny zamiennik API WooCommerce / WordPress / ERPFlow.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = start(store_from_arguments(args), args.host, args.port)
+    print(f"http://{server.server_address[0]}:{server.server_address[1]}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sys.exit(0)
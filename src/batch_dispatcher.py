@@ -0,0 +1,427 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.exceptions import HTTPError, Timeout
+import logger as log
+import metrics
+
+__all__ = [
+    "TokenBucket", "BatchSizer", "AdaptiveBatchSizer", "BatchTooLargeError",
+    "get_rate_limiter", "get_batch_sizer", "split_batches", "iter_batches", "dispatch", "batch_sync"
+]
+
+DEFAULT_BATCH_SIZE = 100  # WooCommerce ma limit 100 elementów na żądanie batch
+DEFAULT_WORKERS = 4
+DEFAULT_RATE_LIMIT = 2.0  # Żądań na sekundę dla jednego endpointu
+DEFAULT_MAX_BYTES = 2_000_000  # Poniżej typowego post_max_size w PHP
+DEFAULT_TARGET_LATENCY = 10.0  # Sekund, z zapasem względem timeoutu 30s
+MAX_LOGGED_ITEM_ERRORS = 20  # Błędów pojedynczych elementów wypisywanych w jednym wywołaniu batch_sync
+
+class BatchTooLargeError(Exception):
+    """
+    Serwer odrzucił partię jako zbyt dużą (HTTP 413). Partia nie została przetworzona.
+    """
+    pass
+
+def get_setting(name: str, endpoint: str, default: float) -> float:
+    """
+    Pobiera ustawienie liczbowe ze zmiennej środowiskowej `<name>_<endpoint>`,
+    a jeżeli jej brak, z `<name>`. Np. `api_rate_limit_products_batch`, potem `api_rate_limit`.
+    """
+    env_name = f"{name}_" + re.sub(r'[^a-z0-9]+', '_', endpoint.lower()).strip('_')
+    return float(os.getenv(env_name) or os.getenv(name) or default)
+
+class TokenBucket:
+    """
+    Limiter żądań typu token bucket.
+    Tokeny odnawiają się z prędkością `rate` na sekundę, do maksymalnie `capacity`.
+    Wartość `rate` <= 0 oznacza brak limitu.
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blokuje do momentu, aż dostępny będzie token.
+        """
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+__limiters = {}
+__limiters_lock = threading.Lock()
+def get_rate_limiter(endpoint: str) -> TokenBucket:
+    """
+    Zwraca współdzielony limiter dla danego endpointu (singleton na endpoint).
+    Limit można ustawić zmienną środowiskową `api_rate_limit_<endpoint>` (np. `api_rate_limit_products_batch`),
+    a domyślny dla wszystkich endpointów zmienną `api_rate_limit`.
+    """
+    with __limiters_lock:
+        limiter = __limiters.get(endpoint)
+        if limiter is None:
+            rate = get_setting("api_rate_limit", endpoint, DEFAULT_RATE_LIMIT)
+            limiter = TokenBucket(rate)
+            __limiters[endpoint] = limiter
+            log.debug(f"Limit żądań dla '{endpoint}': {rate}/s.")
+        return limiter
+
+class BatchSizer:
+    """
+    Stały limit wielkości partii: maksymalnie `max_items` elementów i (opcjonalnie) `max_bytes` bajtów JSON.
+    """
+    def __init__(self, max_items: int = DEFAULT_BATCH_SIZE, max_bytes: int = None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+
+    def limits(self) -> tuple[int, int | None]:
+        """
+        Zwraca aktualne limity (liczba elementów, liczba bajtów).
+        """
+        return self.max_items, self.max_bytes
+
+    def record(self, latency: float, overloaded: bool = False):
+        """
+        Zapisuje czas odpowiedzi serwera dla wysłanej partii. Stały limit go ignoruje.
+        """
+        pass
+
+class AdaptiveBatchSizer(BatchSizer):
+    """
+    Limit wielkości partii dopasowujący się do czasu odpowiedzi serwera.
+
+    Jeżeli odpowiedź przychodzi szybciej niż w połowie `target_latency`, limity rosną o 25%
+    (do `max_items` / `max_bytes`). Jeżeli wolniej niż `target_latency`, limity maleją proporcjonalnie,
+    a po timeoucie lub odrzuceniu partii jako zbyt dużej - o połowę.
+    """
+    def __init__(self, max_items: int = DEFAULT_BATCH_SIZE, max_bytes: int = DEFAULT_MAX_BYTES, target_latency: float = DEFAULT_TARGET_LATENCY, min_items: int = 1):
+        super().__init__(max_items, max_bytes)
+        self.target_latency = target_latency
+        self.min_items = min_items
+        self.min_bytes = min(max_bytes, 64_000)
+        self.item_limit = min(max_items, DEFAULT_BATCH_SIZE)
+        self.byte_limit = max_bytes
+        self.lock = threading.Lock()
+
+    def limits(self) -> tuple[int, int | None]:
+        with self.lock:
+            return self.item_limit, self.byte_limit
+
+    def record(self, latency: float, overloaded: bool = False):
+        with self.lock:
+            if overloaded:
+                factor = 0.5
+            elif latency > self.target_latency:
+                factor = max(0.5, self.target_latency / latency)
+            elif latency < self.target_latency / 2:
+                factor = 1.25
+            else:
+                return
+
+            item_limit = min(self.max_items, max(self.min_items, int(self.item_limit * factor)))
+            byte_limit = min(self.max_bytes, max(self.min_bytes, int(self.byte_limit * factor)))
+            # Przy małych partiach mnożenie przez 1.25 mogłoby nic nie zmienić
+            if factor > 1 and item_limit == self.item_limit:
+                item_limit = min(self.max_items, item_limit + 1)
+
+            if item_limit != self.item_limit or byte_limit != self.byte_limit:
+                log.debug(f"Zmiana wielkości partii: {self.item_limit} -> {item_limit} elementów, {self.byte_limit} -> {byte_limit} bajtów (czas odpowiedzi {latency:.2f}s).")
+            self.item_limit = item_limit
+            self.byte_limit = byte_limit
+
+__sizers = {}
+__sizers_lock = threading.Lock()
+def get_batch_sizer(endpoint: str) -> AdaptiveBatchSizer:
+    """
+    Zwraca współdzielony, adaptacyjny limit wielkości partii dla endpointu (singleton na endpoint).
+    Konfiguracja przez zmienne środowiskowe `api_batch_max_items`, `api_batch_max_bytes`
+    i `api_batch_target_latency` (również z sufiksem endpointu, np. `api_batch_max_items_products_batch`).
+    """
+    with __sizers_lock:
+        sizer = __sizers.get(endpoint)
+        if sizer is None:
+            sizer = AdaptiveBatchSizer(
+                max_items=int(get_setting("api_batch_max_items", endpoint, DEFAULT_BATCH_SIZE)),
+                max_bytes=int(get_setting("api_batch_max_bytes", endpoint, DEFAULT_MAX_BYTES)),
+                target_latency=get_setting("api_batch_target_latency", endpoint, DEFAULT_TARGET_LATENCY)
+            )
+            __sizers[endpoint] = sizer
+        return sizer
+
+def get_workers() -> int:
+    """
+    Zwraca liczbę równoległych żądań (zmienna środowiskowa `api_workers`).
+    """
+    return max(1, int(os.getenv("api_workers") or DEFAULT_WORKERS))
+
+def estimate_size(item) -> int:
+    """
+    Szacuje rozmiar elementu po serializacji do JSON (w bajtach).
+    """
+    return len(json.dumps(item, ensure_ascii=False, default=str).encode('utf-8'))
+
+def iter_batches(creations: list, updates: list, deletions: list, sizer: BatchSizer):
+    """
+    Generator dzielący operacje na partie według aktualnych limitów `sizer` (liczba elementów i bajtów).
+    Limity są odczytywane przy budowie każdej partii, więc zmiany wprowadzone przez
+    `AdaptiveBatchSizer` w trakcie wysyłania dotyczą kolejnych partii.
+    Każda partia jest słownikiem z kluczami 'create', 'update' i 'delete' (tylko niepuste).
+    Partia zawiera zawsze co najmniej jeden element, nawet jeżeli przekracza limit bajtów.
+    """
+    # Najpierw tworzenia, potem aktualizacje, na końcu usunięcia
+    operations = [("create", creations), ("update", updates), ("delete", deletions)]
+    indexes = [0, 0, 0]
+
+    while any(indexes[i] < len(items) for i, (_, items) in enumerate(operations)):
+        max_items, max_bytes = sizer.limits()
+        batch = {}
+        count = 0
+        size = 0
+
+        for i, (key, items) in enumerate(operations):
+            while indexes[i] < len(items) and count < max_items:
+                item = items[indexes[i]]
+                if max_bytes is not None:
+                    item_size = estimate_size(item)
+                    if count and size + item_size > max_bytes:
+                        break
+                    size += item_size
+                batch.setdefault(key, []).append(item)
+                indexes[i] += 1
+                count += 1
+            if count >= max_items or (max_bytes is not None and size >= max_bytes):
+                break
+            # Przerwano z powodu limitu bajtów
+            if indexes[i] < len(items):
+                break
+
+        yield batch
+
+def split_batches(creations: list, updates: list, deletions: list, batch_size: int = DEFAULT_BATCH_SIZE) -> list[dict]:
+    """
+    Dzieli operacje na partie po maksymalnie `batch_size` elementów.
+    Każda partia jest słownikiem z kluczami 'create', 'update' i 'delete' (tylko niepuste).
+    """
+    return list(iter_batches(creations, updates, deletions, BatchSizer(batch_size)))
+
+def split_in_half(batch: dict) -> list[dict]:
+    """
+    Dzieli partię na dwie mniejsze. Zwraca pustą listę, jeżeli partia ma tylko jeden element.
+    """
+    operations = [(key, item) for key in ("create", "update", "delete") for item in batch.get(key, [])]
+    if len(operations) < 2:
+        return []
+
+    middle = len(operations) // 2
+    halves = []
+    for part in (operations[:middle], operations[middle:]):
+        half = {}
+        for key, item in part:
+            half.setdefault(key, []).append(item)
+        halves.append(half)
+    return halves
+
+def dispatch(batches, send_func, endpoint: str, workers: int = None, sizer: BatchSizer = None):
+    """
+    Wysyła partie równolegle, utrzymując maksymalnie `workers` żądań w toku
+    i respektując limit żądań dla endpointu.
+
+    Wyniki są zwracane w kolejności partii jako krotki (batch, response, error).
+    Po pierwszym wyjątku nowe partie nie są już wysyłane, ale wyniki partii,
+    które były już w toku, są zwracane (mogły zostać zapisane po stronie sklepu).
+
+    Czas odpowiedzi każdej partii jest przekazywany do `sizer`. Partia odrzucona jako zbyt duża
+    oraz partia bez tworzeń, której wysłanie przekroczyło timeout, jest dzielona na pół i wysyłana ponownie
+    (tworzenia po timeoucie nie są ponawiane, bo mogły zostać zapisane po stronie sklepu).
+    Wyniki połówek są zwracane w miejscu podzielonej partii - wyniki kolejnych partii czekają na nie.
+    """
+    workers = workers or get_workers()
+    limiter = get_rate_limiter(endpoint)
+
+    def send(batch):
+        limiter.acquire()
+        started = time.monotonic()
+        try:
+            response = send_func(batch)
+        except (Timeout, BatchTooLargeError):
+            if sizer:
+                sizer.record(time.monotonic() - started, overloaded=True)
+            raise
+        finally:
+            metrics.observe("erpflow_api_batch_seconds", time.monotonic() - started, endpoint=endpoint)
+        if sizer:
+            sizer.record(time.monotonic() - started)
+        return response
+
+    batches = iter(batches)
+    in_flight = deque()
+    failed = False
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as executor:
+        while True:
+            # Uzupełniamy kolejkę żądań w toku
+            while not failed and len(in_flight) < workers:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                in_flight.append((batch, executor.submit(send, batch)))
+
+            if not in_flight:
+                break
+
+            batch, future = in_flight.popleft()
+            response = None
+            error = None
+            try:
+                response = future.result()
+            except (Timeout, BatchTooLargeError) as e:
+                halves = split_in_half(batch)
+                if halves and not failed and (isinstance(e, BatchTooLargeError) or "create" not in batch):
+                    log.warning(f"Partia dla '{endpoint}' była zbyt duża lub przekroczyła czas ({e}). Ponawianie w dwóch mniejszych partiach.")
+                    # Połówki trafiają na początek kolejki, by zachować kolejność wyników
+                    in_flight.extendleft(reversed([(half, executor.submit(send, half)) for half in halves]))
+                    continue
+                error = e
+            except Exception as e:
+                error = e
+
+            if error is not None:
+                failed = True
+            yield batch, response, error
+
+def batch_sync(
+    endpoint: str,
+    send_func,
+    creations: list = None,
+    updates: list = None,
+    deletions: list = None,
+    names: tuple[str, str, str] = ("element", "elementu", "elementów"),
+    target: str = "WooCommerce",
+    label_key: str = "name",
+    response_keys: tuple[str, str, str] = ("create", "update", "delete"),
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    sizer: BatchSizer = None,
+    on_batch = None
+) -> tuple[bool, list[dict], list[dict], list[dict]]:
+    """
+    Wspólna implementacja batchowej synchronizacji (tworzenie, aktualizacja, usuwanie) dla endpointów typu `*/batch`.
+
+    Args:
+        endpoint: Nazwa endpointu, używana do wyboru limitu żądań (np. 'products/batch').
+        send_func: Funkcja wysyłająca jedną partię. Sygnatura: (batch: dict) -> dict (odpowiedź API)
+        creations: Lista elementów do utworzenia.
+        updates: Lista elementów do aktualizacji (muszą zawierać 'id').
+        deletions: Lista ID elementów do usunięcia.
+        names: Nazwa elementu w bierniku, dopełniaczu i dopełniaczu liczby mnogiej (do logów).
+        target: Nazwa systemu docelowego (do logów), np. 'WooCommerce' lub 'ERPFlow'.
+        label_key: Pole odpowiedzi API z nazwą elementu (do logów).
+        response_keys: Klucze odpowiedzi API z wynikami tworzenia, aktualizacji i usuwania.
+        batch_size: Maksymalna liczba elementów w partii (jeżeli nie podano `sizer`).
+        sizer: Limit wielkości partii, np. adaptacyjny z `get_batch_sizer`.
+        on_batch: Funkcja wywoływana po każdej przetworzonej partii, w wątku wywołującym (np. do zapisu mapowań
+            i punktów kontrolnych). Sygnatura: (created_items, updated_items, deleted_items) -> None
+
+    Returns:
+        Tuple (success, created_items, updated_items, deleted_items)
+    """
+    creations = creations or []
+    updates = updates or []
+    deletions = deletions or []
+
+    if not creations and not updates and not deletions:
+        log.debug(f"Brak danych do synchronizacji z {target}.")
+        return True, [], [], []
+
+    accusative, genitive, plural = names
+    create_key, update_key, delete_key = response_keys
+    status = True
+    all_created = []
+    all_updated = []
+    all_deleted = []
+
+    log.debug(f"Rozpoczynanie operacji w {target}: {len(creations)} utworzeń, {len(updates)} aktualizacji, {len(deletions)} usunięć.")
+
+    # Wyniki są logowane zbiorczo dla partii; pojedyncze elementy tylko na poziomie DEBUG,
+    # a błędy elementów do MAX_LOGGED_ITEM_ERRORS na wywołanie (pozostałe są tylko liczone)
+    debug = log.is_debug_enabled()
+    item_errors = 0
+
+    def check_items(items: list, operation: str, message: str) -> int:
+        nonlocal status, item_errors
+        failed = 0
+        for item in items:
+            if item.get("error"):
+                failed += 1
+                item_errors += 1
+                status = False
+                if item_errors <= MAX_LOGGED_ITEM_ERRORS:
+                    log.error(f"Błąd podczas {operation} {genitive} (ID: {item.get('id', 'N/A')}): {item.get('error')}")
+            elif debug:
+                log.debug(message.format(name=accusative, label=item.get(label_key, 'N/A'), id=item.get('id'), target=target))
+        return failed
+
+    sizer = sizer or BatchSizer(batch_size)
+    batches = iter_batches(creations, updates, deletions, sizer)
+    for batch, response, error in dispatch(batches, send_func, endpoint, sizer=sizer):
+        if error is not None:
+            if isinstance(error, HTTPError):
+                log.error(f"Błąd HTTP podczas batchowej synchronizacji {plural}: {error}")
+            else:
+                log.error(f"Błąd podczas batchowej synchronizacji {plural}: {error}")
+            status = False
+            continue
+
+        if not isinstance(response, dict) or "error" in response or ("code" in response and "message" in response):
+            log.error(f"Błąd odpowiedzi API podczas batchowej synchronizacji {plural}: {response}")
+            status = False
+            continue
+
+        created = response.get(create_key, [])
+        updated = response.get(update_key, [])
+        deleted = response.get(delete_key, [])
+        failed = (check_items(created, "tworzenia", "Utworzono {name} '{label}' w {target} (ID: {id}).")
+                  + check_items(updated, "aktualizacji", "Zaktualizowano {name} '{label}' w {target} (ID: {id}).")
+                  + check_items(deleted, "usuwania", "Usunięto {name} z {target} (ID: {id})."))
+        all_created.extend(created)
+        all_updated.extend(updated)
+        all_deleted.extend(deleted)
+
+        summary = [f"{label} {len(items)}" for label, items in (("utworzono", created), ("zaktualizowano", updated), ("usunięto", deleted)) if items]
+        if summary:
+            log.info(f"Partia {plural} ({endpoint}): " + ", ".join(summary) + (f", w tym {failed} z błędem" if failed else "") + ".")
+
+        if on_batch:
+            on_batch(created, updated, deleted)
+
+    # Wyświetlamy podsumowanie
+    successful_created_count = len([i for i in all_created if not i.get("error")])
+    successful_updated_count = len([i for i in all_updated if not i.get("error")])
+    successful_deleted_count = len([i for i in all_deleted if not i.get("error")])
+    stats = []
+    if creations:
+        stats.append(f"{successful_created_count}/{len(creations)} utworzonych")
+    if updates:
+        stats.append(f"{successful_updated_count}/{len(updates)} zaktualizowanych")
+    if deletions:
+        stats.append(f"{successful_deleted_count}/{len(deletions)} usuniętych")
+    if item_errors > MAX_LOGGED_ITEM_ERRORS:
+        log.error(f"Pominięto w logach {item_errors - MAX_LOGGED_ITEM_ERRORS} kolejnych błędów {plural} (razem {item_errors}).")
+    log.debug("Zakończono synchornizacje: " + ", ".join(stats) + f" {plural}.")
+
+    return status, all_created, all_updated, all_deleted
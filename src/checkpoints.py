@@ -0,0 +1,83 @@
+import json
+import pyodbc
+import connections as con
+import logger as log
+import sql
+
+__all__ = ["TABLE", "is_available", "load", "acknowledge", "clear"]
+
+# Tabela punktów kontrolnych w schemacie ERPFlow: rekordy potwierdzone przez API w danym uruchomieniu
+TABLE = "SyncCheckpoints"
+
+__available = None
+def is_available() -> bool:
+    """
+    Sprawdza (raz) czy istnieje tabela [ERPFlow].[SyncCheckpoints]. Tabela jest tworzona przez `--setup`,
+    bez niej synchronizacja działa jak dotychczas, bez wznawiania.
+    """
+    global __available
+    if __available is None:
+        try:
+            sql.execute("checkpoints.exists", "SELECT OBJECT_ID(?, 'U')", (f"ERPFlow.{TABLE}",))
+            row = con.cursor.fetchone()
+            __available = row is not None and row[0] is not None
+        except pyodbc.Error:
+            __available = False
+        if not __available:
+            log.debug(f"Brak tabeli ERPFlow.{TABLE} - przerwana synchronizacja nie będzie wznawiana. Uruchom --setup.")
+    return __available
+
+def load(run_start: str, entity: str) -> set:
+    """
+    Zwraca ID bazy rekordów encji `entity` potwierdzonych przez API w uruchomieniu rozpoczętym o `run_start`.
+    """
+    if not is_available():
+        return set()
+    try:
+        sql.execute(
+            "checkpoints.load",
+            f"SELECT DbId FROM {sql.table(None, 'ERPFlow', TABLE)} WHERE RunStart = ? AND Entity = ?",
+            (sql.to_datetime(run_start), entity)
+        )
+        return {row[0] for row in con.cursor.fetchall()}
+    except pyodbc.Error as e:
+        log.warning(f"Nie udało się wczytać punktów kontrolnych '{entity}', wszystkie rekordy zostaną wysłane: {e}")
+        return set()
+
+def acknowledge(run_start: str, entity: str, db_ids: list):
+    """
+    Zapisuje jednym zapytaniem ID bazy rekordów potwierdzonych przez API (po każdej partii).
+    Błąd zapisu jest tylko logowany - w najgorszym razie rekordy zostaną wysłane ponownie.
+    """
+    if not db_ids or not is_available():
+        return
+    try:
+        sql.execute(
+            "checkpoints.acknowledge",
+            f'''
+                INSERT INTO {sql.table(None, 'ERPFlow', TABLE)} (RunStart, Entity, DbId)
+                SELECT DISTINCT ?, ?, CAST(j.value AS INT)
+                FROM OPENJSON(?) j
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {sql.table(None, 'ERPFlow', TABLE)} c
+                    WHERE c.RunStart = ? AND c.Entity = ? AND c.DbId = CAST(j.value AS INT)
+                )
+            ''',
+            (sql.to_datetime(run_start), entity, json.dumps(list(db_ids)), sql.to_datetime(run_start), entity)
+        )
+    except pyodbc.Error as e:
+        log.warning(f"Nie udało się zapisać punktu kontrolnego '{entity}': {e}")
+
+def clear(run_start: str | None = None):
+    """
+    Usuwa punkty kontrolne uruchomienia `run_start` (po udanej synchronizacji) oraz wszystkie starsze.
+    """
+    if not is_available():
+        return
+    try:
+        if run_start is None:
+            sql.execute("checkpoints.clear_all", f"DELETE FROM {sql.table(None, 'ERPFlow', TABLE)}")
+        else:
+            sql.execute("checkpoints.clear", f"DELETE FROM {sql.table(None, 'ERPFlow', TABLE)} WHERE RunStart <= ?", (sql.to_datetime(run_start),))
+    except pyodbc.Error as e:
+        log.warning(f"Nie udało się usunąć punktów kontrolnych: {e}")
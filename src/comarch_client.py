@@ -2,29 +2,205 @@ import connections as con
 import os
 import pyodbc
 import json
+import hashlib
+import queue
+import threading
 import logger as log
+import sql
+import checkpoints
+import metrics
+import profiler
 
 # Ścieżka do pliku JSON przechowującego czas synchronizacji
 SYNC_STATE_FILE = os.path.join(os.path.dirname(__file__), "sync_state.json")
 sync_state = None
 sync_start_timestamp = None
 
+# Mechanizm wykrywania zmian (wybierany przez --setup --sledzenie): temporal tables lub Change Tracking
+TEMPORAL = "temporal"
+CHANGE_TRACKING = "ct"
+change_backend = TEMPORAL
+# Wersja Change Tracking z chwili rozpoczęcia synchronizacji (tylko dla CHANGE_TRACKING)
+sync_start_version = None
+
+# Znacznik czasu rozpoczęcia uruchomienia, którego postęp jest zapisywany w punktach kontrolnych (patrz `begin_sync_run`)
+checkpoint_run = None
+# Domyślna liczba wznowień przerwanego uruchomienia, po której zaczynamy nowe (zmienna sync_resume_attempts)
+DEFAULT_RESUME_ATTEMPTS = 3
+
+# Maksymalna liczba ID przekazywana w jednym zapytaniu wykrywającym zmiany
+CHANGES_CHUNK_SIZE = 5000
+
+# Tryb strumieniowy generic_sync: domyślna liczba wierszy w paczce i maksymalna liczba paczek w kolejce
+DEFAULT_STREAM_CHUNK_SIZE = 1000
+STREAM_QUEUE_SIZE = 2
+
+# Wstępnie pobrane zmiany kolumn: {(tabela, kolumna_id): {id_rekordu: zmiany}}
+changed_columns_cache = {}
+
 def is_temporal_enabled(table_name: str, schema: str = 'CDN') -> bool:
     """
     Sprawdza czy temporal tables są już włączone dla danej tabeli.
     """
-    database_name = os.getenv("database_name")
     try:
-        con.cursor.execute(f'''
+        sql.execute("setup.is_temporal_enabled", '''
             SELECT 1 FROM sys.tables t
             JOIN sys.schemas s ON t.schema_id = s.schema_id
-            WHERE s.name = '{schema}' AND t.name = '{table_name}'
+            WHERE s.name = ? AND t.name = ?
             AND t.temporal_type IN (1, 2)
-        ''')
+        ''', (schema, table_name))
+        return con.cursor.fetchone() is not None
+    except pyodbc.Error:
+        return False
+
+def is_change_tracking_enabled(table_name: str, schema: str = 'CDN') -> bool:
+    """
+    Sprawdza czy Change Tracking jest włączone dla danej tabeli.
+    """
+    try:
+        sql.execute("setup.is_change_tracking_enabled", '''
+            SELECT 1 FROM sys.change_tracking_tables ct
+            JOIN sys.tables t ON ct.object_id = t.object_id
+            JOIN sys.schemas s ON t.schema_id = s.schema_id
+            WHERE s.name = ? AND t.name = ?
+        ''', (schema, table_name))
         return con.cursor.fetchone() is not None
     except pyodbc.Error:
         return False
 
+def detect_change_backend(tables: list[str]) -> str:
+    """
+    Ustawia `change_backend` na podstawie konfiguracji bazy danych: Change Tracking, jeżeli jest włączone
+    dla wszystkich podanych tabel (--setup --sledzenie ct), w przeciwnym razie temporal tables.
+    """
+    global change_backend
+    if all(is_change_tracking_enabled(table) for table in tables):
+        change_backend = CHANGE_TRACKING
+    else:
+        change_backend = TEMPORAL
+    log.debug(f"Mechanizm wykrywania zmian: {change_backend}")
+    return change_backend
+
+def is_change_tracking_version_valid(tables: list[str], version: int | None) -> bool:
+    """
+    Sprawdza, czy zmiany od wersji `version` są nadal dostępne w Change Tracking dla wszystkich tabel,
+    tj. czy nie zostały usunięte po upływie okresu przechowywania (CHANGE_RETENTION).
+    Jeżeli nie są, potrzebna jest pełna synchronizacja.
+    """
+    if version is None:
+        return False
+    try:
+        for table in tables:
+            sql.execute("changes.min_valid_version", "SELECT CHANGE_TRACKING_MIN_VALID_VERSION(OBJECT_ID(?))", (f"CDN.{table}",))
+            min_version = con.cursor.fetchone()[0]
+            if min_version is None or version < min_version:
+                log.warning(f"Zmiany w tabeli '{table}' od wersji {version} nie są już dostępne (minimalna wersja: {min_version}).")
+                return False
+        return True
+    except pyodbc.Error as e:
+        log.error(f"Błąd podczas sprawdzania wersji Change Tracking: {e}")
+        return False
+
+def get_last_sync_version(tables: list[str]) -> int | None:
+    """
+    Zwraca wersję Change Tracking ostatniej udanej synchronizacji lub None, jeżeli synchronizacja
+    przyrostowa nie jest możliwa (brak wersji lub zmiany od tej wersji zostały już usunięte).
+    """
+    version = sync_state.get('last_sync_version')
+    if version is None or not is_change_tracking_version_valid(tables, version):
+        return None
+    return version
+
+def update_sync_watermark():
+    """
+    Zapisuje w `sync_state` punkt, od którego następna synchronizacja szuka zmian:
+    czas rozpoczęcia bieżącej synchronizacji i (dla Change Tracking) jej wersję.
+    Kończy też bieżące uruchomienie (`finish_sync_run`) - wznowienie od czasu rozpoczęcia równego
+    nowemu znacznikowi nie pobrałoby już żadnych zmian.
+    """
+    finish_sync_run()
+    if sync_start_timestamp:
+        sync_state['last_sync_timestamp'] = sync_start_timestamp
+    if change_backend == CHANGE_TRACKING and sync_start_version is not None:
+        sync_state['last_sync_version'] = sync_start_version
+
+def begin_sync_run(max_attempts: int = None):
+    """
+    Rozpoczyna uruchomienie synchronizacji z punktami kontrolnymi. Jeżeli poprzednie uruchomienie zostało
+    przerwane (`pending_run` w `sync_state`), używa jego czasu rozpoczęcia i wersji - rekordy potwierdzone
+    wtedy przez API są pomijane, a synchronizacja jest kontynuowana od miejsca przerwania.
+
+    Po `max_attempts` nieudanych wznowieniach (np. w trybie --daemon, gdy jeden rekord stale kończy się błędem)
+    rozpoczynane jest nowe uruchomienie z bieżącym czasem, by zmiany nowsze niż przerwane uruchomienie
+    nie czekały na jego sukces. Bez tabeli punktów kontrolnych uruchomienia nie są wznawiane.
+    """
+    global checkpoint_run, sync_start_timestamp, sync_start_version
+    checkpoint_run = None
+    pending = sync_state.get('pending_run')
+    if not checkpoints.is_available():
+        # Bez punktów kontrolnych wznowienie tylko zamroziłoby czas rozpoczęcia
+        if sync_state.pop('pending_run', None) is not None:
+            save_sync_state()
+        return
+
+    if pending and pending.get('sync_start_timestamp'):
+        attempts = pending.get('attempts', 0) + 1
+        if max_attempts is None or attempts <= max_attempts:
+            sync_start_timestamp = pending['sync_start_timestamp']
+            sync_start_version = pending.get('sync_start_version')
+            pending['attempts'] = attempts
+            save_sync_state()
+            log.info(f"Wznawianie przerwanej synchronizacji rozpoczętej {sync_start_timestamp} (próba {attempts}).")
+            checkpoint_run = sync_start_timestamp
+            return
+        log.warning(f"Synchronizacja rozpoczęta {pending['sync_start_timestamp']} nie powiodła się w {max_attempts} wznowieniach. Rozpoczynanie nowej.")
+        checkpoints.clear(pending['sync_start_timestamp'])
+
+    sync_state['pending_run'] = {'sync_start_timestamp': sync_start_timestamp, 'sync_start_version': sync_start_version}
+    save_sync_state()
+    checkpoint_run = sync_start_timestamp
+
+def finish_sync_run():
+    """
+    Kończy udane uruchomienie: usuwa jego punkty kontrolne i `pending_run` ze `sync_state` (zapis stanu należy do wywołującego).
+    """
+    global checkpoint_run
+    sync_state.pop('pending_run', None)
+    if checkpoint_run:
+        checkpoints.clear(checkpoint_run)
+    checkpoint_run = None
+
+# Klucze główne (IDENTITY) śledzonych tabel - największa wartość wykrywa dodane wiersze w `get_change_marker`
+PRIMARY_KEYS = {
+    "Towary": "Twr_TwrId",
+    "TwrCeny": "TwC_TwCID",
+    "KntOsoby": "KnO_KnOId",
+    "Rabaty": "Rab_RabId",
+}
+
+def get_change_marker(tables: list[str], schema: str = 'CDN') -> tuple:
+    """
+    Zwraca znacznik ostatniej zmiany w podanych tabelach temporalnych: największe ValidTo z tabeli
+    historii (modyfikacje i usunięcia) oraz największy klucz główny tabeli (dodania).
+    Zmiana znacznika pomiędzy wywołaniami oznacza, że w danych pojawiły się nowe zmiany.
+    Oba zapytania czytają tylko koniec indeksu: MAX(ValidTo) domyślny indeks klastrowy tabeli historii
+    (ValidTo, ValidFrom), a MAX klucza głównego jego indeks - bez przeglądania tabel CDN.
+    Przy Change Tracking znacznikiem jest bieżąca wersja zmian bazy danych.
+
+    Raises:
+        pyodbc.Error: Przy błędzie zapytania (np. zerwanym połączeniu).
+    """
+    if change_backend == CHANGE_TRACKING:
+        sql.execute("changes.marker", "SELECT CHANGE_TRACKING_CURRENT_VERSION()")
+        return tuple(con.cursor.fetchone())
+
+    columns = []
+    for table in tables:
+        columns.append(f"(SELECT MAX({PRIMARY_KEYS[table]}) FROM {sql.table(None, schema, table)})")
+        columns.append(f"(SELECT MAX(ValidTo) FROM {sql.table(None, schema, table + 'History')})")
+    sql.execute("changes.marker", f"SELECT {', '.join(columns)}")
+    return tuple(con.cursor.fetchone())
+
 def load_sync_state():
     """
     Wczytuje stan synchronizacji z pliku JSON.
@@ -58,14 +234,16 @@ def save_sync_state():
 def save_sync_start_timestamp():
     """
     Pobiera aktualny znacznik czasu z bazy danych, i zapisuje go w `sync_start_timestamp`.
+    Przy Change Tracking zapisuje również bieżącą wersję zmian w `sync_start_version`.
     Powinno być tylko używane w main przed rozpoczęciem byle jakiej synchronizacji, 
     by mieć spójny czas rozpoczęcia synchronizacji.
     """
-    global sync_start_timestamp
+    global sync_start_timestamp, sync_start_version
     try:
-        con.cursor.execute('''SELECT SYSUTCDATETIME()''')
+        sql.execute("sync.start", '''SELECT SYSUTCDATETIME(), CHANGE_TRACKING_CURRENT_VERSION()''')
         row = con.cursor.fetchone()
         if row:
+            sync_start_version = row[1]
             if hasattr(row[0], 'isoformat'):
                 # return row[0].strftime("%Y-%m-%d %H:%M:%S")
                 sync_start_timestamp = row[0].strftime("%Y-%m-%d %H:%M:%S")
@@ -81,7 +259,13 @@ def save_sync_start_timestamp():
 def get_changed_columns(table_name: str, columns: list, record_id: int, id_column: str, last_sync: str | None, current_time: str, force: bool = False) -> dict:
     """
     Pobiera szczegółowe informacje o zmianach w kolumnach dla danego rekordu.
+    Jeżeli zmiany dla tabeli zostały wcześniej pobrane przez `prefetch_changed_columns`,
+    wynik jest brany z pamięci bez odpytywania bazy.
     """
+    prefetched = changed_columns_cache.get((table_name, id_column))
+    if prefetched is not None:
+        return prefetched.get(record_id, {})
+
     database_name = os.getenv("database_name")
     changes = {}
     
@@ -93,27 +277,26 @@ def get_changed_columns(table_name: str, columns: list, record_id: int, id_colum
         return changes
     
     try:
-        # Konwertujemy last_sync na datetime w formacie ISO 8601 (YYYY-MM-DDTHH:MM:SS)
-        last_sync_iso = last_sync.replace(' ', 'T') if ' ' in last_sync else last_sync
-        
         # Budujemy zapytanie SELECT z aliasami dla kolumn
         select_columns = []
         for col in columns:
-            select_columns.append(f"t_now.{col} AS nowa_{col}")
-            select_columns.append(f"t_history.{col} AS stara_{col}")
+            select_columns.append(f"t_now.{sql.quote_identifier(col)} AS {sql.quote_identifier('nowa_' + col)}")
+            select_columns.append(f"t_history.{sql.quote_identifier(col)} AS {sql.quote_identifier('stara_' + col)}")
         
         select_clause = ", ".join(select_columns)
+        table = sql.table(database_name, 'CDN', table_name)
+        id_col = sql.quote_identifier(id_column)
         
         query = f'''
             SELECT {select_clause}
-            FROM [{database_name}].[CDN].[{table_name}] t_now
-            LEFT JOIN [{database_name}].[CDN].[{table_name}]
+            FROM {table} t_now
+            LEFT JOIN {table}
                 FOR SYSTEM_TIME AS OF ? t_history
-                ON t_now.{id_column} = t_history.{id_column}
-            WHERE t_now.{id_column} = ?
+                ON t_now.{id_col} = t_history.{id_col}
+            WHERE t_now.{id_col} = ?
         '''
         
-        con.cursor.execute(query, (last_sync_iso, record_id))
+        sql.execute(f"changes.{table_name}.record", query, (sql.to_datetime(last_sync), record_id))
         row = con.cursor.fetchone()
         
         if row:
@@ -134,6 +317,220 @@ def get_changed_columns(table_name: str, columns: list, record_id: int, id_colum
     
     return changes
 
+def get_changed_columns_bulk(table_name: str, columns: list, record_ids: list, id_column: str, last_sync: str | None, current_time: str, force: bool = False, filters: dict = None) -> dict:
+    """
+    Pobiera zmiany w kolumnach dla wielu rekordów naraz.
+
+    Zamiast jednego zapytania na rekord (jak w `get_changed_columns`) wykonuje jedno zapytanie
+    na paczkę ID: lista ID jest przekazywana jako tablica JSON i łączona (OPENJSON) ze stanem
+    aktualnym oraz stanem tabeli z chwili `last_sync` (FOR SYSTEM_TIME AS OF).
+
+    Args:
+        table_name (str): Nazwa tabeli w schemacie CDN.
+        columns (list): Kolumny, które porównujemy.
+        record_ids (list): ID rekordów do sprawdzenia.
+        id_column (str): Kolumna z ID rekordu.
+        last_sync (str | None): Znacznik czasu ostatniej synchronizacji.
+        current_time (str): Znacznik czasu rozpoczęcia synchronizacji.
+        force (bool): Jeśli True, błąd zapytania nie przerywa synchronizacji.
+        filters (dict, optional): Dodatkowe warunki równości {kolumna: wartość}, np. {'TwC_Typ': 2}.
+            Stosowane zarówno do stanu aktualnego jak i historycznego.
+
+    Returns:
+        dict: Słownik {id_rekordu: {kolumna: {'old': ..., 'new': ...}}}. Rekordy bez zmian są pomijane.
+    """
+    database_name = os.getenv("database_name")
+    changes = {}
+
+    # Jeśli brak last_sync (pierwsza synchronizacja), zwracamy pusty słownik
+    if last_sync is None or not columns or not record_ids:
+        return changes
+
+    filters = filters or {}
+    last_sync_time = sql.to_datetime(last_sync)
+
+    table = sql.table(database_name, 'CDN', table_name)
+    id_col = sql.quote_identifier(id_column)
+    select_columns = [f"t_now.{id_col} AS id_rekordu"]
+    for col in columns:
+        select_columns.append(f"t_now.{sql.quote_identifier(col)} AS {sql.quote_identifier('nowa_' + col)}")
+        select_columns.append(f"t_history.{sql.quote_identifier(col)} AS {sql.quote_identifier('stara_' + col)}")
+    select_clause = ", ".join(select_columns)
+
+    join_filters = "".join(f" AND t_history.{sql.quote_identifier(col)} = t_now.{sql.quote_identifier(col)}" for col in filters)
+    where_filters = "".join(f" AND t_now.{sql.quote_identifier(col)} = ?" for col in filters)
+
+    query = f'''
+        SELECT {select_clause}
+        FROM OPENJSON(?) WITH (id INT '$') ids
+        INNER JOIN {table} t_now
+            ON t_now.{id_col} = ids.id
+        LEFT JOIN {table}
+            FOR SYSTEM_TIME AS OF ? t_history
+            ON t_now.{id_col} = t_history.{id_col}{join_filters}
+        WHERE 1 = 1{where_filters}
+    '''
+
+    unique_ids = list(dict.fromkeys(record_ids))
+    seen = set()
+    try:
+        for start in range(0, len(unique_ids), CHANGES_CHUNK_SIZE):
+            chunk = unique_ids[start:start + CHANGES_CHUNK_SIZE]
+            sql.execute(f"changes.{table_name}", query, (json.dumps(chunk), last_sync_time, *filters.values()))
+
+            for row in con.cursor.fetchall():
+                record_id = row.id_rekordu
+                # Tak jak w get_changed_columns bierzemy pod uwagę tylko pierwszy wiersz dla danego ID
+                if record_id in seen:
+                    continue
+                seen.add(record_id)
+
+                record_changes = {}
+                for col in columns:
+                    old_val = getattr(row, f"stara_{col}", None)
+                    new_val = getattr(row, f"nowa_{col}", None)
+                    if old_val != new_val:
+                        record_changes[col] = {'old': old_val, 'new': new_val}
+
+                if record_changes:
+                    changes[record_id] = record_changes
+
+        log.debug(f"Wykryto zmiany w {len(changes)}/{len(unique_ids)} rekordach tabeli {table_name}.")
+    except pyodbc.Error as e:
+        log.error(f"Nie udało się pobrać zmian dla {len(unique_ids)} rekordów w tabeli {table_name}: {e}")
+        if not force:
+            raise
+        else:
+            log.info("Tryb 'force' włączony. Rekordy będą traktowane jako całkowicie zmienione, ponieważ nie można porównać stanu sprzed i po synchronizacji.")
+            changes = {}
+
+    return changes
+
+def prefetch_changed_columns(table_name: str, columns: list, record_ids: list, id_column: str, last_sync: str | None, current_time: str, force: bool = False, filters: dict = None) -> dict:
+    """
+    Pobiera zmiany dla wszystkich podanych rekordów jednym zapytaniem (patrz `get_changed_columns_bulk`)
+    i zapamiętuje je, tak by kolejne wywołania `get_changed_columns` dla tej tabeli nie odpytywały bazy.
+
+    Returns:
+        dict: Słownik {id_rekordu: {kolumna: {'old': ..., 'new': ...}}}.
+    """
+    changes = get_changed_columns_bulk(table_name, columns, record_ids, id_column, last_sync, current_time, force, filters)
+    changed_columns_cache[(table_name, id_column)] = changes
+    return changes
+
+def clear_changed_columns_cache(table_name: str, id_column: str):
+    """
+    Usuwa wstępnie pobrane zmiany dla tabeli.
+    """
+    changed_columns_cache.pop((table_name, id_column), None)
+
+PAYLOAD_HASH_COLUMN = "PayloadHash"
+# Pola danych API, których nie można zmienić po utworzeniu elementu (WordPress users i WooCommerce customers
+# odpowiadają 400 "Username isn't editable") - usuwane z aktualizacji w `__prepare_records`
+READ_ONLY_FIELDS = ("username",)
+__payload_hash_columns = {}
+def has_payload_hash_column(id_mapping_table: str) -> bool:
+    """
+    Sprawdza (raz na tabelę) czy tabela mapowań ma kolumnę z hashem ostatnio wysłanych danych.
+    Kolumna jest dodawana przez `--setup`.
+    """
+    if id_mapping_table not in __payload_hash_columns:
+        try:
+            sql.execute("mappings.has_payload_hash", "SELECT COL_LENGTH(?, ?)", (f"ERPFlow.{id_mapping_table}", PAYLOAD_HASH_COLUMN))
+            row = con.cursor.fetchone()
+            __payload_hash_columns[id_mapping_table] = row is not None and row[0] is not None
+        except pyodbc.Error:
+            __payload_hash_columns[id_mapping_table] = False
+    return __payload_hash_columns[id_mapping_table]
+
+def compute_payload_hash(data: dict) -> bytes:
+    """
+    Oblicza hash SHA-256 danych wysyłanych do API (bez pól 'id' i 'password', które nie opisują zawartości).
+    """
+    content = {key: value for key, value in data.items() if key not in ("id", "password")}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).digest()
+
+def save_id_mappings(id_mapping_table: str, db_id_column: str, api_id_column: str, mappings: list[tuple]) -> tuple[int, int]:
+    """
+    Zapisuje zbiorczo mapowania ID (db_id -> api_id) do tabeli [ERPFlow].[id_mapping_table].
+
+    Wszystkie pary są wysyłane jednym wywołaniem (`fast_executemany`) do tabeli tymczasowej,
+    a następnie scalane z tabelą mapowań jednym MERGE w jawnej transakcji.
+    Jeżeli dane API ID było wcześniej przypisane do innego rekordu bazy, stare mapowanie jest usuwane
+    (tak jak przy pojedynczym MERGE, który dopasowywał po którejkolwiek z kolumn).
+
+    Args:
+        id_mapping_table (str): Nazwa tabeli mapowań w schemacie ERPFlow.
+        db_id_column (str): Kolumna z ID bazy danych.
+        api_id_column (str): Kolumna z ID API.
+        mappings (list[tuple]): Lista par (db_id, api_id) lub trójek (db_id, api_id, payload_hash).
+            Hash jest zapisywany tylko jeżeli tabela ma kolumnę PayloadHash.
+
+    Returns:
+        tuple[int, int]: (liczba wstawionych mapowań, liczba zaktualizowanych mapowań)
+    """
+    # Usuwamy duplikaty - ostatnia para wygrywa, zarówno dla ID bazy jak i ID API
+    by_db_id = {}
+    for db_id, api_id, *payload_hash in mappings:
+        by_db_id[db_id] = (api_id, payload_hash[0] if payload_hash else None)
+    by_api_id = {api_id: (db_id, payload_hash) for db_id, (api_id, payload_hash) in by_db_id.items()}
+    rows = [(db_id, api_id, payload_hash) for api_id, (db_id, payload_hash) in by_api_id.items()]
+
+    if not rows:
+        return 0, 0
+
+    with_hash = has_payload_hash_column(id_mapping_table)
+    if not with_hash:
+        rows = [(db_id, api_id) for db_id, api_id, _ in rows]
+
+    cursor = con.conn.cursor()
+    cursor.fast_executemany = True
+    con.conn.autocommit = False
+    try:
+        cursor.execute("IF OBJECT_ID('tempdb..#ERPFlowMapowania') IS NOT NULL DROP TABLE #ERPFlowMapowania")
+        if with_hash:
+            cursor.execute("CREATE TABLE #ERPFlowMapowania (DbId INT NOT NULL PRIMARY KEY, ApiId INT NOT NULL UNIQUE, PayloadHash BINARY(32) NULL)")
+            cursor.executemany("INSERT INTO #ERPFlowMapowania (DbId, ApiId, PayloadHash) VALUES (?, ?, ?)", rows)
+            update_hash = f", {PAYLOAD_HASH_COLUMN} = source.PayloadHash"
+            insert_columns = f", {PAYLOAD_HASH_COLUMN}"
+            insert_values = ", source.PayloadHash"
+        else:
+            cursor.execute("CREATE TABLE #ERPFlowMapowania (DbId INT NOT NULL PRIMARY KEY, ApiId INT NOT NULL UNIQUE)")
+            cursor.executemany("INSERT INTO #ERPFlowMapowania (DbId, ApiId) VALUES (?, ?)", rows)
+            update_hash = insert_columns = insert_values = ""
+
+        # API ID przypisane teraz do innego rekordu - usuwamy stare mapowanie
+        sql.execute(f"mappings.{id_mapping_table}.unassign", f'''
+            DELETE target FROM [ERPFlow].[{id_mapping_table}] target
+            INNER JOIN #ERPFlowMapowania source
+                ON target.{api_id_column} = source.ApiId AND target.{db_id_column} <> source.DbId
+        ''', cursor=cursor)
+
+        sql.execute(f"mappings.{id_mapping_table}.merge", f'''
+            MERGE [ERPFlow].[{id_mapping_table}] AS target
+            USING #ERPFlowMapowania AS source
+            ON target.{db_id_column} = source.DbId
+            WHEN MATCHED THEN
+                UPDATE SET {api_id_column} = source.ApiId{update_hash}
+            WHEN NOT MATCHED THEN
+                INSERT ({db_id_column}, {api_id_column}{insert_columns}) VALUES (source.DbId, source.ApiId{insert_values})
+            OUTPUT $action;
+        ''', cursor=cursor)
+        actions = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute("DROP TABLE #ERPFlowMapowania")
+        con.conn.commit()
+    except pyodbc.Error:
+        con.conn.rollback()
+        raise
+    finally:
+        con.conn.autocommit = True
+        cursor.close()
+
+    inserted = actions.count('INSERT')
+    updated = actions.count('UPDATE')
+    return inserted, updated
+
 def generic_sync(
     entity_name: str,
     fetch_query: str,
@@ -144,7 +541,14 @@ def generic_sync(
     api_id_column: str = None,
     last_sync_timestamp: str | None = None,
     rebuild: bool = False,
-    force: bool = False
+    force: bool = False,
+    prefetch_func = None,
+    chunk_size: int = None,
+    fetch_params: tuple = (),
+    query_name: str = None,
+    deleted_query: str = None,
+    deleted_params: tuple = (),
+    key_index_func = None
 ) -> bool:
     """
     Ogólna funkcja do synchronizacji encji między bazą danych MSSQL a zewnętrznym API.
@@ -175,12 +579,30 @@ def generic_sync(
         api_batch_func (callable): Funkcja wysyłająca żądania wsadowe do zewnętrznego API.
             Sygnatura: (creations=list, updates=list, deletions=list) -> (bool, list, list, list)
             Zwraca: (success, created_items, updated_items, deleted_items)
+            Przy podanym id_mapping_table wywoływana z argumentem `on_batch` (patrz `batch_dispatcher.batch_sync`)
         last_sync_timestamp (str | None, optional): Znacznik czasu ISO ostatniej udanej synchronizacji.
             Używany przez data_mapper_func do wykrywania zmian. Domyślnie None
         rebuild (bool, optional): Jeśli True, czyści wszystkie istniejące mapowania ID i wykonuje pełną przebudowę.
             Przydatne przy pierwszej synchronizacji lub odzyskiwaniu danych. Domyślnie False
         force (bool, optional): Jeśli True, wymusza synchronizację wszystkich rekordów niezależnie od wykrywania zmian.
             Przekazywany do data_mapper_func. Domyślnie False
+        prefetch_func (callable, optional): Funkcja wywoływana raz dla wszystkich pobranych rekordów przed mapowaniem,
+            np. do zbiorczego wykrycia zmian przez `prefetch_changed_columns`.
+            Sygnatura: (records, last_sync_timestamp, force) -> None
+        chunk_size (int, optional): Jeśli podany, włącza tryb strumieniowy: rekordy są czytane paczkami
+            (`fetchmany`) przez osobne połączenie, a pobieranie, mapowanie i wysyłanie do API działają
+            równolegle na kolejnych paczkach, z ograniczoną kolejką między etapami. Domyślnie None
+        fetch_params (tuple, optional): Parametry (`?`) zapytania fetch_query, np. znaczniki czasu.
+            Wartości zmieniające się między uruchomieniami powinny być parametrami, by plan zapytania był używany ponownie
+        query_name (str, optional): Nazwa zapytania w licznikach i znaczniku /* ERPFlow:<nazwa> */ (patrz `sql.execute`).
+            Domyślnie 'fetch.<id_mapping_table lub db_id_column>'
+        deleted_query (str, optional): Zapytanie zwracające pary (db_id, api_id) rekordów usuniętych z bazy
+            (patrz `get_deleted_query`). Odpowiadające im elementy są usuwane z API, a ich mapowania z tabeli
+            id_mapping_table. Wymaga id_mapping_table. Domyślnie None (bez usuwania)
+        deleted_params (tuple, optional): Parametry zapytania deleted_query
+        key_index_func (callable, optional): Funkcja zwracająca {klucz: ID API} elementów istniejących już w API
+            (np. SKU -> ID produktu). Używana tylko przy pełnej przebudowie: rekordy, które już istnieją w API,
+            są aktualizowane zamiast tworzone (bez błędów duplikatu SKU), a ich mapowania zapisywane ponownie
 
     Returns:
         bool: True jeśli synchronizacja zakończyła się sukcesem (nawet z częściowymi niepowodzeniami),
@@ -204,40 +626,516 @@ def generic_sync(
     Uwaga:
         - Funkcja oczekuje, że połączenie z bazą danych będzie już nawiązane przez moduł `connections`
         - Mapowania ID są przechowywane w schemacie [ERPFlow]
-        - Funkcja używa instrukcji MERGE dla wydajnych operacji upsert na tabelach mapowań
+        - Mapowania nowych rekordów są zapisywane zbiorczo jednym MERGE (patrz `save_id_mappings`) po każdej partii
+        - W uruchomieniu z punktami kontrolnymi (`begin_sync_run`) ID rekordów potwierdzonych przez API są zapisywane
+          po każdej partii w [ERPFlow].[SyncCheckpoints], a wznowione uruchomienie je pomija
         - Elementy API powinny mieć pole 'sku', 'username' lub 'slug' do identyfikacji
         - Niepowodzenia pojedynczych rekordów nie przerywają całego procesu synchronizacji
     """
-    database_name = os.getenv("database_name")
+    query_name = query_name or f"fetch.{id_mapping_table or db_id_column}"
+
+    # Rekordy potwierdzone przez API w przerwanym uruchomieniu (patrz `begin_sync_run`)
+    done = set()
+    if checkpoint_run and id_mapping_table:
+        done = checkpoints.load(checkpoint_run, id_mapping_table)
+        if done:
+            log.info(f"Wznawianie: pomijanie {len(done)} {entity_name} wysłanych przed przerwaniem synchronizacji.")
+
+    if chunk_size:
+        status = __generic_sync_streaming(
+            entity_name, fetch_query, data_mapper_func, api_batch_func, id_mapping_table, db_id_column,
+            api_id_column, last_sync_timestamp, rebuild, force, prefetch_func, chunk_size, fetch_params, query_name, key_index_func, done
+        )
+    else:
+        status = __generic_sync_records(
+            entity_name, fetch_query, data_mapper_func, api_batch_func, id_mapping_table, db_id_column,
+            api_id_column, last_sync_timestamp, rebuild, force, prefetch_func, fetch_params, query_name, key_index_func, done
+        )
+
+    # Usuwanie elementów, których rekordy usunięto z bazy
+    if deleted_query and id_mapping_table:
+        deleted_status = __sync_deletions(
+            entity_name, deleted_query, deleted_params, f"{query_name}.deleted", api_batch_func, id_mapping_table, api_id_column
+        )
+        status = status and deleted_status
+
+    return status
+
+def __generic_sync_records(
+    entity_name: str,
+    fetch_query: str,
+    data_mapper_func,
+    api_batch_func,
+    id_mapping_table: str,
+    db_id_column: str,
+    api_id_column: str,
+    last_sync_timestamp: str | None,
+    rebuild: bool,
+    force: bool,
+    prefetch_func,
+    fetch_params: tuple,
+    query_name: str,
+    key_index_func = None,
+    done: set = None
+) -> bool:
+    """
+    Tryb podstawowy `generic_sync`: pobiera wszystkie rekordy naraz, mapuje je i wysyła do API.
+    """
     status = True
-    
+    entity = __metric_entity(query_name)
+
     # Wykonanie zapytania
     try:
-        con.cursor.execute(fetch_query)
-        records = con.cursor.fetchall()
+        with profiler.phase(entity, "fetch"):
+            sql.execute(query_name, fetch_query, fetch_params)
+            records = con.cursor.fetchall()
     except pyodbc.Error as e:
         log.error(f"Błąd podczas pobierania {entity_name}: {e}")
         return False
+    metrics.inc("erpflow_rows_fetched_total", len(records), entity=entity)
+
+    if done:
+        records = [row for row in records if getattr(row, db_id_column) not in done]
 
     # Sprawdzamy czy jest coś do synchronizacji
     if not records:
         log.info(f"Brak nowych lub zmienionych {entity_name} do synchronizacji.")
         return True
 
+    # Zbiorcze wykrywanie zmian dla wszystkich rekordów
+    if prefetch_func:
+        try:
+            with profiler.phase(entity, "changes"):
+                prefetch_func(records, last_sync_timestamp, force)
+        except Exception as e:
+            log.error(f"Błąd podczas wykrywania zmian {entity_name}: {e}")
+            return False
+
     # Pobieramy mapowanie ID
+    wc_id_map = {}
+    payload_hashes = {}
+    if id_mapping_table:
+        # Wznowiona pełna przebudowa nie czyści mapowań zapisanych przed przerwaniem
+        wc_id_map = __load_id_map(entity_name, id_mapping_table, db_id_column, api_id_column, rebuild and not done)
+        if wc_id_map is None:
+            return False
+        payload_hashes = __load_payload_hashes(entity_name, id_mapping_table, db_id_column, rebuild)
+    api_id_map = {api_id: db_id for db_id, api_id in wc_id_map.items()}
+    key_index = __load_key_index(entity_name, key_index_func) if rebuild and key_index_func else {}
+
+    with profiler.phase(entity, "prepare"):
+        to_create, to_update, item_map, status, new_hashes, skipped = __prepare_records(
+            entity_name, records, data_mapper_func, db_id_column, id_mapping_table, wc_id_map, payload_hashes, last_sync_timestamp, force, key_index
+        )
+    metrics.inc("erpflow_items_skipped_total", skipped, entity=entity)
+
+    if skipped:
+        log.info(f"Pominięto {skipped} {entity_name} bez zmian od ostatniego wysłania.")
+
+    if not to_create and not to_update:
+        log.info(f"Brak danych do wysłania po przetworzeniu zmian {entity_name}.")
+        return True
+
+    # Wykonujemy synchronizację
+    # api_batch_func zwraca (success, created_items, updated_items, deleted_items)
     if id_mapping_table:
-        wc_id_map = {}
+        # Mapowania i punkty kontrolne są zapisywane po każdej partii, by przerwana synchronizacja nie traciła postępu
+        totals = [0, 0]
+        def on_batch(created_items, updated_items, deleted_items):
+            _, created, updated, acknowledged = __process_results(
+                entity_name, (True, created_items, updated_items, deleted_items), item_map, new_hashes, api_id_map, id_mapping_table, db_id_column, api_id_column, entity
+            )
+            __acknowledge(id_mapping_table, acknowledged)
+            totals[0] += created
+            totals[1] += updated
+
+        # Czas etapu 'api' obejmuje tu również zapis mapowań po partiach (mierzony osobno jako 'mappings')
+        with profiler.phase(entity, "api"):
+            success, *_ = api_batch_func(creations=to_create, updates=to_update, on_batch=on_batch)
+        total_created, total_updated = totals
+    else:
+        with profiler.phase(entity, "api"):
+            result = api_batch_func(
+                creations=to_create,
+                updates=to_update
+            )
+        success, total_created, total_updated, _ = __process_results(
+            entity_name, result, item_map, new_hashes, api_id_map, id_mapping_table, db_id_column, api_id_column, entity
+        )
+
+    if not success:
+        log.error(f"Synchronizacja {entity_name} zakończona błędem API.")
+        return False
+
+    log.info(f"Zakończono synchronizacje {entity_name}. Utworzono {total_created}, zaktualizowano {total_updated}, pominięto {skipped} bez zmian.")
+    
+    return status
+
+def get_deleted_query(database_name: str, table_name: str, id_column: str, id_mapping_table: str, api_id_column: str,
+                      last_sync_timestamp: str | None = None, last_sync_version: int | None = None) -> tuple[str, tuple]:
+    """
+    Zwraca (zapytanie, parametry) wyszukujące zmapowane rekordy usunięte z tabeli [CDN].[table_name].
+    Zapytanie zwraca pary (db_id, api_id) z tabeli mapowań.
+
+    - Change Tracking (`last_sync_version`): operacje 'D' z CHANGETABLE od wersji ostatniej synchronizacji.
+    - Temporal tables (`last_sync_timestamp`): wiersze historii zamknięte (ValidTo) od ostatniej synchronizacji,
+      których nie ma już w tabeli. Zakres po ValidTo korzysta z indeksu klastrowego tabeli historii.
+    - Bez znacznika (pełna synchronizacja): mapowania bez odpowiadającego rekordu w tabeli (anti-join).
+
+    W trybach przyrostowych koszt zależy od liczby zmian, a nie od liczby zmapowanych rekordów.
+    """
+    table = sql.table(database_name, 'CDN', table_name)
+    mapping = sql.table(database_name, 'ERPFlow', id_mapping_table)
+    id_col = sql.quote_identifier(id_column)
+    api_col = sql.quote_identifier(api_id_column)
+    not_exists = f"NOT EXISTS (SELECT 1 FROM {table} t WHERE t.{id_col} = m.{id_col})"
+
+    if last_sync_version is not None:
+        query = f'''
+            SELECT m.{id_col}, m.{api_col}
+            FROM CHANGETABLE(CHANGES {table}, ?) ct
+            INNER JOIN {mapping} m ON m.{id_col} = ct.{id_col}
+            WHERE ct.SYS_CHANGE_OPERATION = 'D'
+            AND {not_exists}
+        '''
+        return query, (int(last_sync_version),)
+
+    if last_sync_timestamp is not None:
+        query = f'''
+            SELECT DISTINCT m.{id_col}, m.{api_col}
+            FROM {sql.table(database_name, 'CDN', table_name + 'History')} h
+            INNER JOIN {mapping} m ON m.{id_col} = h.{id_col}
+            WHERE h.ValidTo > ? AND h.ValidTo <= ?
+            AND {not_exists}
+        '''
+        return query, (sql.to_datetime(last_sync_timestamp), sql.to_datetime(sync_start_timestamp))
+
+    query = f'''
+        SELECT m.{id_col}, m.{api_col}
+        FROM {mapping} m
+        WHERE {not_exists}
+    '''
+    return query, ()
+
+def __is_not_found(error) -> bool:
+    """
+    Sprawdza, czy błąd API oznacza, że element już nie istnieje (np. usunięty ręcznie w sklepie).
+    """
+    if isinstance(error, dict):
+        data = error.get("data")
+        status = data.get("status") if isinstance(data, dict) else None
+        return status in (404, 410) or str(error.get("code", "")).endswith("invalid_id")
+    return False
+
+def __sync_deletions(entity_name: str, deleted_query: str, deleted_params: tuple, query_name: str, api_batch_func, id_mapping_table: str, api_id_column: str) -> bool:
+    """
+    Usuwa z API elementy rekordów usuniętych z bazy (`deleted_query` zwraca pary (db_id, api_id))
+    i usuwa ich mapowania. Elementy, których już nie ma w API, również tracą mapowanie.
+    """
+    try:
+        sql.execute(query_name, deleted_query, deleted_params)
+        rows = con.cursor.fetchall()
+    except pyodbc.Error as e:
+        log.error(f"Błąd podczas wyszukiwania usuniętych {entity_name}: {e}")
+        return False
+
+    if not rows:
+        return True
+
+    api_ids = list(dict.fromkeys(row[1] for row in rows))
+    log.info(f"Wykryto {len(api_ids)} usuniętych {entity_name}. Usuwanie...")
+
+    try:
+        _, _, _, deleted_items = api_batch_func(deletions=api_ids)
+    except Exception as e:
+        log.error(f"Błąd podczas usuwania {entity_name}: {e}")
+        return False
+
+    removed = []
+    failed = 0
+    for item in deleted_items:
+        error = item.get("error")
+        if error and not __is_not_found(error):
+            failed += 1
+            continue
+        item_id = item.get("id") or (item.get("previous") or {}).get("id")
+        if item_id is not None:
+            removed.append(item_id)
+
+    if removed:
         try:
-            if rebuild:
-                log.debug(f"Pełna przebudowa: reset istniejących mapowań {entity_name}.")
-                con.cursor.execute(f'DELETE FROM [ERPFlow].[{id_mapping_table}]')
-            else:
-                con.cursor.execute(f'SELECT {db_id_column}, {api_id_column} FROM [ERPFlow].[{id_mapping_table}]')
-                wc_id_map = {row[0]: row[1] for row in con.cursor.fetchall()}
-                log.debug(f"Pobrano {len(wc_id_map)} istniejących mapowań {entity_name}.")
+            sql.execute(
+                f"mappings.{id_mapping_table}.remove",
+                f"DELETE FROM {sql.table(None, 'ERPFlow', id_mapping_table)} WHERE {sql.quote_identifier(api_id_column)} IN (SELECT CAST(value AS INT) FROM OPENJSON(?))",
+                (json.dumps(removed),)
+            )
         except pyodbc.Error as e:
-            log.error(f"Błąd podczas operacji na tabeli mapowań {id_mapping_table}: {e}")
+            log.error(f"Nie udało się usunąć mapowań usuniętych {entity_name}: {e}")
+            return False
+
+    log.info(f"Usunięto {len(removed)}/{len(api_ids)} {entity_name}.")
+    return failed == 0 and len(removed) == len(api_ids)
+
+def get_stream_chunk_size() -> int:
+    """
+    Zwraca liczbę wierszy w paczce dla trybu strumieniowego (zmienna środowiskowa `sync_chunk_size`).
+    """
+    return max(1, int(os.getenv("sync_chunk_size") or DEFAULT_STREAM_CHUNK_SIZE))
+
+def __put(target: queue.Queue, item, stop: threading.Event) -> bool:
+    """
+    Wstawia element do ograniczonej kolejki, czekając na miejsce, chyba że ustawiono `stop`.
+    Zwraca False, jeżeli przerwano.
+    """
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def __read_chunks(entity_name: str, fetch_query: str, fetch_params: tuple, query_name: str, chunk_size: int, output: queue.Queue, stop: threading.Event):
+    """
+    Etap pobierania trybu strumieniowego: czyta wyniki zapytania paczkami przez osobne połączenie
+    i wstawia je do kolejki. Na końcu wstawia None, a w przypadku błędu - wyjątek.
+    """
+    cursor = None
+    connection = None
+    try:
+        cursor, connection = con.open_database_connection()
+        entity = __metric_entity(query_name)
+        with profiler.phase(entity, "fetch"):
+            sql.execute(query_name, fetch_query, fetch_params, cursor=cursor)
+        while not stop.is_set():
+            with profiler.phase(entity, "fetch"):
+                rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            if not __put(output, rows, stop):
+                return
+        __put(output, None, stop)
+    except Exception as e:
+        log.error(f"Błąd podczas pobierania {entity_name}: {e}")
+        __put(output, e, stop)
+    finally:
+        if connection is not None:
+            connection.close()
+
+def __send_chunks(api_batch_func, source: queue.Queue, results: queue.Queue, stop: threading.Event, entity: str = ""):
+    """
+    Etap wysyłania trybu strumieniowego: wysyła paczki z kolejki do API
+    i przekazuje wyniki (wraz z item_map paczki) do kolejki wyników.
+    """
+    while True:
+        try:
+            job = source.get(timeout=0.5)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        if job is None:
+            return
+        to_create, to_update, item_map, new_hashes = job
+        try:
+            with profiler.phase(entity, "api"):
+                result = api_batch_func(creations=to_create, updates=to_update)
+        except Exception as e:
+            log.error(f"Błąd podczas wysyłania paczki do API: {e}")
+            result = (False, [], [], [])
+        results.put((result, item_map, new_hashes))
+
+def __generic_sync_streaming(
+    entity_name: str,
+    fetch_query: str,
+    data_mapper_func,
+    api_batch_func,
+    id_mapping_table: str,
+    db_id_column: str,
+    api_id_column: str,
+    last_sync_timestamp: str | None,
+    rebuild: bool,
+    force: bool,
+    prefetch_func,
+    chunk_size: int,
+    fetch_params: tuple = (),
+    query_name: str = None,
+    key_index_func = None,
+    done: set = None
+) -> bool:
+    """
+    Tryb strumieniowy `generic_sync`. Trzy etapy działają równolegle:
+    pobieranie paczek z bazy (osobne połączenie), mapowanie (bieżący wątek, razem z wykrywaniem zmian
+    i zapisem mapowań ID) oraz wysyłanie do API. Kolejki między etapami mają ograniczony rozmiar,
+    więc w pamięci znajduje się tylko kilka paczek naraz.
+    """
+    status = True
+    api_success = True
+    fetched = 0
+    total_created = 0
+    total_updated = 0
+    total_skipped = 0
+    entity = __metric_entity(query_name)
+
+    # Pobieramy mapowanie ID
+    wc_id_map = {}
+    payload_hashes = {}
+    if id_mapping_table:
+        # Wznowiona pełna przebudowa nie czyści mapowań zapisanych przed przerwaniem
+        wc_id_map = __load_id_map(entity_name, id_mapping_table, db_id_column, api_id_column, rebuild and not done)
+        if wc_id_map is None:
             return False
+        payload_hashes = __load_payload_hashes(entity_name, id_mapping_table, db_id_column, rebuild)
+    api_id_map = {api_id: db_id for db_id, api_id in wc_id_map.items()}
+    key_index = __load_key_index(entity_name, key_index_func) if rebuild and key_index_func else {}
+
+    stop = threading.Event()
+    chunks = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    jobs = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    results = queue.Queue()
+
+    reader = threading.Thread(target=__read_chunks, args=(entity_name, fetch_query, fetch_params, query_name, chunk_size, chunks, stop), name="stream-read", daemon=True)
+    sender = threading.Thread(target=__send_chunks, args=(api_batch_func, jobs, results, stop, __metric_entity(query_name)), name="stream-send", daemon=True)
+    reader.start()
+    sender.start()
+
+    def handle_results():
+        # Zapis mapowań odbywa się w bieżącym wątku, który jest właścicielem połączenia z bazą
+        nonlocal api_success, total_created, total_updated
+        while True:
+            try:
+                result, item_map, new_hashes = results.get_nowait()
+            except queue.Empty:
+                return
+            success, created, updated, acknowledged = __process_results(entity_name, result, item_map, new_hashes, api_id_map, id_mapping_table, db_id_column, api_id_column, entity)
+            __acknowledge(id_mapping_table, acknowledged)
+            api_success = api_success and success
+            total_created += created
+            total_updated += updated
+
+    try:
+        while True:
+            records = chunks.get()
+            if records is None:
+                break
+            if isinstance(records, Exception):
+                status = False
+                break
+
+            fetched += len(records)
+            metrics.inc("erpflow_rows_fetched_total", len(records), entity=entity)
+            if done:
+                records = [row for row in records if getattr(row, db_id_column) not in done]
+
+            if prefetch_func:
+                try:
+                    with profiler.phase(entity, "changes"):
+                        prefetch_func(records, last_sync_timestamp, force)
+                except Exception as e:
+                    log.error(f"Błąd podczas wykrywania zmian {entity_name}: {e}")
+                    status = False
+                    break
+
+            with profiler.phase(entity, "prepare"):
+                to_create, to_update, item_map, chunk_status, new_hashes, skipped = __prepare_records(
+                    entity_name, records, data_mapper_func, db_id_column, id_mapping_table, wc_id_map, payload_hashes, last_sync_timestamp, force, key_index
+                )
+            status = status and chunk_status
+            total_skipped += skipped
+            metrics.inc("erpflow_items_skipped_total", skipped, entity=entity)
+            log.debug(f"Przetworzono paczkę {len(records)} {entity_name} (razem {fetched}).")
+
+            if to_create or to_update:
+                if not __put(jobs, (to_create, to_update, item_map, new_hashes), stop):
+                    break
+            handle_results()
+    finally:
+        # Przy błędzie zatrzymujemy pobieranie, ale pozwalamy dokończyć wysyłkę przygotowanych paczek
+        if not status:
+            stop.set()
+        __put(jobs, None, threading.Event())
+        sender.join()
+        stop.set()
+        reader.join()
+        handle_results()
+
+    if fetched == 0 and status:
+        log.info(f"Brak nowych lub zmienionych {entity_name} do synchronizacji.")
+        return True
+
+    if not api_success:
+        log.error(f"Synchronizacja {entity_name} zakończona błędem API.")
+        return False
+
+    log.info(f"Zakończono synchronizacje {entity_name}. Pobrano {fetched}, utworzono {total_created}, zaktualizowano {total_updated}, pominięto {total_skipped} bez zmian.")
+
+    return status
+
+def __load_id_map(entity_name: str, id_mapping_table: str, db_id_column: str, api_id_column: str, rebuild: bool) -> dict | None:
+    """
+    Wczytuje mapowania ID {db_id: api_id} z tabeli [ERPFlow].[id_mapping_table].
+    Przy pełnej przebudowie czyści tabelę i zwraca pusty słownik.
+    Zwraca None w przypadku błędu.
+    """
+    wc_id_map = {}
+    try:
+        if rebuild:
+            log.debug(f"Pełna przebudowa: reset istniejących mapowań {entity_name}.")
+            sql.execute(f"mappings.{id_mapping_table}.clear", f'DELETE FROM {sql.table(None, "ERPFlow", id_mapping_table)}')
+        else:
+            sql.execute(f"mappings.{id_mapping_table}.load", f'SELECT {sql.quote_identifier(db_id_column)}, {sql.quote_identifier(api_id_column)} FROM {sql.table(None, "ERPFlow", id_mapping_table)}')
+            wc_id_map = {row[0]: row[1] for row in con.cursor.fetchall()}
+            log.debug(f"Pobrano {len(wc_id_map)} istniejących mapowań {entity_name}.")
+    except pyodbc.Error as e:
+        log.error(f"Błąd podczas operacji na tabeli mapowań {id_mapping_table}: {e}")
+        return None
+    return wc_id_map
+
+def __load_payload_hashes(entity_name: str, id_mapping_table: str, db_id_column: str, rebuild: bool) -> dict:
+    """
+    Wczytuje hashe ostatnio wysłanych danych {db_id: hash} z tabeli mapowań.
+    Zwraca pusty słownik, jeżeli tabela nie ma kolumny PayloadHash lub przy pełnej przebudowie.
+    """
+    if rebuild or not has_payload_hash_column(id_mapping_table):
+        return {}
+    try:
+        sql.execute(f"mappings.{id_mapping_table}.hashes", f'SELECT {sql.quote_identifier(db_id_column)}, {PAYLOAD_HASH_COLUMN} FROM {sql.table(None, "ERPFlow", id_mapping_table)} WHERE {PAYLOAD_HASH_COLUMN} IS NOT NULL')
+        payload_hashes = {row[0]: bytes(row[1]) for row in con.cursor.fetchall()}
+        log.debug(f"Pobrano {len(payload_hashes)} hashy ostatnio wysłanych {entity_name}.")
+        return payload_hashes
+    except pyodbc.Error as e:
+        log.warning(f"Nie udało się pobrać hashy {entity_name}, wszystkie rekordy zostaną wysłane: {e}")
+        return {}
+
+def __load_key_index(entity_name: str, key_index_func) -> dict:
+    """
+    Pobiera indeks {klucz: ID API} elementów istniejących w API (patrz `key_index_func` w `generic_sync`).
+    W przypadku błędu zwraca pusty słownik - wszystkie rekordy będą tworzone jak dotychczas.
+    """
+    try:
+        key_index = key_index_func()
+    except Exception as e:
+        log.warning(f"Nie udało się pobrać istniejących {entity_name} z API, wszystkie rekordy zostaną utworzone: {e}")
+        return {}
+    log.info(f"Pobrano {len(key_index)} istniejących {entity_name} z API. Istniejące elementy zostaną zaktualizowane.")
+    return key_index
+
+def __prepare_records(entity_name: str, records, data_mapper_func, db_id_column: str, id_mapping_table: str, wc_id_map: dict, payload_hashes: dict, last_sync_timestamp: str | None, force: bool, key_index: dict = None) -> tuple[list, list, dict, bool, dict, int]:
+    """
+    Mapuje rekordy bazy na dane API i dzieli je na tworzenia i aktualizacje.
+    Aktualizacje, których hash danych jest taki sam jak ostatnio wysłany (`payload_hashes`), są pomijane
+    (chyba że `force`). Rekordy bez mapowania, których klucz jest w `key_index` ({klucz: ID API}),
+    są aktualizowane zamiast tworzone.
+
+    Returns:
+        tuple: (to_create, to_update, item_map, status, new_hashes, skipped), gdzie item_map to {klucz API: db_id},
+            status jest False jeżeli mapowanie któregoś rekordu się nie powiodło, new_hashes to {db_id: hash}
+            dla wysyłanych rekordów, a skipped to liczba pominiętych rekordów bez zmian.
+    """
+    status = True
+    new_hashes = {}
+    skipped = 0
+    track_hashes = bool(id_mapping_table) and has_payload_hash_column(id_mapping_table)
 
     # Przygotowujemy listy do API
     to_create = []
@@ -247,6 +1145,9 @@ def generic_sync(
     # Kluczem będzie unikalny identyfikator w danych (np. sku, username)
     item_map = {} 
 
+    # Komunikaty dla pojedynczych rekordów budujemy tylko, jeżeli będą zapisane
+    debug = log.is_debug_enabled()
+
     for row in records:
         try:
             db_id = getattr(row, db_id_column)
@@ -268,81 +1169,113 @@ def generic_sync(
             
             key_field = 'sku' if 'sku' in data else 'username'
             key_value = data.get(key_field)
+            is_update = id_mapping_table and db_id in wc_id_map
             
-            if not key_value:
+            # Klucz jest potrzebny tylko do zmapowania nowo utworzonych rekordów,
+            # aktualizacje (np. kontrahentów bez read-only 'username') mają już ID API
+            if not key_value and not is_update:
                 log.warning(f"Brak klucza identyfikującego ({key_field}) w danych dla {entity_name} ID {db_id}. Pomijanie.")
                 continue
 
-            item_map[key_value] = db_id
+            if track_hashes:
+                payload_hash = compute_payload_hash(data)
+                if is_update and not force and payload_hashes.get(db_id) == payload_hash:
+                    skipped += 1
+                    continue
+                new_hashes[db_id] = payload_hash
+
+            if key_value:
+                item_map[key_value] = db_id
 
-            if id_mapping_table and db_id in wc_id_map:
+            # Element już istnieje w API (np. pełna przebudowa) - aktualizujemy go i zapisujemy mapowanie ponownie
+            if is_update or (key_index and str(key_value) in key_index):
+                # Pola tylko do odczytu (np. username) są odrzucane przez API w aktualizacji - wysyłamy je tylko
+                # przy tworzeniu. Hash jest liczony z pełnych danych, więc porównanie z poprzednim wysłaniem się nie zmienia.
+                data = {field: value for field, value in data.items() if field not in READ_ONLY_FIELDS}
+
+            if not is_update and key_index and str(key_value) in key_index:
+                data["id"] = key_index[str(key_value)]
+                new_hashes.setdefault(db_id, None)
+                to_update.append(data)
+                if debug: log.debug(f"Przygotowano istniejący {entity_name} do aktualizacji: {db_id} -> {data['id']}")
+            elif is_update:
                 data["id"] = wc_id_map[db_id]
                 to_update.append(data)
-                log.debug(f"Przygotowano {entity_name} do aktualizacji: {db_id} -> {data['id']}")
+                if debug: log.debug(f"Przygotowano {entity_name} do aktualizacji: {db_id} -> {data['id']}")
             else:
                 to_create.append(data)
-                log.debug(f"Przygotowano nowy {entity_name} do utworzenia: {db_id}")
+                if debug: log.debug(f"Przygotowano nowy {entity_name} do utworzenia: {db_id}")
                 
         except Exception as e:
             log.error(f"Błąd podczas przetwarzania {entity_name} (ID: {getattr(row, db_id_column, 'N/A') if db_id_column else 'N/A'}): {e}")
             status = False
             continue
 
-    if not to_create and not to_update:
-        log.info(f"Brak danych do wysłania po przetworzeniu zmian {entity_name}.")
-        return True
+    return to_create, to_update, item_map, status, new_hashes, skipped
 
-    # Wykonujemy synchronizację
-    # api_batch_func zwraca (success, created_items, updated_items, deleted_items)
-    success, created_items, updated_items, _ = api_batch_func(
-        creations=to_create,
-        updates=to_update
-    )
-    
-    if not success:
-        log.error(f"Synchronizacja {entity_name} zakończona błędem API.")
-        return False
+def __process_results(entity_name: str, result: tuple, item_map: dict, new_hashes: dict, api_id_map: dict, id_mapping_table: str, db_id_column: str, api_id_column: str, entity: str = "") -> tuple[bool, int, int, list]:
+    """
+    Zapisuje mapowania ID dla nowo utworzonych elementów (oraz hashe wysłanych danych dla utworzonych
+    i zaktualizowanych elementów) i zlicza udane operacje.
+    Mapowania są zapisywane również wtedy, gdy część operacji się nie powiodła,
+    by utworzone elementy nie zostały utworzone ponownie przy następnej synchronizacji.
+
+    Returns:
+        tuple: (success, liczba utworzonych, liczba zaktualizowanych, ID bazy rekordów potwierdzonych przez API)
+    """
+    success, created_items, updated_items, _ = result
+    acknowledged = []
 
     # Zapisujemy nowe mapowania
     # Zakładamy, że created_items zawiera pole 'sku' lub 'username' identyfikujące rekord
+    # (WP API create_user zwraca obiekt user z username, WC API create_product zwraca produkt z sku)
     if id_mapping_table:
+        new_mappings = []
         for item in created_items:
             item_id = item.get("id")
-            
-            # Próbujemy znaleźć klucz
             key = item.get('sku') or item.get('username') or item.get('slug')
-        
-            # Jeśli klucz nie jest wprost w odpowiedzi, a api_batch_func zwraca pełne obiekty API,
-            # to może być problem jeśli API nie zwraca wysłanych pól niestandardowych.
-            # W takim przypadku item_map może pomóc jeśli iterujemy w tej samej kolejności, ale batch nie gwarantuje kolejności.
-            
-            # W przypadku WP API create_user zwraca obiekt user z username.
-            # W przypadku WC API create_product zwraca produkt z sku.
-            
-            if not key:
-                # Fallback: jeśli mamy item_map i tylko jeden element utworzony... to słabe.
-                # W wp_client.py musimy upewnić się, że zwracane obiekty mają to co wysłaliśmy jeśli API tego nie zwraca.
-                pass
 
             if item_id and not item.get("error") and key in item_map:
                 db_id = item_map[key]
-                try:
-                    # Zapytanie MERGE do wstawiania lub aktualizacji mapowania ID w tabeli [ERPFlow].[id_mapping_table]
-                    query = f'''MERGE [ERPFlow].[{id_mapping_table}] AS target
-                        USING (VALUES (?, ?)) AS source ({db_id_column}, {api_id_column})
-                        ON target.{db_id_column} = source.{db_id_column} OR target.{api_id_column} = source.{api_id_column}
-                        WHEN MATCHED THEN
-                            UPDATE SET {db_id_column} = source.{db_id_column}, {api_id_column} = source.{api_id_column}
-                        WHEN NOT MATCHED THEN
-                            INSERT ({db_id_column}, {api_id_column}) VALUES (source.{db_id_column}, source.{api_id_column});'''
-                    con.cursor.execute(query, (db_id, item_id))
-                    log.debug(f"Zmapowano {entity_name} ID {db_id} na API ID {item_id}.")
-                except pyodbc.Error as e:
-                    log.error(f"Błąd zapisu mapowania dla {entity_name} ID {db_id}: {e}")
+                new_mappings.append((db_id, item_id, new_hashes.get(db_id)))
+                acknowledged.append(db_id)
+
+        # Dla zaktualizowanych elementów zapisujemy nowy hash danych (i mapowanie elementów znalezionych przez key_index)
+        for item in updated_items:
+            db_id = api_id_map.get(item.get("id"))
+            if db_id is None:
+                db_id = item_map.get(item.get('sku') or item.get('username'))
+            if db_id is None or item.get("error"):
+                continue
+            acknowledged.append(db_id)
+            if db_id in new_hashes:
+                new_mappings.append((db_id, item["id"], new_hashes[db_id]))
+
+        if new_mappings:
+            try:
+                with profiler.phase(entity, "mappings"):
+                    inserted, updated = save_id_mappings(id_mapping_table, db_id_column, api_id_column, new_mappings)
+                log.info(f"Zapisano mapowania {entity_name}: {inserted} nowych, {updated} zaktualizowanych.")
+            except pyodbc.Error as e:
+                log.error(f"Błąd zapisu {len(new_mappings)} mapowań dla {entity_name}: {e}")
 
     total_updated = len([i for i in updated_items if not i.get("error")])
     total_created = len([i for i in created_items if not i.get("error")])
+    metrics.inc("erpflow_items_total", total_created, entity=entity, operation="create")
+    metrics.inc("erpflow_items_total", total_updated, entity=entity, operation="update")
+    metrics.inc("erpflow_item_errors_total", len(created_items) - total_created, entity=entity, operation="create")
+    metrics.inc("erpflow_item_errors_total", len(updated_items) - total_updated, entity=entity, operation="update")
+    return success, total_created, total_updated, acknowledged
 
-    log.info(f"Zakończono synchronizacje {entity_name}. Utworzono {total_created}, zaktualizowano {total_updated}.")
-    
-    return status
\ No newline at end of file
+def __metric_entity(query_name: str) -> str:
+    """
+    Etykieta encji w metrykach: pierwszy człon nazwy zapytania, np. 'products' dla 'products.incremental'.
+    """
+    return (query_name or "").split(".")[0]
+
+def __acknowledge(id_mapping_table: str, acknowledged: list):
+    """
+    Zapisuje punkt kontrolny bieżącego uruchomienia (jeżeli jest aktywne) dla rekordów potwierdzonych przez API.
+    """
+    if checkpoint_run and id_mapping_table and acknowledged:
+        checkpoints.acknowledge(checkpoint_run, id_mapping_table, acknowledged)
@@ -1,11 +1,53 @@
 import logger as log
-from dotenv import load_dotenv
 import os
+import threading
 import pyodbc
-from woocommerce import API
+from contextlib import contextmanager
+from http_client import ApiClient
 
 __all__ = ["cursor", "wcapi", "conn", "wpapi", "efapi"]
 
+def open_database_connection():
+    """
+    Otwiera nowe, niezależne połączenie z bazą danych MSSQL (nie singleton).
+    Używane tam, gdzie potrzebny jest osobny kursor, np. do strumieniowego czytania wyników
+    równolegle z innymi zapytaniami.
+    Returns:
+        tuple[pyodbc.Cursor, pyodbc.Connection]: Kursor i połączenie.
+    """
+    host = os.getenv('database_host') 
+    database = os.getenv('database_name')
+    user = os.getenv('database_user')
+    password = os.getenv('database_password')
+    domain = os.getenv('database_domain')
+    driver = os.getenv('database_driver', '{ODBC Driver 17 for SQL Server}')
+
+    conn_str_parts = [
+        f"DRIVER={driver}",
+        f"SERVER={host}",
+        f"DATABASE={database}",
+        "TrustServerCertificate=yes",
+    ]
+
+    if user and password:
+        # SQL auth
+        if domain: conn_str_parts.append(f"UID={domain}\\{user}")
+        else: conn_str_parts.append(f"UID={user}")
+        conn_str_parts.append(f"PWD={password}")
+    else:
+        # Windows auth
+        conn_str_parts.append("Trusted_Connection=yes")
+
+    connection_string = ";".join(conn_str_parts)
+
+    connection = pyodbc.connect(connection_string)
+    connection.autocommit = True
+    return connection.cursor(), connection
+
+# Połączenie z bazą i klienci API są tworzeni przy pierwszym użyciu (patrz __getattr__), pod tą blokadą,
+# by wątki synchronizacji odwołujące się do nich jednocześnie nie utworzyły ich dwukrotnie
+__init_lock = threading.RLock()
+
 __conn = None
 __cursor = None
 def __get_database_connection():
@@ -15,140 +57,170 @@ def __get_database_connection():
         pyodbc.Cursor: Kursor do bazy danych MSSQL.
     """
     global __conn, __cursor
-    if __cursor is not None and __conn is not None:
-        return __cursor, __conn
+    with __init_lock:
+        if __cursor is not None and __conn is not None:
+            return __cursor, __conn
+        try:
+            log.debug(f"Łączenie z bazą danych MSSQL na hoście {os.getenv('database_host')}")
+            __cursor, __conn = open_database_connection()
+            log.info("Połączono z bazą danych MSSQL (pyodbc).")
+            return __cursor, __conn
+        except Exception as e:
+            log.error(f"Błąd połączenia z bazą danych: {e}")
+            raise
+
+def reconnect_database():
+    """
+    Zamyka główne połączenie z bazą danych (np. zerwane) i nawiązuje je ponownie.
+    Bezczynne połączenia wątków są zamykane - zostaną otwarte na nowo przy następnym użyciu.
+    """
+    global __conn, __cursor
+    with __init_lock:
+        connections = [__conn] if __conn is not None else []
+        __conn = None
+        __cursor = None
+    with __idle_lock:
+        connections += [connection for _, connection in __idle]
+        __idle.clear()
+    for connection in connections:
+        try:
+            connection.close()
+        except pyodbc.Error:
+            pass
+    return __get_database_connection()
+
+def __is_alive(cursor) -> bool:
+    try:
+        cursor.execute("SELECT 1")
+        cursor.fetchone()
+        return True
+    except pyodbc.Error:
+        return False
+
+# Połączenia otwarte dla pojedynczych wątków (patrz thread_connection)
+__local = threading.local()
+# Połączenia zwolnione przez wątki, używane ponownie przez kolejne (np. w kolejnych cyklach --daemon)
+__idle = []
+__idle_lock = threading.Lock()
+
+@contextmanager
+def thread_connection():
+    """
+    Udostępnia osobne połączenie z bazą danych dla bieżącego wątku.
+    Wewnątrz bloku `with` odwołania do `connections.cursor` i `connections.conn` z tego wątku
+    wskazują na to połączenie, a pozostałe wątki dalej używają głównego.
+    Po wyjściu z bloku połączenie wraca do puli i może zostać użyte ponownie przez inny wątek.
+    """
+    cursor, connection = None, None
+    with __idle_lock:
+        if __idle:
+            cursor, connection = __idle.pop()
+    if cursor is not None and not __is_alive(cursor):
+        log.debug("Połączenie z puli zostało zerwane. Otwieranie nowego.")
+        try:
+            connection.close()
+        except pyodbc.Error:
+            pass
+        cursor = None
+    if cursor is None:
+        cursor, connection = open_database_connection()
+
+    __local.cursor = cursor
+    __local.conn = connection
     try:
-        log.debug(f"Łączenie z bazą danych MSSQL na hoście {os.getenv('database_host')}")
-        
-        host = os.getenv('database_host') 
-        database = os.getenv('database_name')
-        user = os.getenv('database_user')
-        password = os.getenv('database_password')
-        domain = os.getenv('database_domain')
-        driver = os.getenv('database_driver', '{ODBC Driver 17 for SQL Server}')
-
-        conn_str_parts = [
-            f"DRIVER={driver}",
-            f"SERVER={host}",
-            f"DATABASE={database}",
-            "TrustServerCertificate=yes",
-        ]
-
-        if user and password:
-            # SQL auth
-            if domain: conn_str_parts.append(f"UID={domain}\\{user}")
-            else: conn_str_parts.append(f"UID={user}")
-            conn_str_parts.append(f"PWD={password}")
-        else:
-            # Windows auth
-            conn_str_parts.append("Trusted_Connection=yes")
-
-        connection_string = ";".join(conn_str_parts)
-
-        __conn = pyodbc.connect(connection_string)
-        __conn.autocommit = True
-        __cursor = __conn.cursor()
-        log.info("Połączono z bazą danych MSSQL (pyodbc).")
-        return __cursor, __conn
-    except Exception as e:
-        log.error(f"Błąd połączenia z bazą danych: {e}")
-        raise
+        yield cursor
+    finally:
+        __local.cursor = None
+        __local.conn = None
+        with __idle_lock:
+            __idle.append((cursor, connection))
+
+def __getattr__(name):
+    # `cursor` i `conn` zwracają połączenie bieżącego wątku (jeżeli otwarto je przez thread_connection)
+    # lub główne połączenie. Główne połączenie i klienci API są tworzeni dopiero przy pierwszym odwołaniu,
+    # więc np. --setup nie tworzy klientów API, a --tylko-rabaty klienta WooCommerce i WordPress.
+    # Przypisanie wartości (np. con.wcapi = ... w benchmarkach) zastępuje leniwe tworzenie.
+    if name == "cursor":
+        return getattr(__local, "cursor", None) or __cursor or __get_database_connection()[0]
+    if name == "conn":
+        return getattr(__local, "conn", None) or __conn or __get_database_connection()[1]
+    if name == "wcapi":
+        return __wcapi or __get_woocommerce_api()
+    if name == "wpapi":
+        return __wpapi or __get_wordpress_api()
+    if name == "efapi":
+        return __efapi or __get_erpflow_api()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
 
 __wcapi = None
 def __get_woocommerce_api():
     """
     Nawiązuje połączenie z WooCommerce API (singleton).
     Returns:
-        woocommerce.API: Obiekt API WooCommerce.
+        http_client.ApiClient: Klient API WooCommerce (wc/v3).
     """
     global __wcapi
-    if __wcapi is not None:
-        return __wcapi
-    try:
-        __wcapi = API(
-            url=os.getenv("woocommerce_store_url"),
-            consumer_key=os.getenv("woocommerce_consumer_key"),
-            consumer_secret=os.getenv("woocommerce_consumer_secret"),
-            wp_api=True,
-            version="wc/v3",
-            timeout=30
-        )
-        log.info("Połączono z WooCommerce API.")
-        return __wcapi
-    except Exception as e:
-        log.error(f"Błąd połączenia z WooCommerce API: {e}")
-        raise
+    with __init_lock:
+        if __wcapi is not None:
+            return __wcapi
+        try:
+            url = os.getenv("woocommerce_store_url")
+            credentials = (os.getenv("woocommerce_consumer_key"), os.getenv("woocommerce_consumer_secret"))
+            # WooCommerce przyjmuje HTTP Basic tylko przez HTTPS, w pozostałych przypadkach wymaga podpisu OAuth 1.0a
+            if url.startswith("https"):
+                __wcapi = ApiClient(url, "wc/v3", auth=credentials, timeout=30)
+            else:
+                __wcapi = ApiClient(url, "wc/v3", oauth=credentials, timeout=30)
+            log.info("Połączono z WooCommerce API.")
+            return __wcapi
+        except Exception as e:
+            log.error(f"Błąd połączenia z WooCommerce API: {e}")
+            raise
 
 __wpapi = None
 def __get_wordpress_api():
     """
     Nawiązuje połączenie z WordPress API (singleton).
     Returns:
-        wordpress_api.API: Obiekt API WordPress.
+        http_client.ApiClient: Klient API WordPress (wp/v2).
     """
     global __wpapi
-    if __wpapi is not None:
-        return __wpapi
-    try:
-        from wordpress import API
-        __wpapi = API(
-            url=os.getenv("woocommerce_store_url"),
-            consumer_key=os.getenv("woocommerce_consumer_key"),
-            consumer_secret=os.getenv("woocommerce_consumer_secret"),
-            api="wp-json",
-            version="wp/v2",
-            wp_user=os.getenv("wordpress_user"),
-            wp_pass=os.getenv("wordpress_app_password"),
-            basic_auth=True,
-            user_auth=True,
-            timeout=30
-        )
-        log.info("Połączono z WordPress API.")
-        return __wpapi
-    except Exception as e:
-        log.error(f"Błąd połączenia z WordPress API: {e}")
-        raise
+    with __init_lock:
+        if __wpapi is not None:
+            return __wpapi
+        try:
+            __wpapi = ApiClient(
+                os.getenv("woocommerce_store_url"),
+                "wp/v2",
+                auth=(os.getenv("wordpress_user"), os.getenv("wordpress_app_password")),
+                timeout=30
+            )
+            log.info("Połączono z WordPress API.")
+            return __wpapi
+        except Exception as e:
+            log.error(f"Błąd połączenia z WordPress API: {e}")
+            raise
 
 __efapi = None
 def __get_erpflow_api():
     """
     Nawiązuje połączenie z ERPFlow WordPress API (singleton).
     Returns:
-        wordpress_api.API: Obiekt WordPress dla plugina ERPFlow.
+        http_client.ApiClient: Klient API plugina ERPFlow (erp-flow/v1).
     """
     global __efapi
-    if __efapi is not None:
-        return __efapi
-    try:
-        from wordpress import API
-        __efapi = API(
-            url=os.getenv("woocommerce_store_url"),
-            consumer_key=os.getenv("woocommerce_consumer_key"),
-            consumer_secret=os.getenv("woocommerce_consumer_secret"),
-            api="wp-json",
-            version="erp-flow/v1",
-            wp_user=os.getenv("wordpress_user"),
-            wp_pass=os.getenv("wordpress_app_password"),
-            basic_auth=True,
-            user_auth=True,
-            timeout=30
-        )
-        log.info("Połączono z ERPFlow WordPress API.")
-        return __efapi
-    except Exception as e:
-        log.error(f"Błąd połączenia z ERPFlow WordPress API: {e}")
-        raise
-
-def initialize():
-    global cursor, conn, wcapi, wpapi, efapi
-    load_dotenv()
-    cursor, conn = __get_database_connection()
-    wcapi = __get_woocommerce_api()
-    wpapi = __get_wordpress_api()
-    efapi = __get_erpflow_api()
-
-cursor = None
-conn = None
-wcapi = None
-wpapi = None
-efapi = None
\ No newline at end of file
+    with __init_lock:
+        if __efapi is not None:
+            return __efapi
+        try:
+            __efapi = ApiClient(
+                os.getenv("woocommerce_store_url"),
+                "erp-flow/v1",
+                auth=(os.getenv("wordpress_user"), os.getenv("wordpress_app_password")),
+                timeout=30
+            )
+            log.info("Połączono z ERPFlow WordPress API.")
+            return __efapi
+        except Exception as e:
+            log.error(f"Błąd połączenia z ERPFlow WordPress API: {e}")
+            raise
@@ -1,38 +1,83 @@
 import os
 import comarch_client as db
+import sql
 import connections as con
 import logger as log
 import wp_client as wp
+import wc_client as wc
 import args
+import reconcile as reconcile_module
 
 def get_incremental_query(database_name, last_sync_timestamp):
-    return f'''
+    """
+    Zwraca (zapytanie, parametry) pobierające kontrahentów zmienionych od ostatniej synchronizacji (temporal tables).
+    """
+    knt_osoby = sql.table(database_name, 'CDN', 'KntOsoby')
+    last_sync = sql.to_datetime(last_sync_timestamp)
+    query = f'''
         SELECT DISTINCT 
             ko.KnO_KnOId,
             ko.KnO_KntId,
             ko.KnO_Nazwisko,
             ko.KnO_Email
-        FROM [{database_name}].[CDN].[KntOsoby] ko
+        FROM {knt_osoby} ko
         WHERE 
             -- Zmiany w KntOsoby od ostatniej synchronizacji
             EXISTS (
                 SELECT 1 
-                FROM [{database_name}].[CDN].[KntOsoby]
-                FOR SYSTEM_TIME BETWEEN '{last_sync_timestamp}' AND '{db.sync_start_timestamp}' AS kh
+                FROM {knt_osoby}
+                FOR SYSTEM_TIME BETWEEN ? AND ? AS kh
                 WHERE kh.KnO_KnOId = ko.KnO_KnOId
-                AND kh.ValidFrom > '{last_sync_timestamp}'
+                AND kh.ValidFrom > ?
             )
     '''
+    return query, (last_sync, sql.to_datetime(db.sync_start_timestamp), last_sync)
+
+def get_change_tracking_query(database_name, last_sync_version):
+    """
+    Zwraca (zapytanie, parametry) pobierające kontrahentów zmienionych od wersji ostatniej synchronizacji (Change Tracking).
+    """
+    knt_osoby = sql.table(database_name, 'CDN', 'KntOsoby')
+    query = f'''
+        SELECT DISTINCT 
+            ko.KnO_KnOId,
+            ko.KnO_KntId,
+            ko.KnO_Nazwisko,
+            ko.KnO_Email
+        FROM {knt_osoby} ko
+        -- Zmiany w KntOsoby od wersji ostatniej synchronizacji
+        INNER JOIN CHANGETABLE(CHANGES {knt_osoby}, ?) ct
+            ON ct.KnO_KnOId = ko.KnO_KnOId
+    '''
+    return query, (int(last_sync_version),)
 
 def get_full_query(database_name):
-    return f'''
+    """
+    Zwraca (zapytanie, parametry) pobierające wszystkich kontrahentów.
+    """
+    query = f'''
         SELECT DISTINCT 
             ko.KnO_KnOId,
             ko.KnO_KntId,
             ko.KnO_Nazwisko,
             ko.KnO_Email
-        FROM [{database_name}].[CDN].[KntOsoby] ko
+        FROM {sql.table(database_name, 'CDN', 'KntOsoby')} ko
     '''
+    return query, ()
+
+def prefetch_contractor_changes(records, last_sync_timestamp, force):
+    """
+    Pobiera zmiany w tabeli KntOsoby dla wszystkich kontrahentów naraz.
+    """
+    db.prefetch_changed_columns(
+        table_name='KntOsoby',
+        columns=['KnO_Nazwisko', 'KnO_Email'],
+        record_ids=[row.KnO_KnOId for row in records],
+        id_column='KnO_KnOId',
+        last_sync=last_sync_timestamp,
+        current_time=db.sync_start_timestamp,
+        force=force
+    )
 
 def map_contractor_to_wp(contractor, last_sync_timestamp, force):    
     # Tworzymy username
@@ -90,9 +135,50 @@ def map_contractor_to_wp(contractor, last_sync_timestamp, force):
 
     return data
 
-def sync(add_all=None, force=None) -> bool:
+def map_contractor_to_wc(contractor, last_sync_timestamp, force):
+    """
+    Mapuje kontrahenta na klienta WooCommerce (wc/v3/customers).
+    Pola są takie same jak dla użytkownika WordPress, z tą różnicą, że rola jest nadawana przez WooCommerce,
+    a `erp_business` jest zapisywane jako meta dane klienta.
+    """
+    data = map_contractor_to_wp(contractor, last_sync_timestamp, force)
+    data.pop("roles", None)
+
+    business_id = data.pop("erp_business", None)
+    if business_id is not None:
+        data["meta_data"] = [{"key": "erp_business", "value": business_id}]
+
+    return data
+
+def get_transport(transport=None) -> tuple:
+    """
+    Zwraca (funkcję mapującą, funkcję batch) dla wybranego API kontrahentów:
+    'wp' - wp/v2/users (jedno żądanie na użytkownika), 'wc' - wc/v3/customers/batch (do 100 klientów na żądanie).
+    """
+    if transport is None and args.args is not None:
+        transport = getattr(args.args, 'contractors_api', None)
+
+    if transport == 'wc':
+        return map_contractor_to_wc, wc.batch_sync_customers
+    return map_contractor_to_wp, wp.batch_sync_users
+
+def get_username_index(transport=None) -> dict:
+    """
+    Zwraca {nazwa użytkownika: ID} wszystkich klientów sklepu (użytkowników z rolą 'customer').
+    """
+    _, batch_func = get_transport(transport)
+    if batch_func is wc.batch_sync_customers:
+        users = con.wcapi.get_all("customers", {"role": "customer", "_fields": "id,username"})
+    else:
+        users = con.wpapi.get_all("users", {"context": "edit", "roles": "customer", "_fields": "id,username"})
+    return {user["username"]: user["id"] for user in users if user.get("username")}
+
+def sync(add_all=None, force=None, transport=None, streaming=None) -> bool:
     """
     Synchronizuje kontrahentów między bazą danych MSSQL a WordPress.
+
+    :param transport: API używane do synchronizacji: 'wp' (domyślnie, wp/v2/users) lub 'wc' (wc/v3/customers/batch).
+    :param streaming: Pobieranie, mapowanie i wysyłanie paczkami (patrz `generic_sync`).
     """
     # Argumenty
     if args.args is not None:
@@ -100,9 +186,13 @@ def sync(add_all=None, force=None) -> bool:
             add_all = getattr(args.args, 'full_rebuild', False) or getattr(args.args, 'regeneruj', False)
         if force is None:
             force = getattr(args.args, 'force', False)
+        if streaming is None:
+            streaming = getattr(args.args, 'streaming', False)
             
     add_all = bool(add_all) if add_all is not None else False
     force = bool(force) if force is not None else False
+    streaming = bool(streaming) if streaming is not None else False
+    mapper, batch_func = get_transport(transport)
 
     database_name = os.getenv("database_name")
     if not database_name:
@@ -112,30 +202,60 @@ def sync(add_all=None, force=None) -> bool:
     last_sync_timestamp = db.sync_state.get('last_sync_timestamp')
     has_previous_sync = last_sync_timestamp is not None
     use_incremental = has_previous_sync and not add_all
+    last_sync_version = None
 
-    if use_incremental:
-        query = get_incremental_query(database_name, last_sync_timestamp)
+    # Change Tracking nie przechowuje poprzednich wartości kolumn - wysyłamy pełne dane zmienionych kontrahentów
+    if db.change_backend == db.CHANGE_TRACKING:
+        last_sync_version = db.get_last_sync_version(['KntOsoby']) if use_incremental else None
+        use_incremental = last_sync_version is not None
+        last_sync_timestamp = None
+
+    if use_incremental and db.change_backend == db.CHANGE_TRACKING:
+        query_name = "contractors.changes"
+        query, params = get_change_tracking_query(database_name, last_sync_version)
+        log.info("Rozpoczynanie synchronizacji przyrostowej kontrahentów (Change Tracking)...")
+    elif use_incremental:
+        query_name = "contractors.incremental"
+        query, params = get_incremental_query(database_name, last_sync_timestamp)
         log.info("Rozpoczynanie synchronizacji przyrostowej kontrahentów...")
     else:
-        query = get_full_query(database_name)
+        query_name = "contractors.full"
+        query, params = get_full_query(database_name)
         if last_sync_timestamp:
             log.info("Pełna przebudowa: pobieranie wszystkich kontrahentów.")
         else:
             log.info("Brak poprzedniej synchronizacji. Pobieranie wszystkich kontrahentów.")
 
-    return db.generic_sync(
-        entity_name="kontrahentów",
-        fetch_query=query,
-        id_mapping_table="KontrahenciIDs",
-        db_id_column="KnO_KnOId",
-        api_id_column="WC_ID", # Używamy tej samej nazwy kolumny WC_ID w tabeli, choć to WP User ID
-        data_mapper_func=map_contractor_to_wp,
-        api_batch_func=wp.batch_sync_users,
-        last_sync_timestamp=last_sync_timestamp,
-        rebuild=add_all,
-        force=force
+    # Kontrahenci usunięci z bazy (przyrostowo z historii / Change Tracking, przy pełnej synchronizacji przez anti-join)
+    deleted_query, deleted_params = db.get_deleted_query(
+        database_name, 'KntOsoby', 'KnO_KnOId', 'KontrahenciIDs', 'WC_ID',
+        last_sync_timestamp=last_sync_timestamp if use_incremental else None,
+        last_sync_version=last_sync_version if use_incremental else None
     )
 
+    try:
+        return db.generic_sync(
+            entity_name="kontrahentów",
+            fetch_query=query,
+            fetch_params=params,
+            query_name=query_name,
+            deleted_query=deleted_query,
+            deleted_params=deleted_params,
+            id_mapping_table="KontrahenciIDs",
+            db_id_column="KnO_KnOId",
+            api_id_column="WC_ID", # Używamy tej samej nazwy kolumny WC_ID w tabeli, choć to WP User ID
+            data_mapper_func=mapper,
+            api_batch_func=batch_func,
+            last_sync_timestamp=last_sync_timestamp,
+            rebuild=add_all,
+            force=force,
+            prefetch_func=prefetch_contractor_changes,
+            chunk_size=db.get_stream_chunk_size() if streaming else None,
+            key_index_func=lambda: get_username_index(transport)
+        )
+    finally:
+        db.clear_changed_columns_cache('KntOsoby', 'KnO_KnOId')
+
 def regenerate():
     """
     Usuwa wszystkich zsynchronizowanych kontrahentów z WordPress i synchronizuje ponownie.
@@ -149,8 +269,8 @@ def regenerate():
 
         if ids:
             log.info(f"Znaleziono {len(ids)} kontrahentów do usunięcia z WordPress.")
-            # Używamy wp_client do usuwania
-            wp.batch_sync_users(deletions=ids)
+            _, batch_func = get_transport()
+            batch_func(deletions=ids)
 
             # Czyścimy tabelę
             con.cursor.execute('DELETE FROM [ERPFlow].[KontrahenciIDs]')
@@ -170,11 +290,46 @@ def regenerate():
         if success:
             log.info("Regeneracja kontrahentów zakończona pomyślnie.")
             # Aktualizujemy timestamp na teraz, by kolejne uruchomienie było przyrostowe
-            if db.sync_start_timestamp:
-                db.sync_state['last_sync_timestamp'] = db.sync_start_timestamp
-                db.save_sync_state()
+            db.update_sync_watermark()
+            db.save_sync_state()
         else:
             log.error("Regeneracja kontrahentów zakończona z błędami.")
 
     except Exception as e:
         log.error(f"Błąd podczas regeneracji kontrahentów: {e}", stack_info=True)
+
+def reconcile(transport=None) -> bool:
+    """
+    Uzgadnia użytkowników sklepu z kontrahentami po nazwie użytkownika (--uzgodnij), wysyłając tylko
+    potrzebne zmiany i odbudowując tabelę KontrahenciIDs (patrz `reconcile.run`).
+    Pobierani są tylko użytkownicy z rolą 'customer'.
+    """
+    mapper, batch_func = get_transport(transport)
+
+    database_name = os.getenv("database_name")
+    if not database_name:
+        log.error("Nie znaleziono nazwy bazy danych w zmiennych środowiskowych.")
+        return False
+
+    if batch_func is wc.batch_sync_customers:
+        list_func = lambda: con.wcapi.get_all("customers", {"role": "customer", "_fields": "id,username,email,first_name,last_name,meta_data"})
+    else:
+        list_func = lambda: con.wpapi.get_all("users", {"context": "edit", "roles": "customer", "_fields": "id,username,email,first_name,last_name,roles,erp_business"})
+
+    query, params = get_full_query(database_name)
+    try:
+        return reconcile_module.run(
+            entity_name="kontrahentów",
+            fetch_query=query,
+            fetch_params=params,
+            query_name="contractors.full",
+            list_func=list_func,
+            key_field="username",
+            data_mapper_func=mapper,
+            api_batch_func=batch_func,
+            id_mapping_table="KontrahenciIDs",
+            db_id_column="KnO_KnOId",
+            api_id_column="WC_ID"
+        )
+    finally:
+        db.clear_changed_columns_cache('KntOsoby', 'KnO_KnOId')
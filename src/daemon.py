@@ -0,0 +1,118 @@
+import os
+import time
+import signal
+import threading
+import pyodbc
+import logger as log
+import connections as con
+import comarch_client as db
+
+__all__ = ["run"]
+
+DEFAULT_POLL_INTERVAL = 5.0  # Co ile sekund sprawdzać, czy w bazie są zmiany
+DEFAULT_DEBOUNCE = 3.0       # Ile sekund bez nowych zmian czekać przed synchronizacją
+DEFAULT_MAX_DELAY = 30.0     # Maksymalne opóźnienie synchronizacji przy ciągłych zmianach
+MAX_RETRY_DELAY = 300.0      # Maksymalny odstęp między próbami po błędzie
+
+def __get_seconds(name: str, default: float) -> float:
+    value = os.getenv(name)
+    try:
+        return max(0.0, float(value)) if value else default
+    except ValueError:
+        log.warning(f"Nieprawidłowa wartość zmiennej środowiskowej {name}: '{value}'. Używam {default}.")
+        return default
+
+def run(sync_func, tables: list[str]):
+    """
+    Uruchamia synchronizację w trybie ciągłym (--daemon).
+
+    Połączenia z bazą danych i sklepem pozostają otwarte między cyklami. Co `daemon_poll_interval`
+    sekund sprawdzany jest znacznik ostatniej zmiany tabel (patrz `get_change_marker`). Po wykryciu zmian
+    synchronizacja startuje, gdy przez `daemon_debounce` sekund nie pojawią się kolejne, ale nie później
+    niż `daemon_max_delay` sekund od pierwszej zmiany - seria edycji w ERP daje jeden cykl synchronizacji.
+    Pierwszy cykl rusza od razu i nadrabia zmiany od ostatniej synchronizacji.
+
+    Po zerwaniu połączenia z bazą danych połączenie jest odtwarzane, a nieudany cykl powtarzany
+    z rosnącym odstępem. Daemon kończy pracę po SIGINT/SIGTERM (po zakończeniu bieżącego cyklu).
+
+    Args:
+        sync_func: Funkcja wykonująca jeden cykl synchronizacji, zwraca True przy sukcesie.
+        tables: Tabele (temporalne) w schemacie CDN, w których wykrywane są zmiany.
+    """
+    poll_interval = __get_seconds("daemon_poll_interval", DEFAULT_POLL_INTERVAL) or DEFAULT_POLL_INTERVAL
+    debounce = __get_seconds("daemon_debounce", DEFAULT_DEBOUNCE)
+    max_delay = max(debounce, __get_seconds("daemon_max_delay", DEFAULT_MAX_DELAY))
+
+    stop = threading.Event()
+    def handle_signal(signum, frame):
+        log.info("Otrzymano sygnał zakończenia. Daemon zakończy pracę po bieżącym cyklu.")
+        stop.set()
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    log.info(f"Uruchomiono tryb daemon (sprawdzanie zmian co {poll_interval:g} s, opóźnienie {debounce:g}-{max_delay:g} s).")
+
+    last_marker = None
+    first_change = None   # Czas pierwszej niezsynchronizowanej zmiany
+    due = time.monotonic()  # Czas następnego cyklu synchronizacji (None - brak zmian)
+    retry_delay = poll_interval
+    reconnect_delay = poll_interval
+
+    while not stop.is_set():
+        # Sprawdzenie zmian
+        try:
+            marker = db.get_change_marker(tables)
+        except pyodbc.Error as e:
+            log.warning(f"Błąd połączenia z bazą danych: {e}. Ponowne łączenie za {reconnect_delay:g} s.")
+            if stop.wait(reconnect_delay):
+                break
+            reconnect_delay = min(reconnect_delay * 2, MAX_RETRY_DELAY)
+            try:
+                con.reconnect_database()
+            except Exception:
+                pass
+            continue
+        reconnect_delay = poll_interval
+
+        now = time.monotonic()
+        if last_marker is not None and marker != last_marker:
+            if first_change is None:
+                first_change = now
+                log.debug("Wykryto zmiany w bazie danych.")
+            # Każda kolejna zmiana przesuwa synchronizację, ale nie dalej niż max_delay od pierwszej
+            due = min(now + debounce, first_change + max_delay)
+        last_marker = marker
+
+        # Cykl synchronizacji
+        if due is not None and now >= due:
+            started = time.monotonic()
+            log.info("Rozpoczęto cykl synchronizacji.")
+            try:
+                db.save_sync_start_timestamp()
+                success = sync_func()
+            except pyodbc.Error as e:
+                log.error(f"Błąd bazy danych podczas synchronizacji: {e}")
+                success = False
+                try:
+                    con.reconnect_database()
+                except Exception:
+                    pass
+            except Exception as e:
+                log.error(f"Błąd podczas synchronizacji: {e}")
+                success = False
+
+            if success:
+                log.info(f"Zakończono cykl synchronizacji w {time.monotonic() - started:.1f} s.")
+                first_change = None
+                due = None
+                retry_delay = poll_interval
+            else:
+                log.warning(f"Cykl synchronizacji zakończony błędami. Ponowna próba za {retry_delay:g} s.")
+                due = time.monotonic() + retry_delay
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+
+        # Czekanie do następnego sprawdzenia (krócej, jeżeli wcześniej wypada cykl synchronizacji)
+        wait = poll_interval if due is None else max(0.0, min(poll_interval, due - time.monotonic()))
+        stop.wait(wait)
+
+    log.info("Zakończono tryb daemon.")
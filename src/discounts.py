@@ -2,13 +2,13 @@ import args
 import os
 import logger as log
 import comarch_client as db
-from requests.exceptions import HTTPError
-import time
+import sql
 import efwp_client as efwp
+import batch_dispatcher
 from decimal import *
 getcontext().prec = 2
 
-def get_incremental_query(database_name, last_sync_timestamp):
+def __select(database_name):
     return f'''
         SELECT DISTINCT 
             r.Rab_RabId,
@@ -20,47 +20,60 @@ def get_incremental_query(database_name, last_sync_timestamp):
 			r.Rab_Cena,
 			r.Rab_DataOd,
 			r.Rab_DataDo
-        FROM [{database_name}].[CDN].[Rabaty] r
-        INNER JOIN [{database_name}].[ERPFlow].[TowarIDs] ti
-	        ON r.Rab_TwrId = ti.Twr_TwrId
+        FROM {sql.table(database_name, 'CDN', 'Rabaty')} r
+        INNER JOIN {sql.table(database_name, 'ERPFlow', 'TowarIDs')} ti
+	        ON r.Rab_TwrId = ti.Twr_TwrId'''
+
+def get_incremental_query(database_name, last_sync_timestamp):
+    """
+    Zwraca (zapytanie, parametry) pobierające zniżki zmienione od ostatniej synchronizacji (temporal tables).
+    """
+    last_sync = sql.to_datetime(last_sync_timestamp)
+    query = f'''{__select(database_name)}
         WHERE r.Rab_PodmiotTyp = 1
         --AND r.Rab_TypCenyNB = 2
         AND (
             -- Zmiany w tabeli Rabaty od ostatniej synchronizacji
             EXISTS (
-                SELECT 1 FROM [{database_name}].[CDN].[Rabaty] 
-                FOR SYSTEM_TIME BETWEEN '{last_sync_timestamp}' AND '{db.sync_start_timestamp}' rh
+                SELECT 1 FROM {sql.table(database_name, 'CDN', 'Rabaty')} 
+                FOR SYSTEM_TIME BETWEEN ? AND ? rh
                 WHERE rh.Rab_RabId = r.Rab_RabId
-                AND rh.ValidFrom > '{last_sync_timestamp}'
+                AND rh.ValidFrom > ?
             )
         )
     '''
+    return query, (last_sync, sql.to_datetime(db.sync_start_timestamp), last_sync)
+
+def get_change_tracking_query(database_name, last_sync_version):
+    """
+    Zwraca (zapytanie, parametry) pobierające zniżki zmienione od wersji ostatniej synchronizacji (Change Tracking).
+    """
+    query = f'''{__select(database_name)}
+        -- Zmiany w tabeli Rabaty od wersji ostatniej synchronizacji
+        INNER JOIN CHANGETABLE(CHANGES {sql.table(database_name, 'CDN', 'Rabaty')}, ?) ct
+            ON ct.Rab_RabId = r.Rab_RabId
+        WHERE r.Rab_PodmiotTyp = 1
+        --AND r.Rab_TypCenyNB = 2
+    '''
+    return query, (int(last_sync_version),)
 
 def get_full_query(database_name):
-    return f'''
-        SELECT DISTINCT 
-            r.Rab_RabId,
-            r.Rab_Typ,
-            r.Rab_TwrId,
-            ti.WC_ID,
-			r.Rab_PodmiotId,
-			r.Rab_Rabat,
-			r.Rab_Cena,
-			r.Rab_DataOd,
-			r.Rab_DataDo
-        FROM [{database_name}].[CDN].[Rabaty] r
-        INNER JOIN [{database_name}].[ERPFlow].[TowarIDs] ti
-	        ON r.Rab_TwrId = ti.Twr_TwrId
+    """
+    Zwraca (zapytanie, parametry) pobierające wszystkie zniżki.
+    """
+    query = f'''{__select(database_name)}
         WHERE r.Rab_PodmiotTyp = 1
         --AND r.Rab_TypCenyNB = 2
     '''
+    return query, ()
 
-def sync(add_all=None, skip_free=None, force=None) -> bool:
+def sync(add_all=None, skip_free=None, force=None, streaming=None) -> bool:
     """
     Synchronizuje zniżki między bazą danych MSSQL a WooCommerce, uwzględniając zniżki dla kontrahentów.
     
     :param skip_free: Flaga określająca, czy pomijać darmowe towary (cena 0). Domyślnie True.
     :param force: Flaga wymuszająca synchronizację, nawet jeśli nie wykryto zmian.
+    :param streaming: Flaga włączająca pobieranie, mapowanie i wysyłanie paczkami (patrz `generic_sync`).
 
     :return: True jeżeli wszystko zostało zsynchronizowane, False jeżeli nastąpiły błędy.
     """
@@ -73,6 +86,8 @@ def sync(add_all=None, skip_free=None, force=None) -> bool:
             skip_free = not getattr(args.args, 'obejmuj_darmowe_towary', False)
         if force is None:
             force = getattr(args.args, 'force', False)
+        if streaming is None:
+            streaming = getattr(args.args, 'streaming', False)
             
     database_name = os.getenv("database_name")
     if not database_name:
@@ -83,11 +98,22 @@ def sync(add_all=None, skip_free=None, force=None) -> bool:
     has_previous_sync = last_sync_timestamp is not None
     use_incremental = has_previous_sync and not add_all
 
-    if use_incremental:
-        query = get_incremental_query(database_name, last_sync_timestamp)
+    if db.change_backend == db.CHANGE_TRACKING:
+        last_sync_version = db.get_last_sync_version(['Rabaty']) if use_incremental else None
+        use_incremental = last_sync_version is not None
+        last_sync_timestamp = None
+
+    if use_incremental and db.change_backend == db.CHANGE_TRACKING:
+        query_name = "discounts.changes"
+        query, params = get_change_tracking_query(database_name, last_sync_version)
+        log.info("Rozpoczynanie synchronizacji przyrostowej zniżek (Change Tracking)...")
+    elif use_incremental:
+        query_name = "discounts.incremental"
+        query, params = get_incremental_query(database_name, last_sync_timestamp)
         log.info("Rozpoczynanie synchronizacji przyrostowej zniżek...")
     else: 
-        query = get_full_query(database_name)
+        query_name = "discounts.full"
+        query, params = get_full_query(database_name)
         if last_sync_timestamp:
             log.info("Pełna przebudowa: pobieranie wszystkich zniżek.")
         else:
@@ -96,12 +122,15 @@ def sync(add_all=None, skip_free=None, force=None) -> bool:
     return db.generic_sync(
         entity_name="zniżek",
         fetch_query=query,
+        fetch_params=params,
+        query_name=query_name,
         data_mapper_func=lambda row, ls, f: map_discount_to_efwp(row, ls, f, skip_free=skip_free),
         api_batch_func=batch_sync_discounts,
         db_id_column="Rab_RabId",
         last_sync_timestamp=last_sync_timestamp,
         rebuild=add_all,
-        force=force
+        force=force,
+        chunk_size=db.get_stream_chunk_size() if streaming else None
     )
 
 def map_discount_to_efwp(discount, last_sync_timestamp, force, skip_free=False):
@@ -156,6 +185,7 @@ def batch_sync_discounts(creations: list[dict] = None, updates: list[dict] = Non
     """
     Wysyła batchowe żądania do WooCommerce API dla tworzenia, aktualizacji i usuwania zniżek kontrahentów.
     Wszystkie trzy operacje mogą być wykonane w jednym żądaniu batch.
+    Partie są wysyłane równolegle przez `batch_dispatcher` z limitem żądań dla 'prices/batch'.
     
     :param creations: Lista słowników z danymi zniżek do utworzenia.
     :param updates: Lista słowników z danymi zniżek do zaktualizowania (musi zawierać 'id').
@@ -167,117 +197,13 @@ def batch_sync_discounts(creations: list[dict] = None, updates: list[dict] = Non
         - updated_items: Lista zaktualizowanych zniżek z odpowiedzi API
         - deleted_items: Lista usuniętych zniżek z odpowiedzią API
     """
-    creations = creations or []
-    updates = updates or []
-    deletions = deletions or []
-    
-    if not creations and not updates and not deletions:
-        log.debug("Brak danych do synchronizacji z WooCommerce.")
-        return True, [], [], []
-    
-    batch_size = 100  # Aby nie wysyłać jednego ogromnego żądania do WooCommerce, dzielimy na partie po 100 zniżek
-    status = True
-    all_created = []
-    all_updated = []
-    all_deleted = []
-
-    log.debug(f"Rozpoczynanie operacji w WooCommerce: {len(creations)} utworzeń, {len(updates)} aktualizacji, {len(deletions)} usunięć.")
-    
-    # Indeksy do śledzenia progressu w każdej liście
-    create_idx = 0
-    update_idx = 0
-    delete_idx = 0
-    
-    while create_idx < len(creations) or update_idx < len(updates) or delete_idx < len(deletions):
-        # Budujemy batch
-        creations_data = list()
-        updates_data = list()
-        deletions_data = list()
-
-        batch_created_count = 0
-        batch_updated_count = 0
-        batch_deleted_count = 0
-        
-        # Dodajemy tworzenia
-        if create_idx < len(creations):
-            remaining = batch_size - (batch_created_count + batch_updated_count + batch_deleted_count)
-            creations_data = creations[create_idx:create_idx + remaining]
-            batch_created_count = len(creations_data)
-            
-        
-        # Dodajemy aktualizacje
-        if update_idx < len(updates):
-            remaining = batch_size - (batch_created_count + batch_updated_count + batch_deleted_count)
-            updates_data = updates[update_idx:update_idx + remaining]
-            batch_updated_count = len(updates_data)
-        
-        # Dodajemy usunięcia
-        if delete_idx < len(deletions):
-            remaining = batch_size - (batch_created_count + batch_updated_count + batch_deleted_count)
-            deletions_data = deletions[delete_idx:delete_idx + remaining]
-            batch_deleted_count = len(deletions_data)
-        
-        if not creations_data and not updates_data and not deletions_data:
-            break
-        
-        try:
-            response = efwp.batch_prices(upsert=creations_data, update=updates_data, delete=deletions_data)
-            
-            # Przetwarzamy utworzone zniżki
-            created = response.get("upsert", [])
-            for item in created:
-                if item.get("error"):
-                    log.error(f"Błąd podczas tworzenia zniżki (ID: {item.get('id', 'N/A')}): {item.get('error')}")
-                    status = False
-                else:
-                    log.info(f"Utworzono zniżke '{item.get('name', 'N/A')}' w WooCommerce (ID: {item.get('id')}).")
-            all_created.extend(created)
-            create_idx += batch_created_count
-            
-            # Przetwarzamy zaktualizowane zniżki
-            updated = response.get("update", [])
-            for item in updated:
-                if item.get("error"):
-                    log.error(f"Błąd podczas aktualizacji zniżki (ID: {item.get('id', 'N/A')}): {item.get('error')}")
-                    status = False
-                else:
-                    log.info(f"Zaktualizowano zniżkę '{item.get('name', 'N/A')}' w WooCommerce (ID: {item.get('id')}).")
-            all_updated.extend(updated)
-            update_idx += batch_updated_count
-            
-            # Przetwarzamy usunięte zniżki
-            deleted = response.get("delete", [])
-            for item in deleted:
-                if item.get("error"):
-                    log.error(f"Błąd podczas usuwania zniżki (ID: {item.get('id', 'N/A')}): {item.get('error')}")
-                    status = False
-                else:
-                    log.info(f"Usunięto zniżkę z WooCommerce (ID: {item.get('id')}).")
-            all_deleted.extend(deleted)
-            delete_idx += batch_deleted_count
-            
-            time.sleep(1)  # Krótkie opóźnienie między partiami aby uniknąć limitów API
-            
-        except HTTPError as http_err:
-            log.error(f"Błąd HTTP podczas batchowej synchronizacji zniżek: {http_err}")
-            status = False
-            break
-        except Exception as e:
-            log.error(f"Błąd podczas batchowej synchronizacji zniżek: {e}")
-            status = False
-            break
-
-    # Wyświetlamy podsumowanie
-    successful_created_count = len([i for i in all_created if not i.get("error")])
-    successful_updated_count = len([i for i in all_updated if not i.get("error")])
-    successful_deleted_count = len([i for i in all_deleted if not i.get("error")])
-    stats = []
-    if creations:
-        stats.append(f"{successful_created_count}/{len(creations)} utworzonych")
-    if updates:
-        stats.append(f"{successful_updated_count}/{len(updates)} zaktualizowanych")
-    if deletions:
-        stats.append(f"{successful_deleted_count}/{len(deletions)} usuniętych")
-    log.debug("Zakończono synchornizacje: " + ", ".join(stats) + " zniżek.")
-
-    return status, all_created, all_updated, all_deleted
\ No newline at end of file
+    return batch_dispatcher.batch_sync(
+        endpoint="prices/batch",
+        send_func=lambda batch: efwp.batch_prices(upsert=batch.get("create"), update=batch.get("update"), delete=batch.get("delete")),
+        creations=creations,
+        updates=updates,
+        deletions=deletions,
+        names=("zniżkę", "zniżki", "zniżek"),
+        target="ERPFlow",
+        response_keys=("upsert", "update", "delete")
+    )
@@ -62,7 +62,7 @@ def update_price_by_product(data):
     """
     try:
         # Endpoint POST /prices (tak jak przy tworzeniu, ale logika serwera obsługuje aktualizację jeśli istnieje)
-        response = con.efapi.post("prices", data)
+        response = con.efapi.post("prices", data, idempotent=True)
         if response.status_code in [200, 201]:
             return response.json()
         else:
@@ -105,7 +105,7 @@ def update_price_by_id(price_id, data):
         dict: Zaktualizowany obiekt ceny lub słownik z błędem.
     """
     try:
-        response = con.efapi.post(f"prices/{price_id}", data)
+        response = con.efapi.post(f"prices/{price_id}", data, idempotent=True)
         if response.status_code == 200:
             return response.json()
         else:
@@ -163,7 +163,8 @@ def batch_prices(create=None, update=None, delete=None, upsert=None):
         return {}
 
     try:
-        response = con.efapi.post("prices/batch", data)
+        # Upsert i aktualizacje można bezpiecznie ponowić, tworzenie nie
+        response = con.efapi.post("prices/batch", data, idempotent=not create)
         if response.status_code in [200, 201]:
             return response.json()
         else:
@@ -247,7 +248,7 @@ def update_visibility_rule(rule_id, data):
         dict: Zaktualizowana reguła lub słownik z błędem.
     """
     try:
-        response = con.efapi.post(f"visibility/{rule_id}", data)
+        response = con.efapi.post(f"visibility/{rule_id}", data, idempotent=True)
         if response.status_code == 200:
             return response.json()
         else:
@@ -302,7 +303,7 @@ def batch_visibility_rules(create=None, update=None, delete=None):
         return {}
 
     try:
-        response = con.efapi.post("visibility/batch", data)
+        response = con.efapi.post("visibility/batch", data, idempotent=not create)
         if response.status_code in [200, 201]:
             return response.json()
         else:
@@ -0,0 +1,374 @@
+import os
+import gzip
+import json
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit, urlencode
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.exceptions import NewConnectionError
+import logger as log
+
+__all__ = ["ApiClient", "CircuitBreaker", "get_session", "get_circuit_breaker", "get_retry_stats", "log_retry_stats"]
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_TIMEOUT = 30
+GZIP_MIN_BYTES = 1024  # Mniejszych treści nie opłaca się kompresować
+USER_AGENT = "ERPFlow"
+
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_RETRY_BASE_DELAY = 1.0  # Sekund, podwajane przy każdej próbie
+DEFAULT_RETRY_MAX_DELAY = 60.0
+DEFAULT_CIRCUIT_THRESHOLD = 5  # Kolejnych błędów przeciążenia, po których wstrzymujemy żądania do hosta
+DEFAULT_CIRCUIT_COOLDOWN = 30.0
+RETRY_STATUSES = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+# Hosty, które odrzuciły skompresowaną treść żądania
+gzip_rejected_hosts = set()
+
+__sessions = {}
+__sessions_lock = threading.Lock()
+def get_session(url: str) -> requests.Session:
+    """
+    Zwraca współdzieloną sesję HTTP dla hosta z adresu `url` (singleton na host).
+    Sesja utrzymuje pulę połączeń keep-alive o rozmiarze `http_pool_size` (zmienna środowiskowa),
+    dzięki czemu wszystkie klienty API korzystają z tych samych połączeń TLS.
+    """
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    with __sessions_lock:
+        session = __sessions.get(host)
+        if session is None:
+            pool_size = int(os.getenv("http_pool_size") or DEFAULT_POOL_SIZE)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount(f"{parts.scheme}://", adapter)
+            session.headers.update({
+                "user-agent": USER_AGENT,
+                "accept": "application/json",
+                "accept-encoding": "gzip, deflate",
+                "connection": "keep-alive",
+            })
+            __sessions[host] = session
+            log.debug(f"Utworzono sesję HTTP dla {host} (pula {pool_size} połączeń).")
+        return session
+
+def is_gzip_allowed(host: str) -> bool:
+    """
+    Czy wysyłać treść żądań skompresowaną gzip. Zmienna środowiskowa `http_gzip_requests`:
+    '0' (domyślnie - nigdy) lub '1' (kompresuj, dopóki serwer nie odrzuci takiego żądania).
+    Kompresja jest wyłączona domyślnie, bo PHP/WordPress bez dodatkowej konfiguracji nie dekompresuje
+    treści żądań, a WAF lub proxy mogą odrzucać je kodem, którego nie da się odróżnić od innych błędów.
+    """
+    if os.getenv("http_gzip_requests", "0").lower() not in ("1", "true", "yes", "tak", "auto"):
+        return False
+    return host not in gzip_rejected_hosts
+
+def is_gzip_rejected(response: requests.Response) -> bool:
+    """
+    Sprawdza, czy serwer nie zrozumiał skompresowanej treści (brak obsługi Content-Encoding po stronie serwera).
+    WordPress zwraca wtedy 400 'rest_invalid_json', a niektóre serwery 415.
+    """
+    if response.status_code == 415:
+        return True
+    if response.status_code == 400:
+        try:
+            return response.json().get("code") == "rest_invalid_json"
+        except ValueError:
+            return False
+    return False
+
+def get_retry_settings() -> tuple[int, float, float]:
+    """
+    Zwraca (liczba ponowień, opóźnienie początkowe, maksymalne opóźnienie) ze zmiennych środowiskowych
+    `api_max_retries`, `api_retry_base_delay` i `api_retry_max_delay`.
+    """
+    return (
+        max(0, int(os.getenv("api_max_retries") or DEFAULT_MAX_RETRIES)),
+        float(os.getenv("api_retry_base_delay") or DEFAULT_RETRY_BASE_DELAY),
+        float(os.getenv("api_retry_max_delay") or DEFAULT_RETRY_MAX_DELAY)
+    )
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """
+    Opóźnienie przed ponowieniem: wykładnicze z pełnym losowym rozrzutem (jitter),
+    by równoległe wątki nie ponawiały żądań w tym samym momencie.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+def parse_retry_after(response: requests.Response) -> float | None:
+    """
+    Odczytuje nagłówek Retry-After (liczba sekund lub data HTTP). Zwraca liczbę sekund lub None.
+    """
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def is_connect_error(error: Exception) -> bool:
+    """
+    Czy połączenie nie zostało nawiązane (żądanie na pewno nie dotarło do serwera, więc można je bezpiecznie ponowić).
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+__retry_stats = {"requests": 0, "retries": 0, "failures": 0, "circuit_opened": 0, "by_reason": {}}
+__retry_stats_lock = threading.Lock()
+def record_retry_stat(name: str, reason: str = None):
+    with __retry_stats_lock:
+        __retry_stats[name] += 1
+        if reason is not None:
+            __retry_stats["by_reason"][reason] = __retry_stats["by_reason"].get(reason, 0) + 1
+
+def get_retry_stats() -> dict:
+    """
+    Zwraca liczniki warstwy HTTP: {'requests', 'retries', 'failures', 'circuit_opened', 'by_reason': {powód: liczba ponowień}}.
+    """
+    with __retry_stats_lock:
+        return {**__retry_stats, "by_reason": dict(__retry_stats["by_reason"])}
+
+def log_retry_stats():
+    """
+    Loguje podsumowanie ponowień żądań, jeżeli jakieś były.
+    """
+    stats = get_retry_stats()
+    if not stats["retries"] and not stats["failures"]:
+        return
+    reasons = ", ".join(f"{reason}: {count}" for reason, count in sorted(stats["by_reason"].items()))
+    log.info(f"Żądania HTTP: {stats['requests']}, ponowień {stats['retries']} ({reasons or 'brak'}), nieudanych po ponowieniach {stats['failures']}, wstrzymań {stats['circuit_opened']}.")
+
+class CircuitBreaker:
+    """
+    Wstrzymuje wysyłanie żądań do hosta, który jest przeciążony.
+
+    Po `threshold` kolejnych błędach przeciążenia (429, 502-504, błędy połączenia) lub po odpowiedzi z Retry-After
+    wszystkie wątki czekają (`wait`) przez `cooldown` sekund (albo czas z Retry-After), zamiast dokładać żądań.
+    Pierwsza udana odpowiedź zeruje licznik błędów.
+    """
+    def __init__(self, host: str, threshold: int = DEFAULT_CIRCUIT_THRESHOLD, cooldown: float = DEFAULT_CIRCUIT_COOLDOWN):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Blokuje, dopóki wysyłanie żądań do hosta jest wstrzymane.
+        """
+        while True:
+            with self.lock:
+                remaining = self.open_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+
+    def record_failure(self, retry_after: float = None):
+        with self.lock:
+            self.failures += 1
+            pause = retry_after if retry_after is not None else (self.cooldown if self.failures >= self.threshold else 0)
+            if pause <= 0:
+                return
+            open_until = time.monotonic() + pause
+            if open_until <= self.open_until:
+                return
+            self.open_until = open_until
+            self.failures = 0
+        record_retry_stat("circuit_opened")
+        log.warning(f"Serwer {self.host} jest przeciążony. Wstrzymano wysyłanie żądań na {pause:.0f} s.")
+
+__breakers = {}
+__breakers_lock = threading.Lock()
+def get_circuit_breaker(host: str) -> CircuitBreaker:
+    """
+    Zwraca współdzielony bezpiecznik dla hosta (singleton na host). Konfiguracja przez zmienne środowiskowe
+    `api_circuit_threshold` i `api_circuit_cooldown`.
+    """
+    with __breakers_lock:
+        breaker = __breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                host,
+                threshold=int(os.getenv("api_circuit_threshold") or DEFAULT_CIRCUIT_THRESHOLD),
+                cooldown=float(os.getenv("api_circuit_cooldown") or DEFAULT_CIRCUIT_COOLDOWN)
+            )
+            __breakers[host] = breaker
+        return breaker
+
+class ApiClient:
+    """
+    Klient REST API WordPressa (wp-json/<namespace>) oparty o współdzieloną sesję hosta.
+    Ma ten sam interfejs co `woocommerce.API` i `wordpress.API`: `get`, `post`, `put`, `delete`
+    zwracają `requests.Response`.
+
+    Przy `http_gzip_requests=1` treść żądań większa niż GZIP_MIN_BYTES jest wysyłana skompresowana gzip.
+    Jeżeli serwer jej nie obsługuje, żądanie jest ponawiane bez kompresji, a kompresja wyłączana dla tego hosta.
+
+    Żądania są ponawiane (patrz `request`) z wykładniczym opóźnieniem, a przeciążony host jest chwilowo
+    wstrzymywany przez `CircuitBreaker`.
+    """
+    def __init__(self, url: str, namespace: str, auth: tuple[str, str] = None, oauth: tuple[str, str] = None, timeout: float = DEFAULT_TIMEOUT):
+        """
+        Args:
+            url: Adres sklepu.
+            namespace: Przestrzeń nazw API, np. 'wc/v3', 'wp/v2', 'erp-flow/v1'.
+            auth: Dane logowania HTTP Basic (użytkownik, hasło / klucz, sekret).
+            oauth: Klucz i sekret WooCommerce do podpisywania żądań OAuth 1.0a (dla adresów bez HTTPS).
+            timeout: Limit czasu żądania w sekundach.
+        """
+        self.url = url.rstrip("/")
+        self.namespace = namespace
+        self.auth = HTTPBasicAuth(*auth) if auth else None
+        self.oauth = oauth
+        self.timeout = timeout
+        self.host = "{0.scheme}://{0.netloc}".format(urlsplit(self.url))
+        self.session = get_session(self.url)
+
+    def __sign(self, url: str, method: str, params: dict | None) -> str:
+        """
+        Podpisuje adres OAuth 1.0a tak jak biblioteka woocommerce (wymagane przez WooCommerce bez HTTPS).
+        """
+        from woocommerce.oauth import OAuth
+        if params:
+            url = f"{url}?{urlencode(params)}"
+        return OAuth(
+            url=url,
+            consumer_key=self.oauth[0],
+            consumer_secret=self.oauth[1],
+            version=self.namespace,
+            method=method,
+            oauth_timestamp=int(time.time())
+        ).get_oauth_url()
+
+    def request(self, method: str, endpoint: str, data=None, params: dict = None, idempotent: bool = None, **kwargs) -> requests.Response:
+        """
+        Wysyła żądanie, ponawiając je (maksymalnie `api_max_retries` razy) po odpowiedzi 429, 502, 503, 504,
+        błędzie połączenia lub timeoucie. Opóźnienie rośnie wykładniczo z losowym rozrzutem, a Retry-After jest respektowany.
+
+        Żądania nieidempotentne (domyślnie POST, np. tworzenie produktów) są ponawiane tylko wtedy, gdy serwer
+        na pewno ich nie przetworzył: po 429, po 503 z Retry-After lub gdy nie udało się nawiązać połączenia.
+        Pozostałe błędy zwracają ostatnią odpowiedź lub zgłaszają ostatni wyjątek.
+
+        Args:
+            idempotent: Czy żądanie można bezpiecznie powtórzyć (np. batch bez tworzenia). Domyślnie według metody HTTP.
+        """
+        url = f"{self.url}/wp-json/{self.namespace}/{endpoint}"
+        headers = dict(kwargs.pop("headers", {}))
+        timeout = kwargs.pop("timeout", self.timeout)
+        body = None
+        compressed = False
+
+        if data is not None:
+            body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            headers["content-type"] = "application/json;charset=utf-8"
+            if len(body) >= GZIP_MIN_BYTES and is_gzip_allowed(self.host):
+                compressed = True
+
+        def send(compress: bool) -> requests.Response:
+            request_headers = dict(headers)
+            if compress:
+                request_headers["content-encoding"] = "gzip"
+            # Podpis OAuth zawiera znacznik czasu, więc jest generowany przy każdym wysłaniu
+            request_url, request_params = (self.__sign(url, method, params), None) if self.oauth else (url, params)
+            return self.session.request(
+                method=method,
+                url=request_url,
+                params=request_params,
+                data=gzip.compress(body, compresslevel=5) if compress else body,
+                headers=request_headers,
+                auth=self.auth,
+                timeout=timeout,
+                **kwargs
+            )
+
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        max_retries, base_delay, max_delay = get_retry_settings()
+        breaker = get_circuit_breaker(self.host)
+        record_retry_stat("requests")
+
+        attempt = 0
+        while True:
+            breaker.wait()
+            try:
+                response = send(compressed)
+                if compressed and is_gzip_rejected(response):
+                    log.info(f"Serwer {self.host} nie obsługuje kompresji treści żądań. Wysyłanie bez kompresji.")
+                    gzip_rejected_hosts.add(self.host)
+                    compressed = False
+                    response = send(False)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                breaker.record_failure()
+                if attempt >= max_retries or not (idempotent or is_connect_error(e)):
+                    record_retry_stat("failures")
+                    raise
+                reason = type(e).__name__
+                delay = backoff_delay(attempt, base_delay, max_delay)
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                retry_after = parse_retry_after(response)
+                breaker.record_failure(retry_after)
+                retryable = idempotent or response.status_code == 429 or (response.status_code == 503 and retry_after is not None)
+                if attempt >= max_retries or not retryable:
+                    record_retry_stat("failures")
+                    return response
+                reason = str(response.status_code)
+                delay = max(retry_after or 0, backoff_delay(attempt, base_delay, max_delay))
+
+            attempt += 1
+            record_retry_stat("retries", reason)
+            log.warning(f"{method} {endpoint}: {reason}, ponawianie {attempt}/{max_retries} za {delay:.1f} s.")
+            time.sleep(delay)
+
+    def get(self, endpoint: str, **kwargs) -> requests.Response:
+        return self.request("GET", endpoint, None, **kwargs)
+
+    def get_all(self, endpoint: str, params: dict = None, per_page: int = 100) -> list[dict]:
+        """
+        Pobiera wszystkie strony listy (np. 'products', 'users'), korzystając z nagłówka X-WP-TotalPages.
+
+        Raises:
+            requests.HTTPError: Jeżeli któraś strona zwróci błąd.
+        """
+        items = []
+        page = 1
+        while True:
+            response = self.get(endpoint, params={**(params or {}), "per_page": per_page, "page": page})
+            response.raise_for_status()
+            batch = response.json()
+            items.extend(batch)
+            total_pages = int(response.headers.get("X-WP-TotalPages") or 0)
+            if not batch or page >= total_pages:
+                return items
+            log.debug(f"Pobrano stronę {page}/{total_pages} z {endpoint}.")
+            page += 1
+
+    def post(self, endpoint: str, data, **kwargs) -> requests.Response:
+        return self.request("POST", endpoint, data, **kwargs)
+
+    def put(self, endpoint: str, data, **kwargs) -> requests.Response:
+        return self.request("PUT", endpoint, data, **kwargs)
+
+    def delete(self, endpoint: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", endpoint, None, **kwargs)
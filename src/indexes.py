@@ -0,0 +1,138 @@
+import json
+import pyodbc
+import connections as con
+import logger as log
+import sql
+import comarch_client as db
+
+__all__ = ["INDEXES", "ensure_indexes", "check_indexes"]
+
+# Indeksy potrzebne zapytaniom ERPFlow: (schemat, tabela, nazwa indeksu, kolumny klucza, kolumny dołączone)
+INDEXES = [
+    # Historia temporal tables: EXISTS (... WHERE id = ? AND ValidFrom > ?) w zapytaniach przyrostowych
+    # oraz FOR SYSTEM_TIME AS OF w wykrywaniu zmienionych kolumn
+    ("CDN", "TowaryHistory", "IX_ERPFlow_TowaryHistory_Zmiany", ["Twr_TwrId", "ValidFrom"], ["ValidTo", "Twr_Nazwa"]),
+    ("CDN", "TwrCenyHistory", "IX_ERPFlow_TwrCenyHistory_Zmiany", ["TwC_TwrID", "ValidFrom"], ["ValidTo", "TwC_Typ", "TwC_Wartosc", "TwC_Zaokraglenie"]),
+    ("CDN", "KntOsobyHistory", "IX_ERPFlow_KntOsobyHistory_Zmiany", ["KnO_KnOId", "ValidFrom"], ["ValidTo"]),
+    ("CDN", "RabatyHistory", "IX_ERPFlow_RabatyHistory_Zmiany", ["Rab_RabId", "ValidFrom"], ["ValidTo"]),
+    # Tabele mapowań: wyszukiwanie po ID API (DELETE przed MERGE w save_id_mappings).
+    # ID bazy jest kluczem klastrowym, więc indeks zawiera je bez INCLUDE
+    ("ERPFlow", "TowarIDs", "IX_TowarIDs_WC_ID", ["WC_ID"], []),
+    ("ERPFlow", "KontrahenciIDs", "IX_KontrahenciIDs_WC_ID", ["WC_ID"], []),
+]
+
+def __get_index_columns(schema: str, table: str, index_name: str) -> tuple[list, list] | None:
+    """
+    Zwraca (kolumny klucza, kolumny dołączone) istniejącego indeksu lub None, jeżeli indeks nie istnieje.
+    """
+    sql.execute("setup.index_columns", '''
+        SELECT c.name, ic.is_included_column
+        FROM sys.indexes i
+        JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+        JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+        WHERE i.object_id = OBJECT_ID(?) AND i.name = ?
+        ORDER BY ic.is_included_column, ic.key_ordinal, c.name
+    ''', (f"{schema}.{table}", index_name))
+    rows = con.cursor.fetchall()
+    if not rows:
+        return None
+    keys = [row[0] for row in rows if not row[1]]
+    includes = [row[0] for row in rows if row[1]]
+    return keys, includes
+
+def __table_exists(schema: str, table: str) -> bool:
+    sql.execute("setup.table_exists", "SELECT OBJECT_ID(?, 'U')", (f"{schema}.{table}",))
+    row = con.cursor.fetchone()
+    return row is not None and row[0] is not None
+
+def __matches(existing: tuple[list, list], keys: list, includes: list) -> bool:
+    existing_keys, existing_includes = existing
+    return [k.lower() for k in existing_keys] == [k.lower() for k in keys] \
+        and {i.lower() for i in existing_includes} == {i.lower() for i in includes}
+
+def ensure_indexes(backend: str = db.TEMPORAL):
+    """
+    Tworzy indeksy z `INDEXES` i sprawdza ich definicję. Indeks o tej samej nazwie, ale innych kolumnach
+    jest przebudowywany (DROP_EXISTING). Indeksy tabel historii są pomijane przy Change Tracking
+    oraz gdy tabela historii nie istnieje.
+    """
+    for schema, table, index_name, keys, includes in INDEXES:
+        if schema == "CDN" and backend != db.TEMPORAL:
+            continue
+        if not __table_exists(schema, table):
+            log.debug(f"Pominięto indeks '{index_name}' - tabela '{schema}.{table}' nie istnieje.")
+            continue
+
+        existing = __get_index_columns(schema, table, index_name)
+        if existing is not None and __matches(existing, keys, includes):
+            log.debug(f"Indeks '{index_name}' już istnieje.")
+            continue
+
+        key_clause = ", ".join(sql.quote_identifier(column) for column in keys)
+        include_clause = f" INCLUDE ({', '.join(sql.quote_identifier(column) for column in includes)})" if includes else ""
+        drop_existing = " WITH (DROP_EXISTING = ON)" if existing is not None else ""
+        try:
+            sql.execute("setup.create_index", f'''
+                CREATE NONCLUSTERED INDEX {sql.quote_identifier(index_name)}
+                ON {sql.table(None, schema, table)} ({key_clause}){include_clause}{drop_existing};
+            ''')
+        except pyodbc.Error as e:
+            log.error(f"Nie udało się utworzyć indeksu '{index_name}' na tabeli '{schema}.{table}': {e}")
+            raise
+
+        if __get_index_columns(schema, table, index_name) is None:
+            raise RuntimeError(f"Indeks '{index_name}' nie został utworzony.")
+        log.info(f"{'Przebudowano' if existing is not None else 'Utworzono'} indeks '{index_name}' na tabeli '{schema}.{table}'.")
+
+def check_indexes(tracked_tables: list[str]):
+    """
+    Wypisuje raport (--setup --check): stan indeksów z `INDEXES` oraz brakujące indeksy zgłoszone przez
+    SQL Server (sys.dm_db_missing_index_*) dla śledzonych tabel, ich historii i schematu ERPFlow,
+    posortowane według szacowanego wpływu (koszt * % poprawy * liczba wyszukiwań i skanów).
+    Statystyki brakujących indeksów są zerowane przy restarcie serwera i wymagają VIEW SERVER STATE.
+    """
+    log.info("Indeksy ERPFlow:")
+    for schema, table, index_name, keys, includes in INDEXES:
+        if not __table_exists(schema, table):
+            state = "brak tabeli"
+        else:
+            existing = __get_index_columns(schema, table, index_name)
+            if existing is None:
+                state = "BRAK - uruchom --setup"
+            elif not __matches(existing, keys, includes):
+                state = "INNA DEFINICJA - uruchom --setup"
+            else:
+                state = "OK"
+        log.info(f"  {schema}.{table}.{index_name}: {state}")
+
+    tables = [f"CDN.{table}" for table in tracked_tables] + [f"CDN.{table}History" for table in tracked_tables]
+    try:
+        sql.execute("setup.missing_indexes", '''
+            SELECT
+                OBJECT_SCHEMA_NAME(d.object_id) + '.' + OBJECT_NAME(d.object_id) AS table_name,
+                d.equality_columns, d.inequality_columns, d.included_columns,
+                s.user_seeks + s.user_scans AS uses,
+                s.avg_user_impact,
+                s.avg_total_user_cost * s.avg_user_impact / 100.0 * (s.user_seeks + s.user_scans) AS impact
+            FROM sys.dm_db_missing_index_details d
+            JOIN sys.dm_db_missing_index_groups g ON g.index_handle = d.index_handle
+            JOIN sys.dm_db_missing_index_group_stats s ON s.group_handle = g.index_group_handle
+            WHERE d.database_id = DB_ID()
+            AND (OBJECT_SCHEMA_NAME(d.object_id) = 'ERPFlow'
+                OR OBJECT_SCHEMA_NAME(d.object_id) + '.' + OBJECT_NAME(d.object_id) IN (SELECT value FROM OPENJSON(?)))
+            ORDER BY impact DESC
+        ''', (json.dumps(tables),))
+        rows = con.cursor.fetchall()
+    except pyodbc.Error as e:
+        log.warning(f"Nie udało się odczytać brakujących indeksów (wymagane VIEW SERVER STATE): {e}")
+        return
+
+    if not rows:
+        log.info("SQL Server nie zgłasza brakujących indeksów dla tabel ERPFlow.")
+        return
+
+    log.info("Brakujące indeksy zgłoszone przez SQL Server (od ostatniego restartu):")
+    for table_name, equality, inequality, included, uses, avg_impact, impact in rows:
+        keys = ", ".join(filter(None, [equality, inequality]))
+        include_text = f" INCLUDE ({included})" if included else ""
+        log.info(f"  {table_name} ({keys}){include_text}: użyć {uses}, szacowana poprawa {avg_impact:.0f}%, wpływ {impact:.1f}")
@@ -2,7 +2,13 @@
 # Posted by Sergey Pleshakov, modified by community. See post 'Timeline' for change history
 # Retrieved 2026-02-03, License - CC BY-SA 4.0
 
+import os
+import json
+import queue
+import atexit
 import logging
+import logging.handlers
+from datetime import datetime
 
 class CustomFormatter(logging.Formatter):
     grey = "\x1b[38;20m"
@@ -23,10 +29,43 @@ class CustomFormatter(logging.Formatter):
         logging.CRITICAL: bold_red + log_format + reset,
     }
 
+    def __init__(self):
+        super().__init__()
+        # Formattery poziomów są tworzone raz, a nie przy każdym wpisie
+        self.formatters = {level: logging.Formatter(log_fmt) for level, log_fmt in self.FORMATS.items()}
+
+    def format(self, record):
+        formatter = self.formatters.get(record.levelno)
+        return formatter.format(record) if formatter else super().format(record)
+
+# Atrybuty każdego LogRecord - pozostałe pochodzą z `extra` i trafiają do wpisu JSON jako osobne pola
+LOG_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """
+    Jeden wpis na linię w formacie JSON (JSON Lines), np. do zbierania logów przez Loki lub Elasticsearch.
+    """
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
-        return formatter.format(record)
+        entry = {
+            "time": datetime.fromtimestamp(record.created).astimezone().isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "file": record.filename,
+            "line": record.lineno,
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        for key, value in vars(record).items():
+            if key not in LOG_RECORD_ATTRIBUTES:
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+FORMATTERS = {
+    "text": CustomFormatter,
+    "json": JsonFormatter,
+}
 
 # log = None
 # def initialize():
@@ -35,8 +74,15 @@ log = logging.getLogger("My_app")
 log.setLevel(logging.DEBUG)
 ch = logging.StreamHandler()
 ch.setLevel(logging.DEBUG)
-ch.setFormatter(CustomFormatter())
-log.addHandler(ch)
+ch.setFormatter(FORMATTERS.get(os.getenv("log_format", "text"), CustomFormatter)())
+
+# Wpisy trafiają do kolejki, a formatuje i zapisuje je wątek w tle (QueueListener), więc wątki synchronizacji
+# nie czekają na terminal ani plik. Przy zakończeniu programu kolejka jest opróżniana (atexit).
+__queue = queue.SimpleQueue()
+__listener = logging.handlers.QueueListener(__queue, ch, respect_handler_level=True)
+log.addHandler(logging.handlers.QueueHandler(__queue))
+__listener.start()
+atexit.register(__listener.stop)
 
 def set_log_level(level: str):
     numeric_level = getattr(logging, level.upper(), None)
@@ -44,6 +90,21 @@ def set_log_level(level: str):
         raise ValueError(f'Invalid log level: {level}')
     log.setLevel(numeric_level)
 
+def set_log_format(log_format: str):
+    """
+    Ustawia format wpisów: 'text' (kolorowy, domyślny) lub 'json' (JSON Lines).
+    """
+    formatter = FORMATTERS.get(log_format)
+    if formatter is None:
+        raise ValueError(f'Invalid log format: {log_format}')
+    ch.setFormatter(formatter())
+
+def is_debug_enabled() -> bool:
+    """
+    Sprawdza, czy wpisy DEBUG są zapisywane - do pomijania budowania komunikatów w pętlach po rekordach.
+    """
+    return log.isEnabledFor(logging.DEBUG)
+
 def debug(msg, **kwargs):
     log.debug(msg, stacklevel=2, **kwargs)
 def info(msg, **kwargs):
@@ -1,3 +1,5 @@
+import os
+import time
 import pyodbc
 from dotenv import load_dotenv
 import argparse
@@ -8,6 +10,17 @@ import comarch_client as db
 import products
 import contractors
 import discounts
+import scheduler
+import daemon
+import sql
+import indexes
+import checkpoints
+import http_client
+import metrics
+import profiler
+
+# Tabele Comarch, w których śledzone są zmiany
+TRACKED_TABLES = ["Towary", "TwrCeny", "KntOsoby", "Rabaty"]
 
 def main():
     parser = argparse.ArgumentParser(
@@ -28,6 +41,21 @@ def main():
         default=False,
         help="Skonfiguruj bazę danych do śledzenia zmian."
     )
+    parser.add_argument(
+        "--check",
+        dest="check",
+        action="store_true",
+        default=False,
+        help="Używane z --setup: zamiast konfigurować bazę danych wypisuje raport indeksów ERPFlow i brakujących indeksów zgłoszonych przez SQL Server."
+    )
+    parser.add_argument(
+        "--sledzenie",
+        dest="change_tracking",
+        type=str,
+        default=db.TEMPORAL,
+        choices=[db.TEMPORAL, db.CHANGE_TRACKING],
+        help="Mechanizm wykrywania zmian konfigurowany przez --setup: 'temporal' (temporal tables, domyślnie) lub 'ct' (SQL Server Change Tracking, bez zmian w schemacie tabel Comarch)."
+    )
     parser.add_argument(
         "--odtworz",
         dest="full_rebuild",
@@ -42,6 +70,13 @@ def main():
         default=False,
         help="Usuwa wszystkie produkty z WooCommerce, resetuje wersję śledzenia i synchronizuje ponownie."
     )
+    parser.add_argument(
+        "--uzgodnij",
+        dest="reconcile",
+        action="store_true",
+        default=False,
+        help="Porównuje produkty i użytkowników sklepu z bazą (po SKU / nazwie użytkownika), wysyła tylko potrzebne zmiany i odbudowuje tabele mapowań."
+    )
     parser.add_argument(
         "--wymus",
         dest="force",
@@ -49,6 +84,42 @@ def main():
         default=False,
         help="Wymusza traktowanie produktu jako zmieniony, nawet jeśli nie można porównać stanu sprzed i po synchronizacji."
     )
+    parser.add_argument(
+        "--strumieniowo",
+        dest="streaming",
+        action="store_true",
+        default=False,
+        help="Pobiera, mapuje i wysyła dane paczkami równolegle zamiast wczytywać wszystkie rekordy naraz. Rozmiar paczki: zmienna środowiskowa sync_chunk_size (domyślnie 1000)."
+    )
+    parser.add_argument(
+        "--kontrahenci-api",
+        dest="contractors_api",
+        type=str,
+        default="wp",
+        choices=["wp", "wc"],
+        help="API używane do synchronizacji kontrahentów: 'wp' (wp/v2/users, jeden użytkownik na żądanie) lub 'wc' (wc/v3/customers/batch, do 100 klientów na żądanie). Domyślnie: wp."
+    )
+    parser.add_argument(
+        "--sekwencyjnie",
+        dest="sequential",
+        action="store_true",
+        default=False,
+        help="Synchronizuje towary, kontrahentów i rabaty po kolei zamiast równolegle (towary i kontrahenci równolegle, rabaty po towarach)."
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        action="store_true",
+        default=False,
+        help="Profiluje synchronizację (cProfile i tracemalloc dla każdego etapu każdej encji) i zapisuje raport profile_<data>.txt obok sync_state.json. Wymusza --sekwencyjnie."
+    )
+    parser.add_argument(
+        "--daemon",
+        dest="daemon",
+        action="store_true",
+        default=False,
+        help="Działa w trybie ciągłym: utrzymuje połączenia, sprawdza zmiany w bazie co kilka sekund i synchronizuje je na bieżąco. Zobacz zmienne środowiskowe daemon_*."
+    )
     parser.add_argument(
         "--log-level",
         dest="log_level",
@@ -57,6 +128,14 @@ def main():
         choices=["DEBUG", "INFO", "WARNING", "ERROR"],
         help="Ustaw poziom logowania. Domyślnie: INFO."
     )
+    parser.add_argument(
+        "--log-format",
+        dest="log_format",
+        type=str,
+        default=None,
+        choices=["text", "json"],
+        help="Format logów: 'text' (kolorowy) lub 'json' (jeden wpis JSON na linię). Domyślnie zmienna środowiskowa log_format lub 'text'."
+    )
     parser.add_argument(
         "--tylko-towary",
         dest="only_products",
@@ -83,44 +162,52 @@ def main():
     args = parser.parse_args()
     args_lib.args = args
 
-    # Ustawienie poziomu logowania
+    # Ustawienie poziomu i formatu logowania
     log.set_log_level(args.log_level)
+    if args.log_format:
+        log.set_log_format(args.log_format)
 
     # Sprawdzenie sprzecznych argumentów
     if args.only_products and args.only_contractors and args.only_discounts:
         log.error("Podano sprzeczne argumenty. Nie można jednocześnie synchronizować tylko produktów i tylko kontrahentów i tylko rabatów.")
         return
 
-    # Inicljalizacja połączeń
-    con.initialize()
+    # Profilowanie - encje po kolei, aby etapy różnych encji nie nakładały się w pomiarach pamięci
+    if args.profile:
+        profiler.enable()
+        args.sequential = True
+        log.info("Profilowanie włączone - synchronizacja encji odbywa się sekwencyjnie.")
+
+    # Konfiguracja (jeżeli --setup) - potrzebuje tylko połączenia z bazą, bez klientów API i stanu synchronizacji
+    if args.setup:
+        if args.check:
+            indexes.check_indexes(TRACKED_TABLES)
+        else:
+            setup(args.change_tracking)
+        return
+
+    # Połączenia z bazą i API są nawiązywane przy pierwszym użyciu (patrz connections.__getattr__)
+    db.detect_change_backend(TRACKED_TABLES)
 
-    # Pobieramy aktualny czas przed synchronizacją i ostatniej synchronizacji
+    # Pobieramy aktualny czas przed synchronizacją i wczytujemy stan ostatniej synchronizacji
     db.save_sync_start_timestamp()
     db.load_sync_state()
 
     last_sync_timestamp = db.sync_state.get('last_sync_timestamp')
     log.debug(f"Ostatnia synchronizacja: {last_sync_timestamp}, aktualny czas: {db.sync_start_timestamp}")
 
-    # Sprawdzamy czy temporal tables są włączone
+    # Sprawdzamy czy temporal tables są włączone dla tabel synchronizowanych encji
     has_previous_sync = last_sync_timestamp is not None
     add_all = getattr(args, 'full_rebuild', False) or getattr(args, 'regeneruj', False)
     use_incremental = has_previous_sync and not add_all
 
-    if use_incremental:
-        if not db.is_temporal_enabled('Towary') or not db.is_temporal_enabled('TwrCeny') or not db.is_temporal_enabled('KntOsoby'):
+    if use_incremental and db.change_backend == db.TEMPORAL:
+        if not all(db.is_temporal_enabled(table) for table in required_tables(args)):
             log.warning("Temporal tables nie są włączone dla wymaganych tabel.")
             log.warning("Uruchom aplikację z flagą --setup, aby skonfigurować bazę danych.")
             log.warning("Przełączam na pełną synchronizację.")
             use_incremental = False
 
-    # Wczytanie stanu synchronizacji
-    db.load_sync_state()
-
-    # Konfiguracja (jeżeli --setup)
-    if args.setup:
-        setup()
-        return
-
     exclusive = args.only_products or args.only_contractors or args.only_discounts
     
     # Regeneracja - usuwa wszystkie produkty z WooCommerce i synchronizuje ponownie (--regeneruj)
@@ -130,38 +217,131 @@ def main():
         if not exclusive or args.only_contractors:
             contractors.regenerate()
         return
+
+    # Uzgadnianie - wysyła tylko różnice między sklepem a bazą i odbudowuje mapowania (--uzgodnij)
+    if args.reconcile:
+        results = []
+        if not exclusive or args.only_products:
+            results.append(products.reconcile())
+        if not exclusive or args.only_contractors:
+            results.append(contractors.reconcile())
+        if all(results):
+            db.update_sync_watermark()
+            db.save_sync_state()
+            log.info("Uzgadnianie zakończone pomyślnie.")
+        else:
+            log.error("Uzgadnianie zakończone z błędami. Znacznik czasu synchronizacji nie został zaktualizowany.")
+        return
     
-    # Synchronizacja produktów
-    products_success = False
+    if not args.daemon:
+        sync_all()
+        return
+
+    # Tryb ciągły (--daemon)
+    if db.change_backend == db.CHANGE_TRACKING:
+        tracked_tables = TRACKED_TABLES
+    else:
+        tracked_tables = [table for table in TRACKED_TABLES if db.is_temporal_enabled(table)]
+    if not tracked_tables:
+        log.error("Tryb daemon wymaga włączonego śledzenia zmian. Uruchom aplikację z flagą --setup.")
+        return
+
+    def daemon_cycle() -> bool:
+        success = sync_all()
+        if success:
+            # --odtworz dotyczy tylko pierwszego cyklu
+            args.full_rebuild = False
+        return success
+
+    daemon.run(daemon_cycle, tracked_tables)
+
+def required_tables(args) -> list[str]:
+    """
+    Zwraca tabele Comarch, z których korzystają encje wybrane argumentami --tylko-*.
+    """
+    exclusive = args.only_products or args.only_contractors or args.only_discounts
+    tables = []
     if not exclusive or args.only_products:
-        products_success = products.sync()
-    
-    # Synchronizacja kontrahentów
-    contractors_success = False
+        tables += ["Towary", "TwrCeny"]
     if not exclusive or args.only_contractors:
-        contractors_success = contractors.sync()
+        tables += ["KntOsoby"]
+    if not exclusive or args.only_discounts:
+        tables += ["Rabaty"]
+    return tables
+
+def sync_all() -> bool:
+    """
+    Wykonuje jeden cykl synchronizacji towarów, kontrahentów i rabatów (zgodnie z argumentami --tylko-*)
+    i zapisuje czas synchronizacji, jeżeli wszystkie zakończyły się sukcesem.
+
+    Returns:
+        bool: True, jeżeli synchronizacja zakończyła się sukcesem.
+    """
+    exclusive = args.only_products or args.only_contractors or args.only_discounts
+
+    # Punkty kontrolne - przerwane uruchomienie jest wznawiane z tym samym czasem rozpoczęcia
+    db.begin_sync_run(max_attempts=int(os.getenv("sync_resume_attempts") or db.DEFAULT_RESUME_ATTEMPTS))
+    started = time.time()
+    record_sync_lag()
 
-    # Synchronizacja rabatów
-    discounts_success = False
+    # Zadania synchronizacji: {nazwa: (funkcja, zależności)}.
+    # Towary i kontrahenci są niezależni i działają równolegle, rabaty czekają na udaną synchronizację towarów.
+    tasks = {}
+    if not exclusive or args.only_products:
+        tasks['towary'] = (products.sync, [])
+    if not exclusive or args.only_contractors:
+        tasks['kontrahenci'] = (contractors.sync, [])
     if not exclusive or args.only_discounts:
-        discounts_success = discounts.sync()
+        tasks['rabaty'] = (discounts.sync, ['towary'])
+
+    results = scheduler.run_tasks(tasks, parallel=not args.sequential)
+    sql.log_query_stats()
+    http_client.log_retry_stats()
+    products_success = results.get('towary', False)
+    contractors_success = results.get('kontrahenci', False)
+    discounts_success = results.get('rabaty', False)
     
     # Zapisanie zaktualizowanego stanu synchronizacji jeżeli synchronizacja zakończyła się sukcesem
     if (products_success and contractors_success and discounts_success) or (exclusive and (args.only_products or args.only_contractors or args.only_discounts)): 
 
-        if db.sync_start_timestamp:
-            db.sync_state['last_sync_timestamp'] = db.sync_start_timestamp
+        # Uruchomienie --tylko-* z błędami również przesuwa znacznik czasu (jak dotychczas),
+        # a z nim kończy uruchomienie i usuwa jego punkty kontrolne (patrz `update_sync_watermark`)
+        db.update_sync_watermark()
         db.save_sync_state()
+        success = all(results.values())
     else:
         log.warning("UWAGA: Synchronizacja zakończyła się z błędami. Mogą istnieć elementy, które nie są poprawnie zapisane. Sprawdź logi.")
+        success = False
+
+    metrics.inc("erpflow_sync_runs_total", result="success" if success else "failure")
+    metrics.set_gauge("erpflow_sync_duration_seconds", round(time.time() - started, 3))
+    if success:
+        metrics.set_gauge("erpflow_last_success_timestamp_seconds", round(time.time()))
+    metrics.write(daemon=args.daemon)
+    profiler.write_report(os.path.dirname(db.SYNC_STATE_FILE))
+    return success
 
-def setup():
+def record_sync_lag():
     """
-    Konfiguruje bazę danych do synchronizacji używając tabel tymczasowych (temporal tables).
-    Tworzy schemat ERPFlow, potrzebne tabele oraz włącza temporal tables tam gdzie trzeba.
+    Zapisuje w metrykach, o ile sekund znacznik ostatniej synchronizacji jest starszy od czasu bazy danych
+    na początku bieżącej synchronizacji (brak metryki przed pierwszą synchronizacją).
     """
-    # Lista tabel, dla których chcemy włączyć temporal tables
-    tracked_tables = ["Towary", "TwrCeny", "KntOsoby", "Rabaty"]
+    last_sync_timestamp = db.sync_state.get('last_sync_timestamp')
+    if not last_sync_timestamp or not db.sync_start_timestamp:
+        return
+    try:
+        lag = (sql.to_datetime(db.sync_start_timestamp) - sql.to_datetime(last_sync_timestamp)).total_seconds()
+    except ValueError:
+        return
+    metrics.set_gauge("erpflow_sync_lag_seconds", max(0.0, lag))
+
+def setup(backend: str = db.TEMPORAL):
+    """
+    Konfiguruje bazę danych do synchronizacji.
+    Tworzy schemat ERPFlow, potrzebne tabele oraz włącza wybrany mechanizm wykrywania zmian:
+    temporal tables (`db.TEMPORAL`) lub Change Tracking (`db.CHANGE_TRACKING`).
+    """
+    tracked_tables = TRACKED_TABLES
     
     try:
         # Utworzenie schematu ERPFlow jeśli nie istnieje
@@ -179,7 +359,8 @@ def setup():
                 CREATE TABLE [ERPFlow].[TowarIDs] (
                     Twr_TwrId INT PRIMARY KEY,
                     WC_ID INT NOT NULL,
-                    LastSynced DATETIME2 DEFAULT GETDATE()
+                    LastSynced DATETIME2 DEFAULT GETDATE(),
+                    PayloadHash BINARY(32) NULL
                 );
             ''')
             log.debug(f"Utworzono lub tabela 'TowarIDs' już istnieje.")
@@ -194,7 +375,8 @@ def setup():
                 CREATE TABLE [ERPFlow].[KontrahenciIDs] (
                     KnO_KnOId INT PRIMARY KEY,
                     WC_ID INT NOT NULL,
-                    LastSynced DATETIME2 DEFAULT GETDATE()
+                    LastSynced DATETIME2 DEFAULT GETDATE(),
+                    PayloadHash BINARY(32) NULL
                 );
             ''')
             log.debug(f"Utworzono lub tabela 'KontrahenciIDs' już istnieje.")
@@ -202,6 +384,46 @@ def setup():
             log.error(f"Nie udało się utworzyć tabeli 'KontrahenciIDs': {table_error}")
             raise
         
+        # Utworzenie tabeli punktów kontrolnych (wznawianie przerwanej synchronizacji)
+        try:
+            con.cursor.execute(f'''
+                IF NOT EXISTS (SELECT 1 FROM sys.tables WHERE name = '{checkpoints.TABLE}' AND schema_id = SCHEMA_ID('ERPFlow'))
+                CREATE TABLE [ERPFlow].[{checkpoints.TABLE}] (
+                    RunStart DATETIME2 NOT NULL,
+                    Entity NVARCHAR(128) NOT NULL,
+                    DbId INT NOT NULL,
+                    CONSTRAINT PK_SyncCheckpoints PRIMARY KEY (RunStart, Entity, DbId)
+                );
+            ''')
+            log.debug(f"Utworzono lub tabela '{checkpoints.TABLE}' już istnieje.")
+        except pyodbc.Error as table_error:
+            log.error(f"Nie udało się utworzyć tabeli '{checkpoints.TABLE}': {table_error}")
+            raise
+
+        # Dodanie kolumny z hashem ostatnio wysłanych danych do tabel utworzonych przez starsze wersje
+        for mapping_table in ("TowarIDs", "KontrahenciIDs"):
+            try:
+                con.cursor.execute(f'''
+                    IF COL_LENGTH('ERPFlow.{mapping_table}', 'PayloadHash') IS NULL
+                    ALTER TABLE [ERPFlow].[{mapping_table}] ADD PayloadHash BINARY(32) NULL;
+                ''')
+                log.debug(f"Dodano lub kolumna 'PayloadHash' już istnieje w tabeli '{mapping_table}'.")
+            except pyodbc.Error as table_error:
+                log.error(f"Nie udało się dodać kolumny 'PayloadHash' do tabeli '{mapping_table}': {table_error}")
+                raise
+
+        if backend == db.CHANGE_TRACKING:
+            setup_change_tracking(tracked_tables)
+            indexes.ensure_indexes(backend)
+            log.info("Konfiguracja bazy danych zakończona pomyślnie.")
+            return
+
+        # Wyłączamy Change Tracking, jeżeli wcześniej zostało wybrane, by program używał temporal tables
+        for table in tracked_tables:
+            if db.is_change_tracking_enabled(table):
+                con.cursor.execute(f"ALTER TABLE [CDN].[{table}] DISABLE CHANGE_TRACKING;")
+                log.info(f"Wyłączono Change Tracking dla tabeli '{table}'.")
+
         # Włączamy temporal tables dla każdej tabeli
         for table in tracked_tables:
             try:
@@ -244,11 +466,48 @@ def setup():
                     log.error(f"Błąd podczas włączania temporal table dla '{table}': {table_error}")
                     raise
         
+        # Indeksy dla zapytań przyrostowych (tabele historii) i tabel mapowań
+        indexes.ensure_indexes(backend)
+
         log.info("Konfiguracja bazy danych zakończona pomyślnie.")
     except pyodbc.Error as e:
         log.error(f"Błąd podczas konfiguracji bazy danych: {e}")
         raise
 
+def setup_change_tracking(tracked_tables: list[str]):
+    """
+    Włącza SQL Server Change Tracking dla bazy danych i śledzonych tabel.
+    W przeciwieństwie do temporal tables nie dodaje kolumn do tabel Comarch - zmiany są odczytywane
+    przez CHANGETABLE(CHANGES ...) od numeru wersji zapisanego po ostatniej synchronizacji.
+    Okres przechowywania zmian: zmienna środowiskowa `change_tracking_retention_days` (domyślnie 7 dni).
+    Jeżeli synchronizacja nie odbędzie się w tym czasie, następna będzie pełna.
+    """
+    database_name = os.getenv("database_name")
+    retention_days = int(os.getenv("change_tracking_retention_days") or 7)
+    try:
+        con.cursor.execute("SELECT 1 FROM sys.change_tracking_databases WHERE database_id = DB_ID()")
+        if con.cursor.fetchone() is None:
+            con.cursor.execute(f'''
+                ALTER DATABASE [{database_name}]
+                SET CHANGE_TRACKING = ON (CHANGE_RETENTION = {retention_days} DAYS, AUTO_CLEANUP = ON);
+            ''')
+            log.info(f"Włączono Change Tracking dla bazy danych '{database_name}'.")
+        else:
+            log.debug(f"Change Tracking jest już włączone dla bazy danych '{database_name}'.")
+
+        for table in tracked_tables:
+            if db.is_change_tracking_enabled(table):
+                log.debug(f"Change Tracking jest już włączone dla tabeli '{table}'.")
+                continue
+            con.cursor.execute(f"ALTER TABLE [CDN].[{table}] ENABLE CHANGE_TRACKING WITH (TRACK_COLUMNS_UPDATED = OFF);")
+            log.info(f"Włączono Change Tracking dla tabeli '{table}'.")
+
+        if any(db.is_temporal_enabled(table) for table in tracked_tables):
+            log.info("Temporal tables nadal są włączone dla części tabel. Nie są już używane przez program i można je wyłączyć ręcznie.")
+    except pyodbc.Error as e:
+        log.error(f"Błąd podczas włączania Change Tracking: {e}")
+        raise
+
 if __name__ == "__main__":
     load_dotenv()
     main()
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+import logger as log
+
+__all__ = ["inc", "set_gauge", "observe", "timer", "snapshot", "write"]
+
+# Granice przedziałów histogramów czasu (w sekundach)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Opisy metryk (# HELP w formacie Prometheus)
+HELP = {
+    "erpflow_rows_fetched_total": "Wiersze pobrane z bazy danych.",
+    "erpflow_items_total": "Elementy wysłane do API i potwierdzone przez API.",
+    "erpflow_item_errors_total": "Elementy odrzucone przez API.",
+    "erpflow_items_skipped_total": "Elementy pominięte, bo nie zmieniły się od ostatniego wysłania.",
+    "erpflow_phase_seconds": "Czas etapów synchronizacji (fetch, changes, prepare, api, mappings).",
+    "erpflow_api_batch_seconds": "Czas odpowiedzi API na jedną partię lub żądanie.",
+    "erpflow_sync_runs_total": "Uruchomienia synchronizacji według wyniku.",
+    "erpflow_sync_duration_seconds": "Czas ostatniej synchronizacji.",
+    "erpflow_sync_lag_seconds": "Opóźnienie last_sync_timestamp względem czasu bazy danych na początku ostatniej synchronizacji.",
+    "erpflow_last_success_timestamp_seconds": "Czas (Unix) zakończenia ostatniej udanej synchronizacji.",
+    "erpflow_db_queries_total": "Zapytania SQL według nazwy (patrz sql.execute).",
+    "erpflow_db_query_errors_total": "Nieudane zapytania SQL według nazwy.",
+    "erpflow_db_query_seconds_total": "Łączny czas zapytań SQL według nazwy.",
+    "erpflow_http_requests_total": "Żądania HTTP do API (bez ponowień).",
+    "erpflow_http_retries_total": "Ponowienia żądań HTTP według powodu.",
+    "erpflow_http_failures_total": "Żądania HTTP nieudane mimo ponowień.",
+    "erpflow_http_circuit_opened_total": "Wstrzymania wysyłania żądań do przeciążonego serwera.",
+}
+
+__lock = threading.Lock()
+__counters = {}
+__gauges = {}
+__histograms = {}
+
+def __key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def inc(name: str, value: float = 1, **labels):
+    """
+    Zwiększa licznik `name` z etykietami `labels`.
+    """
+    if not value:
+        return
+    key = __key(name, labels)
+    with __lock:
+        __counters[key] = __counters.get(key, 0) + value
+
+def set_gauge(name: str, value: float, **labels):
+    """
+    Ustawia wartość metryki `name` z etykietami `labels`.
+    """
+    with __lock:
+        __gauges[__key(name, labels)] = value
+
+def observe(name: str, seconds: float, **labels):
+    """
+    Dodaje pomiar czasu do histogramu `name` z etykietami `labels`.
+    """
+    key = __key(name, labels)
+    with __lock:
+        histogram = __histograms.get(key)
+        if histogram is None:
+            histogram = __histograms[key] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+@contextmanager
+def timer(name: str, **labels):
+    """
+    Mierzy czas bloku `with` i dodaje go do histogramu `name` (również przy wyjątku).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+def __collect():
+    """
+    Przepisuje liczniki zapytań SQL (`sql.get_query_stats`) i warstwy HTTP (`http_client.get_retry_stats`) do metryk.
+    """
+    import sql
+    import http_client
+    collected = {}
+    for name, stats in sql.get_query_stats().items():
+        collected[__key("erpflow_db_queries_total", {"query": name})] = stats["executions"]
+        collected[__key("erpflow_db_query_errors_total", {"query": name})] = stats["errors"]
+        collected[__key("erpflow_db_query_seconds_total", {"query": name})] = round(stats["total_seconds"], 6)
+    http_stats = http_client.get_retry_stats()
+    collected[__key("erpflow_http_requests_total", {})] = http_stats["requests"]
+    collected[__key("erpflow_http_failures_total", {})] = http_stats["failures"]
+    collected[__key("erpflow_http_circuit_opened_total", {})] = http_stats["circuit_opened"]
+    for reason, count in http_stats["by_reason"].items():
+        collected[__key("erpflow_http_retries_total", {"reason": reason})] = count
+    with __lock:
+        __counters.update(collected)
+
+def snapshot() -> dict:
+    """
+    Zwraca kopię wszystkich metryk: {'counters': {...}, 'gauges': {...}, 'histograms': {...}},
+    gdzie kluczami są pary (nazwa, etykiety).
+    """
+    __collect()
+    with __lock:
+        return {
+            "counters": dict(__counters),
+            "gauges": dict(__gauges),
+            "histograms": {key: {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]} for key, value in __histograms.items()},
+        }
+
+def __format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+def __format_number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def to_prometheus(data: dict) -> str:
+    """
+    Zamienia `snapshot()` na format tekstowy Prometheus (dla kolektora textfile node_exportera).
+    """
+    lines = []
+    sections = [
+        ("counter", data["counters"]),
+        ("gauge", data["gauges"]),
+        ("histogram", data["histograms"]),
+    ]
+    for metric_type, values in sections:
+        for name in sorted({name for name, _ in values}):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for (metric_name, labels), value in sorted(values.items()):
+                if metric_name != name:
+                    continue
+                if metric_type != "histogram":
+                    lines.append(f"{name}{__format_labels(labels)} {__format_number(value)}")
+                    continue
+                for bound, count in zip(BUCKETS, value["buckets"]):
+                    lines.append(f"{name}_bucket{__format_labels(labels, (('le', str(bound)),))} {count}")
+                lines.append(f"{name}_bucket{__format_labels(labels, (('le', '+Inf'),))} {value['count']}")
+                lines.append(f"{name}_sum{__format_labels(labels)} {__format_number(value['sum'])}")
+                lines.append(f"{name}_count{__format_labels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+def to_json(data: dict) -> str:
+    """
+    Zamienia `snapshot()` na JSON: listy {'name', 'labels', 'value'} (histogramy z 'buckets', 'sum', 'count').
+    """
+    def entries(values):
+        return [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(values.items())]
+    histograms = [
+        {"name": name, "labels": dict(labels), "buckets": dict(zip(map(str, BUCKETS), value["buckets"])), "sum": value["sum"], "count": value["count"]}
+        for (name, labels), value in sorted(data["histograms"].items())
+    ]
+    return json.dumps({
+        "generated_at": time.time(),
+        "counters": entries(data["counters"]),
+        "gauges": entries(data["gauges"]),
+        "histograms": histograms,
+    }, ensure_ascii=False, indent=2)
+
+def write(path: str = None, daemon: bool = False) -> bool:
+    """
+    Zapisuje metryki do pliku `path` (domyślnie zmienna środowiskowa `metrics_file`; brak - nic nie robi).
+    Format wybiera zmienna `metrics_format` ('prometheus' lub 'json'); domyślnie JSON dla pliku *.json
+    lub w trybie daemon, a w pozostałych przypadkach format tekstowy Prometheus.
+    Plik jest zapisywany atomowo (plik tymczasowy + zamiana), więc node_exporter nigdy nie czyta połowy pliku.
+    """
+    path = path or os.getenv("metrics_file")
+    if not path:
+        return False
+
+    metrics_format = (os.getenv("metrics_format") or "").lower()
+    if not metrics_format:
+        metrics_format = "json" if path.endswith(".json") or daemon else "prometheus"
+
+    data = snapshot()
+    content = to_json(data) if metrics_format == "json" else to_prometheus(data)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(temp_path, path)
+        log.debug(f"Zapisano metryki do {path} ({metrics_format}).")
+        return True
+    except OSError as e:
+        log.error(f"Nie udało się zapisać metryk do {path}: {e}")
+        return False
@@ -3,47 +3,126 @@ import comarch_client as db
 import connections as con
 import logger as log
 import wc_client as wc
+import sql
 import args
+import reconcile as reconcile_module
 
 def get_incremental_query(database_name, last_sync_timestamp):
-    return f'''
+    """
+    Zwraca (zapytanie, parametry) pobierające produkty zmienione od ostatniej synchronizacji (temporal tables).
+    """
+    towary = sql.table(database_name, 'CDN', 'Towary')
+    twr_ceny = sql.table(database_name, 'CDN', 'TwrCeny')
+    last_sync = sql.to_datetime(last_sync_timestamp)
+    current_time = sql.to_datetime(db.sync_start_timestamp)
+    query = f'''
         SELECT DISTINCT 
             t.Twr_TwrId,
             t.Twr_Nazwa,
             t.Twr_Opis,
             tc.TwC_Wartosc,
             tc.TwC_Zaokraglenie
-        FROM [{database_name}].[CDN].[Towary] t
-        INNER JOIN [{database_name}].[CDN].[TwrCeny] tc 
+        FROM {towary} t
+        INNER JOIN {twr_ceny} tc 
             ON t.Twr_TwrId = tc.TwC_TwrID
         WHERE tc.TwC_Typ = 2
         AND (
             -- Zmiany w tabeli Towary od ostatniej synchronizacji
             EXISTS (
-                SELECT 1 FROM [{database_name}].[CDN].[Towary] 
-                FOR SYSTEM_TIME BETWEEN '{last_sync_timestamp}' AND '{db.sync_start_timestamp}' th
+                SELECT 1 FROM {towary} 
+                FOR SYSTEM_TIME BETWEEN ? AND ? th
                 WHERE th.Twr_TwrId = t.Twr_TwrId
-                AND th.ValidFrom > '{last_sync_timestamp}'
+                AND th.ValidFrom > ?
             )
             OR
             -- Zmiany w tabeli TwrCeny od ostatniej synchronizacji
             EXISTS (
-                SELECT 1 FROM [{database_name}].[CDN].[TwrCeny] 
-                FOR SYSTEM_TIME BETWEEN '{last_sync_timestamp}' AND '{db.sync_start_timestamp}' tch
+                SELECT 1 FROM {twr_ceny} 
+                FOR SYSTEM_TIME BETWEEN ? AND ? tch
                 WHERE tch.TwC_TwrID = tc.TwC_TwrID
                 AND tch.TwC_Typ = 2
-                AND tch.ValidFrom > '{last_sync_timestamp}'
+                AND tch.ValidFrom > ?
             )
         )
     '''
+    return query, (last_sync, current_time, last_sync, last_sync, current_time, last_sync)
+
+def get_change_tracking_query(database_name, last_sync_version):
+    """
+    Zwraca (zapytanie, parametry) pobierające produkty zmienione od wersji ostatniej synchronizacji (Change Tracking).
+    """
+    towary = sql.table(database_name, 'CDN', 'Towary')
+    twr_ceny = sql.table(database_name, 'CDN', 'TwrCeny')
+    query = f'''
+        SELECT DISTINCT 
+            t.Twr_TwrId,
+            t.Twr_Nazwa,
+            t.Twr_Opis,
+            tc.TwC_Wartosc,
+            tc.TwC_Zaokraglenie
+        FROM {towary} t
+        INNER JOIN {twr_ceny} tc 
+            ON t.Twr_TwrId = tc.TwC_TwrID
+        WHERE tc.TwC_Typ = 2
+        AND (
+            -- Zmiany w tabeli Towary od wersji ostatniej synchronizacji
+            t.Twr_TwrId IN (
+                SELECT ct.Twr_TwrId FROM CHANGETABLE(CHANGES {towary}, ?) ct
+            )
+            OR
+            -- Zmiany w tabeli TwrCeny od wersji ostatniej synchronizacji
+            tc.TwC_TwCID IN (
+                SELECT ct.TwC_TwCID FROM CHANGETABLE(CHANGES {twr_ceny}, ?) ct
+            )
+        )
+    '''
+    return query, (int(last_sync_version), int(last_sync_version))
 
 def get_full_query(database_name):
-    return f'''
+    """
+    Zwraca (zapytanie, parametry) pobierające wszystkie produkty.
+    """
+    query = f'''
         SELECT DISTINCT t.Twr_TwrId, Twr_Nazwa, Twr_Opis, TwC_Wartosc, TwC_Zaokraglenie 
-        FROM [{database_name}].[CDN].[Towary] t
-        INNER JOIN [{database_name}].[CDN].[TwrCeny] tc ON t.Twr_TwrId = tc.TwC_TwrID
+        FROM {sql.table(database_name, 'CDN', 'Towary')} t
+        INNER JOIN {sql.table(database_name, 'CDN', 'TwrCeny')} tc ON t.Twr_TwrId = tc.TwC_TwrID
         WHERE tc.TwC_Typ = 2
     '''
+    return query, ()
+
+def prefetch_product_changes(records, last_sync_timestamp, force):
+    """
+    Pobiera zmiany w tabelach Towary i TwrCeny dla wszystkich produktów naraz,
+    tak by `map_product_to_wc` nie odpytywał bazy dla każdego produktu osobno.
+    """
+    product_ids = [row.Twr_TwrId for row in records]
+
+    db.prefetch_changed_columns(
+        table_name='Towary',
+        columns=['Twr_Nazwa', 'Twr_Opis'],
+        record_ids=product_ids,
+        id_column='Twr_TwrId',
+        last_sync=last_sync_timestamp,
+        current_time=db.sync_start_timestamp,
+        force=force
+    )
+    db.prefetch_changed_columns(
+        table_name='TwrCeny',
+        columns=['TwC_Wartosc', 'TwC_Zaokraglenie'],
+        record_ids=product_ids,
+        id_column='TwC_TwrID',
+        last_sync=last_sync_timestamp,
+        current_time=db.sync_start_timestamp,
+        force=force,
+        filters={'TwC_Typ': 2}
+    )
+
+def get_sku_index() -> dict:
+    """
+    Zwraca {SKU: ID produktu} wszystkich produktów WooCommerce (100 na stronę, tylko pola id i sku).
+    """
+    products = con.wcapi.get_all("products", {"context": "edit", "_fields": "id,sku"})
+    return {str(product["sku"]): product["id"] for product in products if product.get("sku")}
 
 def map_product_to_wc(product, last_sync_timestamp, force, skip_free=False):
     # Obliczamy cenę regularną z uwzględnieniem zaokrągleń
@@ -106,11 +185,12 @@ def map_product_to_wc(product, last_sync_timestamp, force, skip_free=False):
         if 'Cena' in changes: product_data["regular_price"] = str(changes['Cena']['new'])
         
         # Logowanie zmian
-        change_details = ", ".join([
-            f"{col}: {info.get('old')} -> {info.get('new')}"
-            for col, info in changes.items()
-        ])
-        log.debug(f"Zmiany w produkcie ID={product.Twr_TwrId}: {change_details}")
+        if log.is_debug_enabled():
+            change_details = ", ".join([
+                f"{col}: {info.get('old')} -> {info.get('new')}"
+                for col, info in changes.items()
+            ])
+            log.debug(f"Zmiany w produkcie ID={product.Twr_TwrId}: {change_details}")
 
     else:
         # Jeśli nie ma zmian (np. pełna synchronizacja), używamy aktualnych wartości
@@ -122,9 +202,10 @@ def map_product_to_wc(product, last_sync_timestamp, force, skip_free=False):
     
     return product_data
 
-def sync(add_all=None, skip_free=None, force=None) -> bool:
+def sync(add_all=None, skip_free=None, force=None, streaming=None) -> bool:
     """
     Synchronizuje produkty między bazą danych MSSQL a WooCommerce.
+    Z `streaming=True` produkty są pobierane, mapowane i wysyłane paczkami (patrz `generic_sync`).
     """
     # Argumenty
     if args.args is not None:
@@ -134,11 +215,14 @@ def sync(add_all=None, skip_free=None, force=None) -> bool:
             skip_free = not getattr(args.args, 'obejmuj_darmowe_towary', False)
         if force is None:
             force = getattr(args.args, 'force', False)
+        if streaming is None:
+            streaming = getattr(args.args, 'streaming', False)
             
     # Domyślne wartości
     add_all = bool(add_all) if add_all is not None else False
     skip_free = bool(skip_free) if skip_free is not None else False
     force = bool(force) if force is not None else False
+    streaming = bool(streaming) if streaming is not None else False
 
     database_name = os.getenv("database_name")
     if not database_name:
@@ -148,12 +232,25 @@ def sync(add_all=None, skip_free=None, force=None) -> bool:
     last_sync_timestamp = db.sync_state.get('last_sync_timestamp')
     has_previous_sync = last_sync_timestamp is not None
     use_incremental = has_previous_sync and not add_all
+    last_sync_version = None
+
+    # Change Tracking nie przechowuje poprzednich wartości kolumn - wysyłamy pełne dane zmienionych produktów
+    if db.change_backend == db.CHANGE_TRACKING:
+        last_sync_version = db.get_last_sync_version(['Towary', 'TwrCeny']) if use_incremental else None
+        use_incremental = last_sync_version is not None
+        last_sync_timestamp = None
 
-    if use_incremental:
-        query = get_incremental_query(database_name, last_sync_timestamp)
+    if use_incremental and db.change_backend == db.CHANGE_TRACKING:
+        query_name = "products.changes"
+        query, params = get_change_tracking_query(database_name, last_sync_version)
+        log.info("Rozpoczynanie synchronizacji przyrostowej produktów (Change Tracking)...")
+    elif use_incremental:
+        query_name = "products.incremental"
+        query, params = get_incremental_query(database_name, last_sync_timestamp)
         log.info("Rozpoczynanie synchronizacji przyrostowej produktów...")
     else:
-        query = get_full_query(database_name)
+        query_name = "products.full"
+        query, params = get_full_query(database_name)
         if last_sync_timestamp:
             log.info("Pełna przebudowa: pobieranie wszystkich produktów.")
         else:
@@ -161,19 +258,37 @@ def sync(add_all=None, skip_free=None, force=None) -> bool:
 
     mapper = lambda row, ls, f: map_product_to_wc(row, ls, f, skip_free=skip_free)
 
-    return db.generic_sync(
-        entity_name="produktów",
-        fetch_query=query,
-        id_mapping_table="TowarIDs",
-        db_id_column="Twr_TwrId",
-        api_id_column="WC_ID",
-        data_mapper_func=mapper,
-        api_batch_func=wc.batch_sync_products,
-        last_sync_timestamp=last_sync_timestamp,
-        rebuild=add_all,
-        force=force
+    # Produkty usunięte z bazy (przyrostowo z historii / Change Tracking, przy pełnej synchronizacji przez anti-join)
+    deleted_query, deleted_params = db.get_deleted_query(
+        database_name, 'Towary', 'Twr_TwrId', 'TowarIDs', 'WC_ID',
+        last_sync_timestamp=last_sync_timestamp if use_incremental else None,
+        last_sync_version=last_sync_version if use_incremental else None
     )
 
+    try:
+        return db.generic_sync(
+            entity_name="produktów",
+            fetch_query=query,
+            fetch_params=params,
+            query_name=query_name,
+            deleted_query=deleted_query,
+            deleted_params=deleted_params,
+            id_mapping_table="TowarIDs",
+            db_id_column="Twr_TwrId",
+            api_id_column="WC_ID",
+            data_mapper_func=mapper,
+            api_batch_func=wc.batch_sync_products,
+            last_sync_timestamp=last_sync_timestamp,
+            rebuild=add_all,
+            force=force,
+            prefetch_func=prefetch_product_changes,
+            chunk_size=db.get_stream_chunk_size() if streaming else None,
+            key_index_func=get_sku_index
+        )
+    finally:
+        db.clear_changed_columns_cache('Towary', 'Twr_TwrId')
+        db.clear_changed_columns_cache('TwrCeny', 'TwC_TwrID')
+
 def regenerate():
     """
     Usuwa wszystkie produkty z WooCommerce, które mają swoje ID w tabeli TowarIDs,
@@ -208,11 +323,38 @@ def regenerate():
         if success:
             log.info("Regeneracja zakończona pomyślnie.")
             # Aktualizujemy timestamp na teraz
-            if db.sync_start_timestamp:
-                db.sync_state['last_sync_timestamp'] = db.sync_start_timestamp
-                db.save_sync_state()
+            db.update_sync_watermark()
+            db.save_sync_state()
         else:
             log.error("Regeneracja zakończona z błędami.")
 
     except Exception as e:
         log.error(f"Błąd podczas regeneracji: {e}", stack_info=True)
+
+def reconcile(skip_free=None) -> bool:
+    """
+    Uzgadnia produkty WooCommerce z bazą po SKU (--uzgodnij), wysyłając tylko potrzebne zmiany
+    i odbudowując tabelę TowarIDs (patrz `reconcile.run`).
+    """
+    if skip_free is None:
+        skip_free = args.args is not None and not getattr(args.args, 'obejmuj_darmowe_towary', False)
+
+    database_name = os.getenv("database_name")
+    if not database_name:
+        log.error("Nie znaleziono nazwy bazy danych w zmiennych środowiskowych.")
+        return False
+
+    query, params = get_full_query(database_name)
+    return reconcile_module.run(
+        entity_name="produktów",
+        fetch_query=query,
+        fetch_params=params,
+        query_name="products.full",
+        list_func=lambda: con.wcapi.get_all("products", {"context": "edit", "_fields": "id,sku,name,description,regular_price"}),
+        key_field="sku",
+        data_mapper_func=lambda row, ls, f: map_product_to_wc(row, ls, f, skip_free=skip_free),
+        api_batch_func=wc.batch_sync_products,
+        id_mapping_table="TowarIDs",
+        db_id_column="Twr_TwrId",
+        api_id_column="WC_ID"
+    )
@@ -0,0 +1,192 @@
+import io
+import os
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+from contextlib import contextmanager
+import logger as log
+import metrics
+
+__all__ = ["enable", "is_enabled", "phase", "write_report"]
+
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 10
+
+# Kategorie czasu w podsumowaniu raportu: (nazwa, funkcja dopasowująca (plik, nazwa funkcji), czy liczyć czas łączny)
+# Czas łączny (z wywołaniami) dla funkcji wejściowych, czas własny dla funkcji wbudowanych, które czekają na sieć lub bazę
+CATEGORIES = [
+    ("Wykrywanie zmian (get_changed_columns)", lambda file, func: func in ("get_changed_columns", "prefetch_changed_columns"), True),
+    ("Kodowanie i dekodowanie JSON", lambda file, func: file.replace("\\", "/").endswith("json/__init__.py") and func in ("dumps", "loads"), True),
+    ("Oczekiwanie na HTTP", lambda file, func: file == "~" and any(name in func for name in ("'recv_into' of '_socket", "'read' of '_ssl", "'do_handshake' of '_ssl", "'connect' of '_socket")), False),
+    ("Oczekiwanie na SQL", lambda file, func: file == "~" and "pyodbc.Cursor" in func, False),
+]
+
+__enabled = False
+__lock = threading.Lock()
+__phases = {}  # {(encja, etap): {'profile', 'wall', 'calls', 'peak', 'allocations'}}
+__local = threading.local()
+
+def enable():
+    """
+    Włącza profilowanie (--profile): każdy etap `phase` wątku głównego jest profilowany przez cProfile,
+    a tracemalloc śledzi szczytowe zużycie pamięci i miejsca alokacji.
+    """
+    global __enabled
+    __enabled = True
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def is_enabled() -> bool:
+    return __enabled
+
+def __get_phase(key: tuple) -> dict:
+    with __lock:
+        entry = __phases.get(key)
+        if entry is None:
+            entry = __phases[key] = {"profile": cProfile.Profile(), "wall": 0.0, "calls": 0, "profiled_calls": 0, "peak": 0, "allocations": {}}
+        return entry
+
+@contextmanager
+def phase(entity: str, name: str):
+    """
+    Etap synchronizacji encji (np. 'products', 'fetch'). Czas etapu trafia zawsze do metryki `erpflow_phase_seconds`,
+    a przy włączonym profilowaniu również do raportu (`write_report`).
+
+    Etapy mogą być zagnieżdżone (np. zapis mapowań w trakcie wysyłania partii) - na czas etapu wewnętrznego
+    profilowanie etapu zewnętrznego jest wstrzymywane, więc czas CPU nie jest liczony podwójnie.
+
+    cProfile działa tylko w wątku głównym: od Pythona 3.12 w procesie może być aktywny jeden profiler,
+    więc etapy innych wątków (np. czytanie i wysyłanie w trybie --strumieniowo) mają tylko czas i pamięć.
+    """
+    if not __enabled:
+        with metrics.timer("erpflow_phase_seconds", entity=entity, phase=name):
+            yield
+        return
+
+    stack = getattr(__local, "stack", None)
+    if stack is None:
+        stack = __local.stack = []
+    entry = __get_phase((entity, name))
+    frame = {"entry": entry, "peak": 0}
+    profiled = threading.current_thread() is threading.main_thread()
+
+    if stack:
+        outer = stack[-1]
+        if profiled:
+            outer["entry"]["profile"].disable()
+        outer["peak"] = max(outer["peak"], tracemalloc.get_traced_memory()[1])
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    start_snapshot = tracemalloc.take_snapshot()
+    stack.append(frame)
+
+    started = time.perf_counter()
+    if profiled:
+        entry["profile"].enable()
+    try:
+        yield
+    finally:
+        if profiled:
+            entry["profile"].disable()
+        elapsed = time.perf_counter() - started
+        metrics.observe("erpflow_phase_seconds", elapsed, entity=entity, phase=name)
+        stack.pop()
+
+        peak = max(frame["peak"], tracemalloc.get_traced_memory()[1]) - current
+        differences = tracemalloc.take_snapshot().compare_to(start_snapshot, "lineno")
+        with __lock:
+            entry["wall"] += elapsed
+            entry["calls"] += 1
+            entry["profiled_calls"] += int(profiled)
+            entry["peak"] = max(entry["peak"], peak)
+            for stat in differences:
+                if stat.size_diff <= 0:
+                    continue
+                location = str(stat.traceback[0])
+                size, count = entry["allocations"].get(location, (0, 0))
+                entry["allocations"][location] = (size + stat.size_diff, count + stat.count_diff)
+
+        if stack and profiled:
+            stack[-1]["entry"]["profile"].enable()
+
+def __format_bytes(size: int) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+def __category_times(stats: pstats.Stats) -> list[float]:
+    totals = [0.0] * len(CATEGORIES)
+    for (file, _, func), (_, _, own_time, total_time, _) in stats.stats.items():
+        for i, (_, matches, cumulative) in enumerate(CATEGORIES):
+            if matches(file, func):
+                totals[i] += total_time if cumulative else own_time
+    return totals
+
+def write_report(directory: str) -> str | None:
+    """
+    Zapisuje raport profilowania do pliku `profile_<data>.txt` w katalogu `directory`:
+    podsumowanie etapów (czas, CPU, szczyt pamięci), udział wykrywania zmian, JSON i oczekiwania na HTTP / SQL,
+    a dla każdego etapu najdroższe funkcje (cProfile) i miejsca alokacji (tracemalloc). Zwraca ścieżkę pliku.
+    """
+    if not __enabled:
+        return None
+
+    with __lock:
+        phases = sorted(__phases.items(), key=lambda item: item[1]["wall"], reverse=True)
+        __phases.clear()
+    if not phases:
+        return None
+
+    out = io.StringIO()
+    out.write(f"Raport profilowania ERPFlow - {datetime.now():%Y-%m-%d %H:%M:%S}\n\n")
+    out.write(f"{'Encja':<14}{'Etap':<12}{'Wywołań':>9}{'Czas [s]':>11}{'CPU [s]':>10}{'Szczyt pamięci':>17}\n")
+
+    all_stats = None
+    details = []
+    for (entity, name), entry in phases:
+        # Etapy wykonywane tylko poza wątkiem głównym nie mają danych cProfile
+        stats = pstats.Stats(entry["profile"], stream=io.StringIO()) if entry["profiled_calls"] else None
+        if stats is None:
+            cpu = "-"
+        else:
+            if all_stats is None:
+                all_stats = pstats.Stats(entry["profile"], stream=io.StringIO())
+            else:
+                all_stats.add(entry["profile"])
+            cpu = f"{sum(own_time for _, _, own_time, _, _ in stats.stats.values()):.3f}"
+        out.write(f"{entity:<14}{name:<12}{entry['calls']:>9}{entry['wall']:>11.3f}{cpu:>10}{__format_bytes(entry['peak']):>17}\n")
+        details.append((entity, name, entry, stats))
+
+    if all_stats is not None:
+        out.write("\nUdział wybranych kategorii (etapy wątku głównego):\n")
+        for (label, _, cumulative), seconds in zip(CATEGORIES, __category_times(all_stats)):
+            out.write(f"  {label}: {seconds:.3f} s ({'łącznie z wywołaniami' if cumulative else 'czas własny'})\n")
+
+    for entity, name, entry, stats in details:
+        out.write(f"\n=== {entity} / {name} ===\n")
+        if stats is None:
+            out.write("Etap wykonywany poza wątkiem głównym - bez profilu cProfile.\n")
+        else:
+            functions = io.StringIO()
+            stats.stream = functions
+            stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+            out.write(functions.getvalue().strip() + "\n")
+        out.write(f"\nNajwięcej zaalokowanej pamięci (pozostającej po etapie), szczyt {__format_bytes(entry['peak'])}:\n")
+        allocations = sorted(entry["allocations"].items(), key=lambda item: item[1][0], reverse=True)[:TOP_ALLOCATIONS]
+        for location, (size, count) in allocations:
+            out.write(f"  {__format_bytes(size):>10} w {count} blokach: {location}\n")
+
+    path = os.path.join(directory, f"profile_{datetime.now():%Y%m%d_%H%M%S}.txt")
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(out.getvalue())
+    except OSError as e:
+        log.error(f"Nie udało się zapisać raportu profilowania do {path}: {e}")
+        return None
+    log.info(f"Zapisano raport profilowania: {path}")
+    return path
@@ -0,0 +1,198 @@
+import json
+from decimal import Decimal, InvalidOperation
+import pyodbc
+import requests
+import connections as con
+import comarch_client as db
+import logger as log
+import sql
+
+__all__ = ["run"]
+
+# Pola, których nie porównujemy ze sklepem (hasło nie jest zwracane przez API, ID jest kluczem)
+IGNORED_FIELDS = ("id", "password")
+
+def __same_value(key: str, value, store_value) -> bool:
+    """
+    Porównuje wartość wysyłaną do API z wartością zwróconą przez sklep.
+    """
+    if key == "meta_data":
+        store_meta = {meta.get("key"): meta.get("value") for meta in store_value or []}
+        return all(str(store_meta.get(meta["key"], "")) == str(meta["value"]) for meta in value or [])
+    if key == "roles":
+        return set(value or []) == set(store_value or [])
+    if key.endswith("price"):
+        try:
+            return Decimal(str(value or 0)) == Decimal(str(store_value or 0))
+        except InvalidOperation:
+            pass
+    return str(value if value is not None else "").strip() == str(store_value if store_value is not None else "").strip()
+
+def __differs(data: dict, item: dict) -> bool:
+    """
+    Sprawdza, czy element sklepu różni się od danych z bazy. Pola, których sklep nie zwraca
+    (np. niezarejestrowane w REST API), są pomijane.
+    """
+    return any(
+        key in item and not __same_value(key, value, item[key])
+        for key, value in data.items()
+        if key not in IGNORED_FIELDS
+    )
+
+def __load_mappings(entity_name: str, id_mapping_table: str, db_id_column: str, api_id_column: str) -> dict | None:
+    try:
+        sql.execute(f"mappings.{id_mapping_table}.load", f'SELECT {sql.quote_identifier(db_id_column)}, {sql.quote_identifier(api_id_column)} FROM {sql.table(None, "ERPFlow", id_mapping_table)}')
+        return {row[1]: row[0] for row in con.cursor.fetchall()}
+    except pyodbc.Error as e:
+        log.error(f"Błąd podczas wczytywania mapowań {entity_name}: {e}")
+        return None
+
+def __replace_mappings(entity_name: str, id_mapping_table: str, db_id_column: str, api_id_column: str, mappings: list[tuple]) -> bool:
+    """
+    Zastępuje zawartość tabeli mapowań: usuwa mapowania spoza `mappings`, a pozostałe zapisuje przez `save_id_mappings`.
+    """
+    try:
+        sql.execute(
+            f"mappings.{id_mapping_table}.prune",
+            f"DELETE FROM {sql.table(None, 'ERPFlow', id_mapping_table)} WHERE {sql.quote_identifier(db_id_column)} NOT IN (SELECT CAST(value AS INT) FROM OPENJSON(?))",
+            (json.dumps([db_id for db_id, *_ in mappings]),)
+        )
+        inserted, updated = db.save_id_mappings(id_mapping_table, db_id_column, api_id_column, mappings)
+        log.info(f"Odbudowano mapowania {entity_name}: {len(mappings)} mapowań ({inserted} nowych, {updated} zmienionych).")
+        return True
+    except pyodbc.Error as e:
+        log.error(f"Błąd podczas odbudowy mapowań {entity_name}: {e}")
+        return False
+
+def run(
+    entity_name: str,
+    fetch_query: str,
+    fetch_params: tuple,
+    query_name: str,
+    list_func,
+    key_field: str,
+    data_mapper_func,
+    api_batch_func,
+    id_mapping_table: str,
+    db_id_column: str,
+    api_id_column: str
+) -> bool:
+    """
+    Uzgadnia sklep z bazą bez usuwania wszystkiego (zamiast --regeneruj).
+
+    Pobiera wszystkie elementy sklepu (`list_func`) i wszystkie rekordy bazy (`fetch_query`), łączy je po kluczu
+    (`key_field`: 'sku' lub 'username') i wysyła tylko potrzebne operacje:
+    - tworzenie rekordów, których nie ma w sklepie,
+    - aktualizację elementów, które różnią się od danych z bazy,
+    - usunięcie elementów zmapowanych w `id_mapping_table`, których rekordów nie ma już w bazie.
+    Elementy sklepu bez mapowania (np. dodane ręcznie) nie są usuwane.
+    Na koniec tabela mapowań jest odbudowywana z tego, co znaleziono w sklepie.
+
+    Args:
+        list_func (callable): Funkcja zwracająca listę wszystkich elementów sklepu (np. `ApiClient.get_all`).
+        data_mapper_func (callable): Tak jak w `generic_sync`, wywoływana bez znacznika czasu (pełne dane).
+
+    Returns:
+        bool: True jeżeli wszystkie operacje i zapis mapowań się powiodły.
+    """
+    log.info(f"Uzgadnianie {entity_name}: pobieranie danych ze sklepu...")
+    try:
+        store_items = list_func()
+    except (requests.RequestException, ValueError) as e:
+        log.error(f"Nie udało się pobrać {entity_name} ze sklepu: {e}")
+        return False
+    store_by_key = {str(item[key_field]): item for item in store_items if item.get(key_field)}
+    log.info(f"Pobrano {len(store_items)} {entity_name} ze sklepu ({len(store_by_key)} z polem '{key_field}').")
+
+    mapped = __load_mappings(entity_name, id_mapping_table, db_id_column, api_id_column)
+    if mapped is None:
+        return False
+
+    try:
+        sql.execute(query_name, fetch_query, fetch_params)
+        records = con.cursor.fetchall()
+    except pyodbc.Error as e:
+        log.error(f"Błąd podczas pobierania {entity_name} z bazy: {e}")
+        return False
+
+    status = True
+    db_ids = set()
+    to_create = []
+    to_update = []
+    item_map = {}  # {klucz: db_id} dla tworzonych elementów
+    hashes = {}
+    mappings = {}  # {db_id: (api_id, hash)}
+    unchanged = 0
+
+    for row in records:
+        db_id = getattr(row, db_id_column)
+        db_ids.add(db_id)
+        try:
+            data = data_mapper_func(row, None, False)
+        except Exception as e:
+            log.error(f"Błąd podczas przetwarzania {entity_name} (ID: {db_id}): {e}")
+            status = False
+            continue
+        if not data or not data.get(key_field):
+            continue
+
+        key = str(data[key_field])
+        hashes[db_id] = db.compute_payload_hash(data)
+        item = store_by_key.get(key)
+        if item is None:
+            item_map[key] = db_id
+            to_create.append(data)
+        elif __differs(data, item):
+            # Pola tylko do odczytu (np. nazwa użytkownika) - porównujemy po nich, ale ich nie wysyłamy
+            update = {k: v for k, v in data.items() if k not in db.READ_ONLY_FIELDS}
+            update["id"] = item["id"]
+            to_update.append(update)
+            mappings[db_id] = (item["id"], None)
+        else:
+            mappings[db_id] = (item["id"], hashes[db_id])
+            unchanged += 1
+
+    # Rekordy pominięte przez mapowanie (np. darmowe towary) zachowują istniejące mapowanie
+    store_ids = {item["id"] for item in store_items}
+    for api_id, db_id in mapped.items():
+        if db_id in db_ids and db_id not in mappings and api_id in store_ids:
+            mappings[db_id] = (api_id, None)
+
+    # Usuwamy tylko elementy zmapowane, których rekordów nie ma już w bazie
+    deletions = [api_id for api_id, db_id in mapped.items() if db_id not in db_ids and api_id in store_ids]
+
+    log.info(f"Uzgadnianie {entity_name}: do utworzenia {len(to_create)}, do aktualizacji {len(to_update)}, do usunięcia {len(deletions)}, bez zmian {unchanged}.")
+
+    if to_create or to_update or deletions:
+        try:
+            success, created_items, updated_items, deleted_items = api_batch_func(
+                creations=to_create, updates=to_update, deletions=deletions
+            )
+        except Exception as e:
+            log.error(f"Błąd podczas wysyłania {entity_name}: {e}")
+            return False
+        status = status and success
+
+        for item in created_items:
+            key = item.get(key_field) or item.get("sku")
+            if item.get("id") and not item.get("error") and key in item_map:
+                db_id = item_map[key]
+                mappings[db_id] = (item["id"], hashes.get(db_id))
+
+        by_api_id = {api_id: db_id for db_id, (api_id, _) in mappings.items()}
+        for item in updated_items:
+            db_id = by_api_id.get(item.get("id"))
+            if db_id is not None and not item.get("error"):
+                mappings[db_id] = (item["id"], hashes.get(db_id))
+
+        # Elementy, których nie udało się usunąć, zachowują mapowanie, by usunąć je przy kolejnej synchronizacji
+        deleted_ids = {item.get("id") or (item.get("previous") or {}).get("id") for item in deleted_items if not item.get("error")}
+        for api_id in deletions:
+            if api_id not in deleted_ids:
+                mappings[mapped[api_id]] = (api_id, None)
+
+    rows = [(db_id, api_id, payload_hash) for db_id, (api_id, payload_hash) in mappings.items()]
+    status = __replace_mappings(entity_name, id_mapping_table, db_id_column, api_id_column, rows) and status
+
+    log.info(f"Zakończono uzgadnianie {entity_name}.")
+    return status
@@ -0,0 +1,87 @@
+import logger as log
+import connections as con
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+__all__ = ["run_tasks"]
+
+def __run_with_connection(name: str, func) -> bool:
+    """
+    Uruchamia zadanie w bieżącym wątku z osobnym połączeniem z bazą danych.
+    """
+    with con.thread_connection():
+        log.debug(f"Rozpoczęto zadanie '{name}'.")
+        return func()
+
+def run_tasks(tasks: dict, parallel: bool = True) -> dict[str, bool]:
+    """
+    Uruchamia zadania synchronizacji z uwzględnieniem zależności między nimi.
+
+    Zadanie startuje, gdy wszystkie jego zależności zakończyły się sukcesem, a zadania niezależne działają
+    równolegle, każde w osobnym wątku z własnym połączeniem z bazą danych. Jeżeli któraś zależność się
+    nie powiodła, zadanie jest pomijane i ma wynik False (tak samo jego zadania zależne).
+    Np. {'towary': (products.sync, []), 'kontrahenci': (contractors.sync, []), 'rabaty': (discounts.sync, ['towary'])}
+    uruchamia towary i kontrahentów równolegle, a rabaty po zakończeniu towarów.
+
+    Args:
+        tasks (dict): Słownik {nazwa: (funkcja, [nazwy zależności])}. Funkcja zwraca True przy sukcesie.
+            Zależności spoza słownika są ignorowane.
+        parallel (bool): Jeśli False, zadania są wykonywane po kolei w bieżącym wątku (z głównym połączeniem).
+
+    Returns:
+        dict[str, bool]: Wynik każdego zadania. Zadanie, które zgłosiło wyjątek lub zostało pominięte, ma wynik False.
+    """
+    results = {}
+    pending = {name: [dep for dep in deps if dep in tasks] for name, (_, deps) in tasks.items()}
+
+    def ready():
+        """
+        Zwraca zadania gotowe do uruchomienia. Zadania z nieudaną zależnością są usuwane z `pending`
+        z wynikiem False (powtarzane, bo pominięte zadanie może być zależnością kolejnego).
+        """
+        while True:
+            names = [name for name, deps in pending.items() if all(dep in results for dep in deps)]
+            failed = [name for name in names if not all(results[dep] for dep in pending[name])]
+            if not failed:
+                return names
+            for name in failed:
+                log.warning(f"Pominięto zadanie '{name}' - zależność {', '.join(dep for dep in pending[name] if not results[dep])} zakończona błędem.")
+                del pending[name]
+                results[name] = False
+
+    if not parallel:
+        while pending:
+            names = ready()
+            if not names and pending:
+                raise ValueError(f"Cykliczne zależności między zadaniami: {', '.join(pending)}")
+            for name in names:
+                del pending[name]
+                try:
+                    results[name] = bool(tasks[name][0]())
+                except Exception as e:
+                    log.error(f"Zadanie '{name}' zakończone wyjątkiem: {e}")
+                    results[name] = False
+        return results
+
+    with ThreadPoolExecutor(max_workers=max(1, len(tasks)), thread_name_prefix="sync") as executor:
+        running = {}
+        while pending or running:
+            for name in ready():
+                del pending[name]
+                running[executor.submit(__run_with_connection, name, tasks[name][0])] = name
+
+            if not running:
+                if not pending:
+                    break
+                raise ValueError(f"Cykliczne zależności między zadaniami: {', '.join(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = bool(future.result())
+                except Exception as e:
+                    log.error(f"Zadanie '{name}' zakończone wyjątkiem: {e}")
+                    results[name] = False
+                log.debug(f"Zakończono zadanie '{name}' ({'sukces' if results[name] else 'błąd'}).")
+
+    return results
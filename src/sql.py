@@ -0,0 +1,159 @@
+import re
+import time
+import logging
+import threading
+from datetime import datetime
+import pyodbc
+import connections as con
+import logger as log
+
+__all__ = ["execute", "quote_identifier", "table", "to_datetime", "get_query_stats", "get_plan_cache_stats", "log_query_stats"]
+
+# Znacznik dodawany na początku każdego zapytania: /* ERPFlow:<nazwa> */
+QUERY_TAG = "ERPFlow"
+__tag_pattern = re.compile(r"/\* " + QUERY_TAG + r":([\w.\-]+) \*/")
+__name_pattern = re.compile(r"^[\w.\-]+$")
+
+__identifiers = {}
+def quote_identifier(name: str) -> str:
+    """
+    Sprawdza i zwraca identyfikator SQL (nazwę bazy, schematu, tabeli, kolumny) w nawiasach kwadratowych.
+    Wynik jest zapamiętywany, więc każdy identyfikator jest sprawdzany tylko raz.
+
+    Raises:
+        ValueError: Jeżeli nazwa jest pusta, dłuższa niż 128 znaków lub zawiera znaki sterujące.
+    """
+    quoted = __identifiers.get(name)
+    if quoted is None:
+        if not isinstance(name, str) or not name or len(name) > 128 or any(ord(char) < 32 for char in name):
+            raise ValueError(f"Nieprawidłowy identyfikator SQL: {name!r}")
+        quoted = "[" + name.replace("]", "]]") + "]"
+        __identifiers[name] = quoted
+    return quoted
+
+def table(database_name: str | None, schema: str, table_name: str) -> str:
+    """
+    Zwraca pełną, bezpieczną nazwę tabeli, np. [Firma].[CDN].[Towary] (bez bazy, jeżeli `database_name` jest pusta).
+    """
+    parts = [database_name] if database_name else []
+    return ".".join(quote_identifier(part) for part in parts + [schema, table_name])
+
+def to_datetime(value: str | datetime | None) -> datetime | None:
+    """
+    Zamienia znacznik czasu zapisany jako tekst (np. '2024-01-01 12:00:00') na datetime,
+    tak by był przekazywany do zapytań jako parametr typu datetime2, a nie tekst.
+    """
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).strip())
+
+__stats = {}
+__stats_lock = threading.Lock()
+def __record(name: str, seconds: float, failed: bool):
+    with __stats_lock:
+        stats = __stats.setdefault(name, {"executions": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        stats["executions"] += 1
+        stats["errors"] += int(failed)
+        stats["total_seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+def execute(name: str, query: str, params: tuple | list = (), cursor=None):
+    """
+    Wykonuje zapytanie z parametrami i zlicza jego wykonania.
+
+    Tekst zapytania jest poprzedzony znacznikiem /* ERPFlow:<name> */, dzięki któremu można je znaleźć
+    w cache planów SQL Servera (patrz `get_plan_cache_stats`). Zapytanie nie powinno zawierać wartości
+    zmieniających się między uruchomieniami - znaczniki czasu, wersje i ID przekazujemy jako parametry (?),
+    a identyfikatory przez `quote_identifier`, dzięki czemu tekst zapytania jest stały i plan jest używany ponownie.
+    Parametry tekstowe są deklarowane jako NVARCHAR(MAX), bo deklaracja parametru (np. NVARCHAR(37)) jest częścią
+    klucza cache planów, a długość np. listy ID w JSON zmienia się przy każdym wywołaniu.
+
+    Args:
+        name (str): Nazwa zapytania, np. 'products.incremental'.
+        query (str): Zapytanie SQL z parametrami `?`.
+        params (tuple | list): Wartości parametrów.
+        cursor (pyodbc.Cursor, optional): Kursor, domyślnie `connections.cursor`.
+
+    Returns:
+        pyodbc.Cursor: Kursor z wynikami zapytania.
+    """
+    if not __name_pattern.match(name):
+        raise ValueError(f"Nieprawidłowa nazwa zapytania: {name!r}")
+    cursor = cursor if cursor is not None else con.cursor
+    params = tuple(params or ())
+    text_params = any(isinstance(param, str) for param in params)
+    if text_params:
+        cursor.setinputsizes([(pyodbc.SQL_WVARCHAR, 0, 0) if isinstance(param, str) else None for param in params])
+
+    started = time.perf_counter()
+    failed = True
+    try:
+        if params:
+            cursor.execute(f"/* {QUERY_TAG}:{name} */ {query}", params)
+        else:
+            cursor.execute(f"/* {QUERY_TAG}:{name} */ {query}")
+        failed = False
+        return cursor
+    finally:
+        __record(name, time.perf_counter() - started, failed)
+        if text_params:
+            cursor.setinputsizes(None)
+
+def get_query_stats() -> dict[str, dict]:
+    """
+    Zwraca liczniki zapytań wykonanych przez `execute`:
+    {nazwa: {'executions', 'errors', 'total_seconds', 'max_seconds'}}.
+    """
+    with __stats_lock:
+        return {name: dict(stats) for name, stats in __stats.items()}
+
+def get_plan_cache_stats() -> dict[str, dict] | None:
+    """
+    Odczytuje z cache planów SQL Servera (sys.dm_exec_query_stats) statystyki zapytań oznaczonych przez `execute`:
+    {nazwa: {'plans': liczba planów w cache, 'compilations': liczba kompilacji (z rekompilacjami),
+    'executions': liczba wykonań planów}}. Jeden plan z wieloma wykonaniami oznacza, że plan jest używany ponownie.
+
+    Wymaga uprawnienia VIEW SERVER STATE. Zwraca None, jeżeli nie można odczytać statystyk.
+    """
+    try:
+        cursor = con.cursor
+        # Wzorzec jest parametrem, więc to zapytanie nie znajduje samego siebie
+        cursor.execute('''
+            SELECT st.text, qs.plan_handle, qs.plan_generation_num, qs.execution_count
+            FROM sys.dm_exec_query_stats qs
+            CROSS APPLY sys.dm_exec_sql_text(qs.sql_handle) st
+            WHERE st.text LIKE ?
+        ''', (f"%/* {QUERY_TAG}:%",))
+        rows = cursor.fetchall()
+    except pyodbc.Error as e:
+        log.debug(f"Nie udało się odczytać statystyk cache planów (wymagane VIEW SERVER STATE): {e}")
+        return None
+
+    stats = {}
+    plans = {}
+    for text, plan_handle, plan_generation, executions in rows:
+        match = __tag_pattern.search(text or "")
+        if not match:
+            continue
+        name = match.group(1)
+        entry = stats.setdefault(name, {"plans": 0, "compilations": 0, "executions": 0})
+        if plan_handle not in plans.setdefault(name, set()):
+            plans[name].add(plan_handle)
+            entry["plans"] += 1
+            entry["compilations"] += plan_generation or 1
+        entry["executions"] += executions or 0
+    return stats
+
+def log_query_stats():
+    """
+    Loguje (na poziomie DEBUG) liczniki zapytań oraz, jeżeli są dostępne, statystyki cache planów.
+    """
+    if not log.log.isEnabledFor(logging.DEBUG):
+        return
+    plan_stats = get_plan_cache_stats() or {}
+    for name, stats in sorted(get_query_stats().items()):
+        message = f"Zapytanie {name}: wykonań {stats['executions']}, błędów {stats['errors']}, czas {stats['total_seconds']:.3f} s (maks. {stats['max_seconds']:.3f} s)"
+        if name in plan_stats:
+            plan = plan_stats[name]
+            message += f"; cache planów: planów {plan['plans']}, kompilacji {plan['compilations']}, wykonań {plan['executions']}"
+        log.debug(message)
@@ -1,17 +1,32 @@
-import time
 import logger as log
 import connections as con
-from requests.exceptions import HTTPError
+import batch_dispatcher
+import wp_client as wp
 
-def batch_sync_products(creations: list[dict] = None, updates: list[dict] = None, deletions: list[int] = None) -> tuple[bool, list[dict], list[dict], list[dict]]:
+def __post_batch(endpoint: str, batch: dict) -> dict:
+    """
+    Wysyła jedną partię do endpointu batch WooCommerce.
+    Odpowiedź HTTP 413 (np. przekroczony `post_max_size` w PHP) jest zgłaszana jako `BatchTooLargeError`,
+    dzięki czemu dispatcher może podzielić partię i wysłać ją ponownie.
+    """
+    # Partie bez tworzenia można bezpiecznie ponowić (patrz `http_client.ApiClient.request`)
+    response = con.wcapi.post(endpoint, batch, idempotent="create" not in batch)
+    if response.status_code == 413:
+        raise batch_dispatcher.BatchTooLargeError(f"{endpoint}: HTTP 413")
+    return response.json()
+
+def batch_sync_products(creations: list[dict] = None, updates: list[dict] = None, deletions: list[int] = None, on_batch=None) -> tuple[bool, list[dict], list[dict], list[dict]]:
     """
     Wysyła batchowe żądania do WooCommerce API dla tworzenia, aktualizacji i usuwania produktów.
     Wszystkie trzy operacje mogą być wykonane w jednym żądaniu batch.
+    Partie są wysyłane równolegle przez `batch_dispatcher` z limitem żądań dla 'products/batch'.
+    Wielkość partii (liczba elementów i bajtów) dopasowuje się do czasu odpowiedzi serwera.
     
     Args:
         creations: Lista słowników z danymi produktów do utworzenia.
         updates: Lista słowników z danymi produktów do zaktualizowania (musi zawierać 'id').
         deletions: Lista ID produktów WooCommerce do usunięcia.
+        on_batch: Funkcja wywoływana po każdej partii (patrz `batch_dispatcher.batch_sync`).
     
     Returns:
         Tuple (success, created_items, updated_items, deleted_items) gdzie:
@@ -20,120 +35,44 @@ def batch_sync_products(creations: list[dict] = None, updates: list[dict] = None
         - updated_items: Lista zaktualizowanych produktów z odpowiedzi API
         - deleted_items: Lista usuniętych produktów z odpowiedzi API
     """
-    creations = creations or []
-    updates = updates or []
-    deletions = deletions or []
-    
-    if not creations and not updates and not deletions:
-        log.debug("Brak danych do synchronizacji z WooCommerce.")
-        return True, [], [], []
-    
-    batch_size = 100  # WooCommerce ma limit 100 produktów na żądanie
-    status = True
-    all_created = []
-    all_updated = []
-    all_deleted = []
-    
-    total_operations = len(creations) + len(updates) + len(deletions)
-    log.debug(f"Rozpoczynanie operacji w WooCommerce: {len(creations)} utworzeń, {len(updates)} aktualizacji, {len(deletions)} usunięć.")
+    return batch_dispatcher.batch_sync(
+        endpoint="products/batch",
+        send_func=lambda batch: __post_batch("products/batch", batch),
+        creations=creations,
+        updates=updates,
+        deletions=deletions,
+        names=("produkt", "produktu", "produktów"),
+        target="WooCommerce",
+        sizer=batch_dispatcher.get_batch_sizer("products/batch"),
+        on_batch=on_batch
+    )
+
+
+def batch_sync_customers(creations: list[dict] = None, updates: list[dict] = None, deletions: list[int] = None, on_batch=None) -> tuple[bool, list[dict], list[dict], list[dict]]:
+    """
+    Wysyła batchowe żądania do WooCommerce API (customers/batch) dla tworzenia, aktualizacji i usuwania klientów.
+    Do 100 klientów w jednym żądaniu, zamiast jednego żądania na użytkownika jak w `wp_client.batch_sync_users`.
     
-    # Indeksy do śledzenia progressu w każdej liście
-    create_idx = 0
-    update_idx = 0
-    delete_idx = 0
+    Args:
+        creations: Lista słowników z danymi klientów do utworzenia (muszą zawierać 'username' i 'email').
+        updates: Lista słowników z danymi klientów do zaktualizowania (musi zawierać 'id').
+        deletions: Lista ID klientów (użytkowników WordPress) do usunięcia.
+        on_batch: Funkcja wywoływana po każdej partii (patrz `batch_dispatcher.batch_sync`).
     
-    while create_idx < len(creations) or update_idx < len(updates) or delete_idx < len(deletions):
-        # Budujemy batch
-        data = {}
-        batch_created_count = 0
-        batch_updated_count = 0
-        batch_deleted_count = 0
-        
-        # Dodajemy tworzenia
-        if create_idx < len(creations):
-            remaining = batch_size - (batch_created_count + batch_updated_count + batch_deleted_count)
-            batch = creations[create_idx:create_idx + remaining]
-            if batch:
-                data["create"] = batch
-                batch_created_count = len(batch)
-        
-        # Dodajemy aktualizacje
-        if update_idx < len(updates):
-            remaining = batch_size - (batch_created_count + batch_updated_count + batch_deleted_count)
-            batch = updates[update_idx:update_idx + remaining]
-            if batch:
-                data["update"] = batch
-                batch_updated_count = len(batch)
-        
-        # Dodajemy usunięcia
-        if delete_idx < len(deletions):
-            remaining = batch_size - (batch_created_count + batch_updated_count + batch_deleted_count)
-            batch = deletions[delete_idx:delete_idx + remaining]
-            if batch:
-                data["delete"] = batch
-                batch_deleted_count = len(batch)
-        
-        if not data:
-            break
-        
-        try:
-            response = con.wcapi.post("products/batch", data).json()
-            
-            # Przetwarzamy utworzone produkty
-            created = response.get("create", [])
-            for item in created:
-                if item.get("error"):
-                    log.error(f"Błąd podczas tworzenia produktu (ID: {item.get('id', 'N/A')}): {item.get('error')}")
-                    status = False
-                else:
-                    log.info(f"Utworzono produkt '{item.get('name', 'N/A')}' w WooCommerce (ID: {item.get('id')}).")
-            all_created.extend(created)
-            create_idx += batch_created_count
-            
-            # Przetwarzamy zaktualizowane produkty
-            updated = response.get("update", [])
-            for item in updated:
-                if item.get("error"):
-                    log.error(f"Błąd podczas aktualizacji produktu (ID: {item.get('id', 'N/A')}): {item.get('error')}")
-                    status = False
-                else:
-                    log.info(f"Zaktualizowano produkt '{item.get('name', 'N/A')}' w WooCommerce (ID: {item.get('id')}).")
-            all_updated.extend(updated)
-            update_idx += batch_updated_count
-            
-            # Przetwarzamy usunięte produkty
-            deleted = response.get("delete", [])
-            for item in deleted:
-                if item.get("error"):
-                    log.error(f"Błąd podczas usuwania produktu (ID: {item.get('id', 'N/A')}): {item.get('error')}")
-                    status = False
-                else:
-                    log.info(f"Usunięto produkt z WooCommerce (ID: {item.get('id')}).")
-            all_deleted.extend(deleted)
-            delete_idx += batch_deleted_count
-            
-            time.sleep(1)  # Krótkie opóźnienie między partiami aby uniknąć limitów API
-            
-        except HTTPError as http_err:
-            log.error(f"Błąd HTTP podczas batchowej synchronizacji produktów: {http_err}")
-            status = False
-            break
-        except Exception as e:
-            log.error(f"Błąd podczas batchowej synchronizacji produktów: {e}")
-            status = False
-            break
-
-    # Wyświetlamy podsumowanie
-    successful_created_count = len([i for i in all_created if not i.get("error")])
-    successful_updated_count = len([i for i in all_updated if not i.get("error")])
-    successful_deleted_count = len([i for i in all_deleted if not i.get("error")])
-    stats = []
-    if creations:
-        stats.append(f"{successful_created_count}/{len(creations)} utworzonych")
-    if updates:
-        stats.append(f"{successful_updated_count}/{len(updates)} zaktualizowanych")
-    if deletions:
-        stats.append(f"{successful_deleted_count}/{len(deletions)} usuniętych")
-    log.debug("Zakończono synchornizacje: " + ", ".join(stats) + " produktów.")
+    Returns:
+        Tuple (success, created_items, updated_items, deleted_items)
+    """
+    # Tak jak w wp_client.create_user - nowi klienci dostają losowe hasło (w kopii danych wywołującego)
+    creations = [data if 'password' in data else {**data, 'password': wp.generate_random_password()} for data in creations or []]
 
-    return status, all_created, all_updated, all_deleted
\ No newline at end of file
+    return batch_dispatcher.batch_sync(
+        endpoint="customers/batch",
+        send_func=lambda batch: __post_batch("customers/batch", batch),
+        creations=creations,
+        updates=updates,
+        deletions=deletions,
+        names=("klienta", "klienta", "klientów"),
+        target="WooCommerce",
+        label_key="username",
+        on_batch=on_batch
+    )
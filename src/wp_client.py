@@ -1,7 +1,13 @@
+import os
 import connections as con
 import logger as log
+import batch_dispatcher
+import metrics
 import secrets
 import string
+from collections import deque
+from itertools import islice
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 def generate_random_password(length=12):
     """Generuje losowe hasło."""
@@ -28,7 +34,7 @@ def create_user(data):
 def update_user(user_id, data):
     """Aktualizuje istniejącego użytkownika WordPress."""
     try:
-        response = con.wpapi.post(f"users/{user_id}", data)
+        response = con.wpapi.post(f"users/{user_id}", data, idempotent=True)
         if response.status_code == 200:
             return response.json()
         else:
@@ -45,51 +51,112 @@ def delete_user(user_id, reassign=0):
             
         response = con.wpapi.delete(f"users/{user_id}", params=params)
         if response.status_code == 200:
-            return response.json()
+            return {"id": user_id, **response.json()}
+        elif response.status_code == 404:
+            # Użytkownik już nie istnieje - zwracamy błąd w formacie WP, by wywołujący mógł go rozpoznać
+            log.warning(f"Użytkownik {user_id} nie istnieje w WordPress.")
+            return {"id": user_id, "error": {"code": "rest_user_invalid_id", "data": {"status": 404}}}
         else:
             log.error(f"Błąd usuwania użytkownika {user_id}: {response.status_code} - {response.text}")
-            return {"error": response.text}
+            return {"id": user_id, "error": response.text}
     except Exception as e:
         log.error(f"Wyjątek podczas usuwania użytkownika {user_id}: {e}")
-        return {"error": str(e)}
+        return {"id": user_id, "error": str(e)}
+
+def get_workers() -> int:
+    """
+    Zwraca liczbę równoległych żądań do wp/v2/users (zmienna środowiskowa `wp_users_workers`,
+    domyślnie tak jak `api_workers`).
+    """
+    return max(1, int(os.getenv("wp_users_workers") or batch_dispatcher.get_workers()))
 
-def batch_sync_users(creations=None, updates=None, deletions=None):
+def __map_bounded(executor, func, items, window: int):
+    """
+    Jak `executor.map`, ale w puli jest najwyżej `window` niezwróconych zadań - kolejne są zlecane
+    dopiero po zakończeniu poprzednich, zamiast wszystkich naraz. Wyniki w kolejności `items`.
+    """
+    items = iter(items)
+    pending = deque()
+    while True:
+        pending.extend(executor.submit(func, item) for item in islice(items, window - len(pending)))
+        if not pending:
+            return
+        while pending and pending[0].done():
+            yield pending.popleft().result()
+        if pending and not pending[0].done():
+            wait([future for future in pending if not future.done()], return_when=FIRST_COMPLETED)
+
+def batch_sync_users(creations=None, updates=None, deletions=None, workers=None, on_batch=None):
     """
     Symuluje batchową synchronizację użytkowników (WP API nie wspiera natywnego batcha dla users).
+    Żądania są wykonywane równolegle przez pulę `workers` wątków, z limitem żądań dla endpointu 'users'
+    (zmienna środowiskowa `api_rate_limit_users`). Kolejność wyników odpowiada kolejności danych wejściowych.
+    Jednocześnie zlecanych jest najwyżej `workers * 2` żądań, więc pamięć nie rośnie z liczbą użytkowników.
+    `on_batch(created, updated, deleted)` jest wywoływane w wątku wywołującym co `batch_dispatcher.DEFAULT_BATCH_SIZE`
+    wyników, tak jak po partii w `batch_dispatcher.batch_sync`.
     """
     creations = creations or []
     updates = updates or []
     deletions = deletions or []
+    workers = workers or get_workers()
+    limiter = batch_dispatcher.get_rate_limiter("users")
     
     created_items = []
     updated_items = []
     deleted_items = []
     success = True
-    
-    # Tworzenie
-    for data in creations:
-        result = create_user(data)
-        if "error" in result:
-            success = False
-            result["sku"] = data.get("username") # Zachowujemy identyfikator dla logowania błędów
-        created_items.append(result)
-        
-    # Aktualizacja
+
+    # Wyniki, które nie zostały jeszcze przekazane do on_batch: (utworzone, zaktualizowane, usunięte)
+    pending = ([], [], [])
+    def flush():
+        if on_batch and any(pending):
+            on_batch(*(list(results) for results in pending))
+        for results in pending:
+            results.clear()
+
+    def collect(index, result):
+        pending[index].append(result)
+        if sum(len(results) for results in pending) >= batch_dispatcher.DEFAULT_BATCH_SIZE:
+            flush()
+
+    def limited(func):
+        def call(*args):
+            limiter.acquire()
+            with metrics.timer("erpflow_api_batch_seconds", endpoint="users"):
+                return func(*args)
+        return call
+
+    # Aktualizacje bez ID nie są wysyłane
+    valid_updates = []
     for data in updates:
-        user_id = data.get("id")
-        if not user_id:
+        if not data.get("id"):
             log.error(f"Brak ID dla aktualizacji użytkownika: {data}")
             continue
-        result = update_user(user_id, data)
-        if "error" in result:
-            success = False
-        updated_items.append(result)
-        
-    # Usuwanie
-    for user_id in deletions:
-        result = delete_user(user_id)
-        if "error" in result:
-            success = False
-        deleted_items.append(result)
-        
+        valid_updates.append(data)
+
+    window = workers * 2
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="wp-users") as executor:
+        # Tworzenie
+        for data, result in zip(creations, __map_bounded(executor, limited(create_user), creations, window)):
+            if "error" in result:
+                success = False
+                result["sku"] = data.get("username") # Zachowujemy identyfikator dla logowania błędów
+            created_items.append(result)
+            collect(0, result)
+
+        # Aktualizacja
+        for result in __map_bounded(executor, limited(lambda data: update_user(data.get("id"), data)), valid_updates, window):
+            if "error" in result:
+                success = False
+            updated_items.append(result)
+            collect(1, result)
+
+        # Usuwanie
+        for result in __map_bounded(executor, limited(delete_user), deletions, window):
+            if "error" in result:
+                success = False
+            deleted_items.append(result)
+            collect(2, result)
+
+    flush()
     return success, created_items, updated_items, deleted_items
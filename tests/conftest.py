@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Moduły programu są płaskie w katalogu src (tak jak przy uruchamianiu `python src/main.py`)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
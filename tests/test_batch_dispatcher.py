@@ -0,0 +1,151 @@
+import time
+import pytest
+from requests.exceptions import Timeout
+import batch_dispatcher
+from batch_dispatcher import BatchSizer, BatchTooLargeError, TokenBucket, dispatch, iter_batches
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch):
+    monkeypatch.setattr(batch_dispatcher, "get_rate_limiter", lambda endpoint: TokenBucket(0))
+
+def test_iter_batches_fills_batches_in_operation_order():
+    batches = list(iter_batches([1, 2, 3], [4, 5], [6], BatchSizer(4)))
+
+    assert batches == [{"create": [1, 2, 3], "update": [4]}, {"update": [5], "delete": [6]}]
+
+def test_iter_batches_without_operations_yields_nothing():
+    assert list(iter_batches([], [], [], BatchSizer(4))) == []
+
+def test_dispatch_splits_batch_rejected_as_too_large():
+    sent = []
+    def send(batch):
+        sent.append(batch)
+        if len(batch.get("create", [])) > 2:
+            raise BatchTooLargeError("HTTP 413")
+        return {"create": batch["create"]}
+
+    results = list(dispatch([{"create": [1, 2, 3, 4]}], send, "test", workers=1))
+
+    assert [(batch, error) for batch, _, error in results] == [({"create": [1, 2]}, None), ({"create": [3, 4]}, None)]
+    assert sent[0] == {"create": [1, 2, 3, 4]}
+
+def test_dispatch_splits_update_batch_after_timeout():
+    def send(batch):
+        if len(batch["update"]) > 1:
+            raise Timeout("read timeout")
+        return batch
+
+    results = list(dispatch([{"update": [1, 2]}], send, "test", workers=1))
+
+    assert [response for _, response, _ in results] == [{"update": [1]}, {"update": [2]}]
+
+def test_dispatch_does_not_retry_creations_after_timeout():
+    calls = []
+    def send(batch):
+        calls.append(batch)
+        raise Timeout("read timeout")
+
+    [(batch, response, error)] = list(dispatch([{"create": [1, 2]}], send, "test", workers=1))
+
+    assert isinstance(error, Timeout) and response is None
+    assert calls == [{"create": [1, 2]}]
+
+def test_dispatch_stops_sending_after_error():
+    def send(batch):
+        raise ValueError("boom")
+
+    results = list(dispatch(({"delete": [n]} for n in range(10)), send, "test", workers=2))
+
+    assert len(results) <= 2
+    assert all(isinstance(error, ValueError) for _, _, error in results)
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=1)
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+
+    # Pierwszy token jest dostępny od razu, kolejne co 1/50 s
+    assert time.monotonic() - started >= 5 / 50 * 0.9
+
+def test_token_bucket_without_limit_does_not_block():
+    bucket = TokenBucket(0)
+    started = time.monotonic()
+    for _ in range(1000):
+        bucket.acquire()
+    assert time.monotonic() - started < 0.5
+
+@pytest.fixture
+def messages(monkeypatch):
+    """
+    Komunikaty logowane przez batch_dispatcher (wszystkie poziomy).
+    """
+    logged = []
+    for level in ("debug", "info", "warning", "error"):
+        monkeypatch.setattr(batch_dispatcher.log, level, lambda msg, **kwargs: logged.append(msg))
+    monkeypatch.setattr(batch_dispatcher.log, "is_debug_enabled", lambda: True)
+    return logged
+
+def test_batch_sync_logs_caller_target(messages):
+    success, created, _, _ = batch_dispatcher.batch_sync(
+        endpoint="prices/batch",
+        send_func=lambda batch: {"upsert": [{"id": 1, "name": "a"}]},
+        creations=[{"name": "a"}],
+        names=("zniżkę", "zniżki", "zniżek"),
+        target="ERPFlow",
+        response_keys=("upsert", "update", "delete"),
+    )
+
+    assert success and created == [{"id": 1, "name": "a"}]
+    assert any("w ERPFlow" in message for message in messages)
+    assert not any("WooCommerce" in message for message in messages)
+
+def test_iter_batches_respects_byte_limit():
+    items = [{"name": "x" * 40} for _ in range(5)]
+    size = batch_dispatcher.estimate_size(items[0])
+
+    batches = list(iter_batches(items, [], [], BatchSizer(100, max_bytes=size * 2)))
+
+    assert [len(batch["create"]) for batch in batches] == [2, 2, 1]
+
+def test_iter_batches_sends_oversized_item_alone():
+    items = [{"name": "x" * 500}, {"name": "y"}]
+
+    batches = list(iter_batches(items, [], [], BatchSizer(100, max_bytes=100)))
+
+    assert batches == [{"create": [items[0]]}, {"create": [items[1]]}]
+
+def test_adaptive_sizer_halves_on_overload_and_grows_when_fast():
+    sizer = batch_dispatcher.AdaptiveBatchSizer(max_items=100, max_bytes=1_000_000, target_latency=10)
+
+    sizer.record(30, overloaded=True)
+    assert sizer.limits() == (50, 500_000)
+
+    sizer.record(1)
+    assert sizer.limits() == (62, 625_000)
+
+    sizer.record(7)  # Pomiędzy połową a docelowym czasem - bez zmian
+    assert sizer.limits() == (62, 625_000)
+
+def test_adaptive_sizer_stays_within_bounds():
+    sizer = batch_dispatcher.AdaptiveBatchSizer(max_items=4, max_bytes=100_000, target_latency=10)
+    for _ in range(10):
+        sizer.record(0.1)
+    assert sizer.limits() == (4, 100_000)
+
+    for _ in range(20):
+        sizer.record(100, overloaded=True)
+    assert sizer.limits() == (1, 64_000)
+
+def test_dispatch_keeps_batch_order_when_batch_is_split():
+    def send(batch):
+        if batch == {"update": [1, 2]}:
+            # Zbyt duża partia wraca po tym, jak kolejne partie zostały już wysłane
+            time.sleep(0.05)
+            raise BatchTooLargeError("HTTP 413")
+        return batch
+
+    batches = [{"update": [1, 2]}, {"update": [3]}, {"update": [4]}]
+    results = list(dispatch(batches, send, "test", workers=3))
+
+    assert [response for _, response, _ in results] == [{"update": [1]}, {"update": [2]}, {"update": [3]}, {"update": [4]}]
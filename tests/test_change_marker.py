@@ -0,0 +1,19 @@
+import comarch_client as db
+import connections as con
+
+class FakeCursor:
+    def fetchone(self):
+        return (10, "2026-01-01 08:00:00")
+
+def test_temporal_marker_reads_primary_key_and_history_only(monkeypatch):
+    queries = []
+    monkeypatch.setattr(db, "change_backend", db.TEMPORAL)
+    monkeypatch.setattr(db.sql, "execute", lambda name, query, params=(), cursor=None: queries.append(query))
+    monkeypatch.setitem(vars(con), "cursor", FakeCursor())
+
+    assert db.get_change_marker(["Towary"]) == (10, "2026-01-01 08:00:00")
+
+    [query] = queries
+    assert "MAX(Twr_TwrId)" in query
+    assert "MAX(ValidTo)" in query and "TowaryHistory" in query
+    assert "ValidFrom" not in query
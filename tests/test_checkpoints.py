@@ -0,0 +1,118 @@
+import json
+from types import SimpleNamespace
+import pytest
+import checkpoints
+import comarch_client as db
+
+@pytest.fixture
+def state(monkeypatch, tmp_path):
+    """
+    Pusty stan synchronizacji w pliku tymczasowym i dostępna tabela punktów kontrolnych.
+    """
+    monkeypatch.setattr(db, "SYNC_STATE_FILE", str(tmp_path / "sync_state.json"))
+    monkeypatch.setattr(db, "sync_state", {})
+    monkeypatch.setattr(db, "sync_start_timestamp", "2026-01-02 10:00:00")
+    monkeypatch.setattr(db, "sync_start_version", None)
+    monkeypatch.setattr(checkpoints, "is_available", lambda: True)
+    cleared = []
+    monkeypatch.setattr(checkpoints, "clear", lambda run_start=None: cleared.append(run_start))
+    return cleared
+
+def test_new_run_is_recorded_as_pending(state):
+    db.begin_sync_run(max_attempts=3)
+
+    assert db.checkpoint_run == "2026-01-02 10:00:00"
+    assert db.sync_state["pending_run"]["sync_start_timestamp"] == "2026-01-02 10:00:00"
+
+def test_interrupted_run_is_resumed_with_its_start_time(state):
+    db.sync_state["pending_run"] = {"sync_start_timestamp": "2026-01-01 08:00:00", "sync_start_version": None}
+
+    db.begin_sync_run(max_attempts=3)
+
+    assert db.sync_start_timestamp == "2026-01-01 08:00:00"
+    assert db.checkpoint_run == "2026-01-01 08:00:00"
+    assert db.sync_state["pending_run"]["attempts"] == 1
+
+def test_fresh_run_after_max_attempts(state):
+    db.sync_state["pending_run"] = {"sync_start_timestamp": "2026-01-01 08:00:00", "sync_start_version": None, "attempts": 3}
+
+    db.begin_sync_run(max_attempts=3)
+
+    assert db.sync_start_timestamp == "2026-01-02 10:00:00"
+    assert db.sync_state["pending_run"] == {"sync_start_timestamp": "2026-01-02 10:00:00", "sync_start_version": None}
+    assert state == ["2026-01-01 08:00:00"]
+
+def test_no_resume_without_checkpoint_table(state, monkeypatch):
+    monkeypatch.setattr(checkpoints, "is_available", lambda: False)
+    db.sync_state["pending_run"] = {"sync_start_timestamp": "2026-01-01 08:00:00", "sync_start_version": None}
+
+    db.begin_sync_run(max_attempts=3)
+
+    assert db.sync_start_timestamp == "2026-01-02 10:00:00"
+    assert db.checkpoint_run is None
+    assert "pending_run" not in db.sync_state
+
+def test_finish_clears_pending_run_and_checkpoints(state):
+    db.begin_sync_run()
+    db.finish_sync_run()
+
+    assert "pending_run" not in db.sync_state
+    assert state == ["2026-01-02 10:00:00"]
+    assert db.checkpoint_run is None
+
+@pytest.fixture
+def executed(monkeypatch):
+    """
+    Zapytania wykonane przez moduł checkpoints: [(nazwa, zapytanie, parametry)].
+    """
+    monkeypatch.setitem(vars(checkpoints), "__available", True)
+    queries = []
+    monkeypatch.setattr(checkpoints.sql, "execute", lambda name, query, params=(), cursor=None: queries.append((name, query, params)))
+    return queries
+
+def test_acknowledge_sends_ids_as_one_json_parameter(executed):
+    checkpoints.acknowledge("2026-01-01 08:00:00", "produkty", [3, 1, 2])
+
+    [(name, _, params)] = executed
+    assert name == "checkpoints.acknowledge"
+    assert json.loads(params[2]) == [3, 1, 2]
+    assert params[1] == "produkty" and params[4] == "produkty"
+
+def test_acknowledge_without_ids_does_nothing(executed):
+    checkpoints.acknowledge("2026-01-01 08:00:00", "produkty", [])
+    assert executed == []
+
+def test_clear_removes_run_and_older(executed):
+    checkpoints.clear("2026-01-01 08:00:00")
+    checkpoints.clear()
+
+    assert [name for name, _, _ in executed] == ["checkpoints.clear", "checkpoints.clear_all"]
+    assert "RunStart <= ?" in executed[0][1]
+
+def test_watermark_move_ends_pending_run(state):
+    db.begin_sync_run()
+    db.update_sync_watermark()
+
+    assert "pending_run" not in db.sync_state
+    assert db.sync_state["last_sync_timestamp"] == "2026-01-02 10:00:00"
+    assert state == ["2026-01-02 10:00:00"]
+
+def test_failed_exclusive_run_is_not_resumed_with_empty_window(state, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "args", SimpleNamespace(only_products=True, only_contractors=False, only_discounts=False, sequential=True, daemon=False), raising=False)
+    monkeypatch.setattr(main, "record_sync_lag", lambda: None)
+    monkeypatch.setattr(main.scheduler, "run_tasks", lambda tasks, parallel: {"towary": False})
+    for module, name in ((main.sql, "log_query_stats"), (main.http_client, "log_retry_stats"), (main.metrics, "write"), (main.profiler, "write_report")):
+        monkeypatch.setattr(module, name, lambda *args, **kwargs: None)
+
+    # Uruchomienie --tylko-towary z błędami przesuwa znacznik czasu (jak dotychczas)
+    assert not main.sync_all()
+    assert db.sync_state["last_sync_timestamp"] == "2026-01-02 10:00:00"
+
+    # Kolejne uruchomienie zaczyna od nowa: okno [znacznik, nowy czas rozpoczęcia], a nie [T, T]
+    monkeypatch.setattr(db, "sync_start_timestamp", "2026-01-02 11:00:00")
+    db.begin_sync_run(max_attempts=3)
+
+    assert db.sync_start_timestamp == "2026-01-02 11:00:00"
+    assert db.sync_state["pending_run"] == {"sync_start_timestamp": "2026-01-02 11:00:00", "sync_start_version": None}
+    assert db.sync_state["last_sync_timestamp"] < db.sync_start_timestamp
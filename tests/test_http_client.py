@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+import pytest
+import requests
+import http_client
+from http_client import backoff_delay, is_gzip_allowed, parse_retry_after
+
+def response_with(retry_after=None):
+    response = requests.Response()
+    if retry_after is not None:
+        response.headers["Retry-After"] = retry_after
+    return response
+
+@pytest.mark.parametrize("value, expected", [("120", 120.0), ("1.5", 1.5), ("-3", 0.0), (None, None), ("", None), ("wkrótce", None)])
+def test_parse_retry_after_seconds(value, expected):
+    assert parse_retry_after(response_with(value)) == expected
+
+def test_parse_retry_after_http_date():
+    value = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+
+    assert 55 <= parse_retry_after(response_with(value)) <= 60
+
+def test_parse_retry_after_past_date_is_zero():
+    value = format_datetime(datetime.now(timezone.utc) - timedelta(hours=1), usegmt=True)
+
+    assert parse_retry_after(response_with(value)) == 0.0
+
+def test_backoff_delay_grows_exponentially_up_to_limit(monkeypatch):
+    # Górna granica losowania: jitter od 0 do min(max_delay, base_delay * 2^attempt)
+    monkeypatch.setattr("http_client.random.uniform", lambda low, high: high)
+
+    assert [backoff_delay(attempt, 0.5, 5) for attempt in range(6)] == [0.5, 1, 2, 4, 5, 5]
+
+def test_backoff_delay_is_within_bounds():
+    delays = [backoff_delay(3, 1, 30) for _ in range(200)]
+
+    assert all(0 <= delay <= 8 for delay in delays)
+    assert len(set(delays)) > 1
+
+def test_request_gzip_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("http_gzip_requests", raising=False)
+
+    assert not is_gzip_allowed("sklep.example.com")
+
+def test_request_gzip_opt_in_until_host_rejects_it(monkeypatch):
+    monkeypatch.setenv("http_gzip_requests", "1")
+    monkeypatch.setattr(http_client, "gzip_rejected_hosts", {"stary.example.com"})
+
+    assert is_gzip_allowed("sklep.example.com")
+    assert not is_gzip_allowed("stary.example.com")
@@ -0,0 +1,96 @@
+import pyodbc
+import pytest
+import comarch_client as db
+import connections as con
+
+class FakeCursor:
+    def __init__(self, actions):
+        self.actions = actions
+        self.queries = []
+        self.rows = None
+        self.closed = False
+
+    def execute(self, query, params=()):
+        self.queries.append(query)
+
+    def executemany(self, query, rows):
+        self.rows = list(rows)
+
+    def fetchall(self):
+        return [(action,) for action in self.actions]
+
+    def setinputsizes(self, sizes):
+        pass
+
+    def close(self):
+        self.closed = True
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self.fake_cursor = cursor
+        self.autocommit = True
+        self.committed = False
+        self.rolled_back = False
+
+    def cursor(self):
+        return self.fake_cursor
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+@pytest.fixture
+def connection(monkeypatch):
+    def make(actions=(), with_hash=False):
+        conn = FakeConnection(FakeCursor(list(actions)))
+        monkeypatch.setitem(vars(con), "conn", conn)
+        monkeypatch.setattr(db, "has_payload_hash_column", lambda table: with_hash)
+        return conn
+    return make
+
+def test_duplicates_are_merged_last_pair_wins(connection):
+    conn = connection(actions=["INSERT", "UPDATE"])
+
+    result = db.save_id_mappings("TowarIDs", "Twr_TwrId", "WC_ID", [(1, 100), (2, 200), (1, 101), (3, 200)])
+
+    assert result == (1, 1)
+    # DbId 1 -> ostatnie ApiId 101; ApiId 200 -> ostatni rekord 3
+    assert sorted(conn.fake_cursor.rows) == [(1, 101), (3, 200)]
+    assert conn.committed and conn.autocommit and conn.fake_cursor.closed
+
+def test_reassigned_api_id_removes_old_mapping_before_merge(connection):
+    conn = connection(actions=["UPDATE"])
+
+    db.save_id_mappings("TowarIDs", "Twr_TwrId", "WC_ID", [(5, 100)])
+
+    queries = conn.fake_cursor.queries
+    unassign = next(i for i, query in enumerate(queries) if "mappings.TowarIDs.unassign" in query)
+    merge = next(i for i, query in enumerate(queries) if "mappings.TowarIDs.merge" in query)
+    assert unassign < merge
+    assert "target.WC_ID = source.ApiId AND target.Twr_TwrId <> source.DbId" in queries[unassign]
+
+def test_payload_hash_is_saved_when_column_exists(connection):
+    conn = connection(actions=["INSERT"], with_hash=True)
+
+    db.save_id_mappings("TowarIDs", "Twr_TwrId", "WC_ID", [(1, 100, b"hash")])
+
+    assert conn.fake_cursor.rows == [(1, 100, b"hash")]
+    assert any("PayloadHash = source.PayloadHash" in query for query in conn.fake_cursor.queries)
+
+def test_empty_mappings_do_not_touch_database(connection):
+    conn = connection()
+
+    assert db.save_id_mappings("TowarIDs", "Twr_TwrId", "WC_ID", []) == (0, 0)
+    assert conn.fake_cursor.queries == []
+
+def test_database_error_rolls_back(connection):
+    conn = connection()
+    def fail(query, params=()):
+        raise pyodbc.Error("deadlock")
+    conn.fake_cursor.execute = fail
+
+    with pytest.raises(pyodbc.Error):
+        db.save_id_mappings("TowarIDs", "Twr_TwrId", "WC_ID", [(1, 100)])
+    assert conn.rolled_back and not conn.committed and conn.autocommit
@@ -0,0 +1,56 @@
+from collections import namedtuple
+import pytest
+import comarch_client as db
+
+Row = namedtuple("Row", ["KnO_KnOId", "KnO_Nazwisko"])
+
+@pytest.fixture
+def prepare(monkeypatch):
+    """
+    `__prepare_records` z tabelą mapowań z kolumną hashy, bez odpytywania bazy.
+    """
+    monkeypatch.setattr(db, "has_payload_hash_column", lambda table: True)
+    return getattr(db, "__prepare_records")
+
+def contractor(row, last_sync, force):
+    return {"username": f"user{row.KnO_KnOId}", "first_name": row.KnO_Nazwisko, "email": f"{row.KnO_KnOId}@example.com"}
+
+def test_update_payload_has_no_read_only_fields(prepare):
+    records = [Row(1, "Jan"), Row(2, "Anna")]
+    to_create, to_update, item_map, status, _, _ = prepare("kontrahentów", records, contractor, "KnO_KnOId", "KontrahenciIDs", {1: 101}, {}, None, False)
+
+    assert status
+    assert to_update == [{"first_name": "Jan", "email": "1@example.com", "id": 101}]
+    assert to_create == [{"username": "user2", "first_name": "Anna", "email": "2@example.com"}]
+    assert item_map == {"user1": 1, "user2": 2}
+
+def test_existing_item_from_key_index_is_updated_without_username(prepare):
+    _, to_update, item_map, _, _, _ = prepare("kontrahentów", [Row(3, "Ewa")], contractor, "KnO_KnOId", "KontrahenciIDs", {}, {}, None, False, key_index={"user3": 303})
+
+    assert to_update == [{"first_name": "Ewa", "email": "3@example.com", "id": 303}]
+    assert item_map == {"user3": 3}
+
+def test_payload_hash_ignores_id_password_and_key_order():
+    data = {"first_name": "Jan", "email": "1@example.com"}
+
+    assert db.compute_payload_hash(data) == db.compute_payload_hash({"email": "1@example.com", "first_name": "Jan", "id": 101, "password": "x"})
+    assert db.compute_payload_hash(data) != db.compute_payload_hash({**data, "first_name": "Janusz"})
+
+def test_unchanged_update_is_skipped(prepare):
+    sent_hash = db.compute_payload_hash(contractor(Row(1, "Jan"), None, False))
+
+    _, to_update, _, status, new_hashes, skipped = prepare("kontrahentów", [Row(1, "Jan")], contractor, "KnO_KnOId", "KontrahenciIDs", {1: 101}, {1: sent_hash}, None, False)
+
+    assert status
+    assert to_update == [] and skipped == 1
+    assert new_hashes == {}
+
+def test_changed_or_forced_update_is_sent_with_new_hash(prepare):
+    old_hash = db.compute_payload_hash(contractor(Row(1, "Jan"), None, False))
+
+    _, changed, _, _, new_hashes, skipped = prepare("kontrahentów", [Row(1, "Janusz")], contractor, "KnO_KnOId", "KontrahenciIDs", {1: 101}, {1: old_hash}, None, False)
+    _, forced, _, _, _, _ = prepare("kontrahentów", [Row(1, "Jan")], contractor, "KnO_KnOId", "KontrahenciIDs", {1: 101}, {1: old_hash}, None, True)
+
+    assert [item["id"] for item in changed] == [101] and skipped == 0
+    assert new_hashes == {1: db.compute_payload_hash(contractor(Row(1, "Janusz"), None, False))}
+    assert [item["id"] for item in forced] == [101]
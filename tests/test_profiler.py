@@ -0,0 +1,50 @@
+import threading
+import tracemalloc
+import pytest
+import profiler
+
+@pytest.fixture
+def enabled(monkeypatch):
+    """
+    Włączone profilowanie z pustym raportem; tracemalloc jest zatrzymywany po teście.
+    """
+    monkeypatch.setitem(vars(profiler), "__enabled", True)
+    monkeypatch.setitem(vars(profiler), "__phases", {})
+    tracing = tracemalloc.is_tracing()
+    tracemalloc.start()
+    yield vars(profiler)["__phases"]
+    if not tracing:
+        tracemalloc.stop()
+
+def test_phases_in_two_threads_at_once(enabled, tmp_path):
+    worker_started = threading.Event()
+    main_done = threading.Event()
+    errors = []
+
+    def worker():
+        try:
+            with profiler.phase("products", "api"):
+                worker_started.set()
+                main_done.wait(5)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=worker)
+    with profiler.phase("products", "fetch"):
+        thread.start()
+        assert worker_started.wait(5)
+        # Etap wątku głównego i wątku roboczego są aktywne jednocześnie
+        with profiler.phase("products", "changes"):
+            sum(range(1000))
+    main_done.set()
+    thread.join()
+
+    assert errors == []
+    assert enabled[("products", "api")]["calls"] == 1
+    assert enabled[("products", "api")]["profiled_calls"] == 0
+    assert enabled[("products", "fetch")]["profiled_calls"] == 1
+
+    path = profiler.write_report(str(tmp_path))
+    content = open(path, encoding="utf-8").read()
+    assert "=== products / api ===\nEtap wykonywany poza wątkiem głównym" in content
+    assert "=== products / changes ===" in content
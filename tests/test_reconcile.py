@@ -0,0 +1,78 @@
+import json
+from types import SimpleNamespace
+import pytest
+import comarch_client as db
+import connections as con
+import reconcile
+
+class FakeCursor:
+    """
+    Kursor zwracający mapowania i rekordy bazy według znacznika zapytania.
+    """
+    def __init__(self, mappings, records):
+        self.results = {"mappings.TowarIDs.load": mappings, "products.full": records}
+        self.rows = []
+        self.queries = []
+
+    def setinputsizes(self, sizes):
+        pass
+
+    def execute(self, query, params=()):
+        self.queries.append((query, params))
+        self.rows = next((rows for tag, rows in self.results.items() if f"ERPFlow:{tag} " in query), [])
+
+    def fetchall(self):
+        return self.rows
+
+def product(row, last_sync, force):
+    return {"sku": str(row.Twr_TwrId), "name": row.Twr_Nazwa, "regular_price": "10"}
+
+@pytest.fixture
+def store(monkeypatch):
+    """
+    Baza z towarami 1, 2, 3 (mapowania: 1 -> 101, 3 -> 103 oraz 9 -> 109 usuniętego towaru) i sklep z wysłanymi operacjami.
+    """
+    records = [SimpleNamespace(Twr_TwrId=1, Twr_Nazwa="A"), SimpleNamespace(Twr_TwrId=2, Twr_Nazwa="B"), SimpleNamespace(Twr_TwrId=3, Twr_Nazwa="C")]
+    cursor = FakeCursor([(1, 101), (9, 109), (3, 103)], records)
+    monkeypatch.setitem(vars(con), "cursor", cursor)
+    monkeypatch.setattr(db, "has_payload_hash_column", lambda table: True)
+    saved = []
+    monkeypatch.setattr(db, "save_id_mappings", lambda table, db_column, api_column, mappings: saved.extend(mappings) or (len(mappings), 0))
+
+    items = [
+        {"id": 101, "sku": "1", "name": "A", "regular_price": "10.00"},
+        {"id": 109, "sku": "9", "name": "X"},
+        {"id": 103, "sku": "3", "name": "stara nazwa"},
+        {"id": 200, "sku": "dodany-recznie"},
+    ]
+    sent = {}
+    def batch(creations=None, updates=None, deletions=None):
+        sent.update(creations=creations, updates=updates, deletions=deletions)
+        return True, [{"id": 102, "sku": "2"}], [{"id": item["id"]} for item in updates], [{"id": api_id} for api_id in deletions]
+
+    def run():
+        return reconcile.run("produktów", "SELECT", (), "products.full", lambda: items, "sku", product, batch, "TowarIDs", "Twr_TwrId", "WC_ID")
+    return SimpleNamespace(run=run, sent=sent, saved=saved, cursor=cursor)
+
+def test_only_differences_are_sent(store):
+    assert store.run()
+
+    assert store.sent["creations"] == [{"sku": "2", "name": "B", "regular_price": "10"}]
+    assert store.sent["updates"] == [{"sku": "3", "name": "C", "regular_price": "10", "id": 103}]
+    # Element bez mapowania (dodany ręcznie) nie jest usuwany
+    assert store.sent["deletions"] == [109]
+
+def test_mappings_are_rebuilt_from_store(store):
+    store.run()
+
+    assert sorted((db_id, api_id) for db_id, api_id, _ in store.saved) == [(1, 101), (2, 102), (3, 103)]
+    [prune_params] = [params for query, params in store.cursor.queries if "mappings.TowarIDs.prune" in query]
+    assert sorted(json.loads(prune_params[0])) == [1, 2, 3]
+
+def test_nothing_is_sent_when_store_matches(store):
+    store.cursor.results["products.full"] = [SimpleNamespace(Twr_TwrId=1, Twr_Nazwa="A")]
+    store.cursor.results["mappings.TowarIDs.load"] = [(1, 101)]
+
+    assert store.run()
+    assert store.sent == {}
+    assert [(db_id, api_id) for db_id, api_id, _ in store.saved] == [(1, 101)]
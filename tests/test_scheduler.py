@@ -0,0 +1,42 @@
+import contextlib
+import pytest
+import scheduler
+
+@pytest.fixture(autouse=True)
+def no_thread_connections(monkeypatch):
+    monkeypatch.setattr(scheduler.con, "thread_connection", contextlib.nullcontext)
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_dependents_of_failed_task_are_skipped(parallel):
+    calls = []
+    def task(name, result):
+        def run():
+            calls.append(name)
+            return result
+        return run
+
+    results = scheduler.run_tasks({
+        "towary": (task("towary", False), []),
+        "kontrahenci": (task("kontrahenci", True), []),
+        "rabaty": (task("rabaty", True), ["towary"]),
+        "ceny": (task("ceny", True), ["rabaty"]),
+    }, parallel=parallel)
+
+    assert results == {"towary": False, "kontrahenci": True, "rabaty": False, "ceny": False}
+    assert sorted(calls) == ["kontrahenci", "towary"]
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_dependents_run_after_successful_dependency(parallel):
+    calls = []
+    results = scheduler.run_tasks({
+        "rabaty": (lambda: calls.append("rabaty") or True, ["towary"]),
+        "towary": (lambda: calls.append("towary") or True, []),
+    }, parallel=parallel)
+
+    assert results == {"towary": True, "rabaty": True}
+    assert calls == ["towary", "rabaty"]
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_cyclic_dependencies_raise(parallel):
+    with pytest.raises(ValueError):
+        scheduler.run_tasks({"a": (lambda: True, ["b"]), "b": (lambda: True, ["a"])}, parallel=parallel)
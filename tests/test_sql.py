@@ -0,0 +1,32 @@
+import pytest
+import sql
+
+@pytest.mark.parametrize("name, expected", [
+    ("Towary", "[Towary]"),
+    ("Firma Sp. z o.o.", "[Firma Sp. z o.o.]"),
+    ("dziwna]nazwa", "[dziwna]]nazwa]"),
+    ("x" * 128, "[" + "x" * 128 + "]"),
+])
+def test_quote_identifier(name, expected):
+    assert sql.quote_identifier(name) == expected
+
+@pytest.mark.parametrize("name", ["", "x" * 129, "Towary\n; DROP TABLE x", None, 1])
+def test_quote_identifier_rejects_invalid_names(name):
+    with pytest.raises(ValueError):
+        sql.quote_identifier(name)
+
+def test_table_with_and_without_database():
+    assert sql.table("Firma]1", "CDN", "Towary") == "[Firma]]1].[CDN].[Towary]"
+    assert sql.table(None, "ERPFlow", "TowarIDs") == "[ERPFlow].[TowarIDs]"
+
+def test_execute_tags_query_with_name():
+    class Cursor:
+        def execute(self, query, params=None):
+            self.query = query
+
+    cursor = Cursor()
+    sql.execute("products.full", "SELECT 1", cursor=cursor)
+
+    assert cursor.query == "/* ERPFlow:products.full */ SELECT 1"
+    with pytest.raises(ValueError):
+        sql.execute("products */ SELECT 2; --", "SELECT 1", cursor=cursor)
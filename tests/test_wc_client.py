@@ -0,0 +1,16 @@
+import batch_dispatcher
+import wc_client as wc
+
+def test_batch_sync_customers_adds_password_without_mutating_input(monkeypatch):
+    sent = {}
+    def batch_sync(**kwargs):
+        sent.update(kwargs)
+        return True, [], [], []
+    monkeypatch.setattr(batch_dispatcher, "batch_sync", batch_sync)
+
+    creations = [{"username": "jan", "email": "jan@example.com"}, {"username": "ewa", "password": "secret"}]
+    wc.batch_sync_customers(creations=creations)
+
+    assert creations[0] == {"username": "jan", "email": "jan@example.com"}
+    assert sent["creations"][0]["password"]
+    assert sent["creations"][1]["password"] == "secret"
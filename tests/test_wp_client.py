@@ -0,0 +1,50 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import connections as con
+import batch_dispatcher
+import wp_client as wp
+
+map_bounded = getattr(wp, "__map_bounded")
+
+class CountingExecutor(ThreadPoolExecutor):
+    """
+    Pula zliczająca zlecone zadania.
+    """
+    submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        return super().submit(*args, **kwargs)
+
+def test_map_bounded_keeps_order_and_window():
+    def work(n):
+        time.sleep(0.001 * (n % 3))
+        return n
+
+    with CountingExecutor(max_workers=2) as executor:
+        results = []
+        for result in map_bounded(executor, work, range(30), 4):
+            # Zlecone zadania, których wyniki nie zostały jeszcze zwrócone
+            assert executor.submitted - len(results) - 1 <= 4
+            results.append(result)
+
+    assert results == list(range(30))
+
+def test_batch_sync_users_returns_results_in_input_order(monkeypatch):
+    monkeypatch.setattr(batch_dispatcher, "get_rate_limiter", lambda endpoint: batch_dispatcher.TokenBucket(0))
+    monkeypatch.setattr(wp, "create_user", lambda data: {"error": "exists"} if data["username"] == "u3" else {"id": int(data["username"][1:])})
+
+    creations = [{"username": f"u{n}"} for n in range(10)]
+    success, created, _, _ = wp.batch_sync_users(creations=creations, workers=3)
+
+    assert not success
+    assert created[3] == {"error": "exists", "sku": "u3"}
+    assert [item.get("id") for item in created] == [0, 1, 2, None, 4, 5, 6, 7, 8, 9]
+
+def test_delete_user_exception_keeps_id(monkeypatch):
+    class FailingApi:
+        def delete(self, *args, **kwargs):
+            raise ConnectionError("reset")
+    monkeypatch.setitem(vars(con), "wpapi", FailingApi())
+
+    assert wp.delete_user(7) == {"id": 7, "error": "reset"}